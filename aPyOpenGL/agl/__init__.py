@@ -8,7 +8,7 @@ from .heightmap   import Heightmap
 from .light       import Light
 from .material    import Material
 from .model       import Model
-from .motion      import Joint, Skeleton, Pose, Motion
+from .motion      import Joint, Skeleton, FrozenSkeleton, Pose, Motion, MotionDataset, EncodedMotion, KeyframedMotion, MotionDatabase
 from .render      import Render
 from .texture     import TextureType
 
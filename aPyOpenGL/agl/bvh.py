@@ -4,6 +4,7 @@ import numpy as np
 import multiprocessing as mp
 
 from .motion import Joint, Skeleton, Pose, Motion
+from .motion.resample import resample_indices, resample
 from .model  import Model
 
 from aPyOpenGL.transforms import n_euler
@@ -33,16 +34,23 @@ class BVH:
         This implementation is only for character poses with 3D root positions and 3D joint rotations.
         Therefore, joint positions and scales within the BVH file are not considered.
     !!!
+
+    If target_fps differs from the frame rate of the file, the motion is resampled while loading,
+    and frames that are not needed for the target frame rate are not parsed.
+    Set target_fps to None to keep the frame rate of the file.
     """
     def __init__(self, filename: str, target_fps=30, scale=0.01):
         self.filename = filename
         self.target_fps = target_fps
         self.scale = scale
+        self.fps = None
 
         self._cumsum_channels = 0
         self._valid_channel_idx = []
 
-        self.poses = []
+        self.skeleton = None
+        self.local_quats = None
+        self.root_pos = None
         self._load()
     
     def _load(self):
@@ -50,11 +58,12 @@ class BVH:
             print(f"{self.filename} is not a bvh file.")
             return
         
-        i = 0
         active = -1
         end_site = False
 
         skeleton = Skeleton(joints=[])
+        data_blocks = []
+        fnum, frame_idx, frame_needed, sampling = 0, 0, None, None
 
         with open(self.filename, "r") as f:
             for line in f:
@@ -120,30 +129,45 @@ class BVH:
                 fmatch = re.match("\s*Frame Time:\s+([\d\.]+)", line)
                 if fmatch:
                     frametime = float(fmatch.group(1))
-                    fps = round(1. / frametime)
-                    # if fps % self.target_fps != 0:
-                    #     raise Exception(f"Invalid target fps for {self.filename}: {self.target_fps} (fps: {fps})")
-
-                    # sampling_step = fps // self.target_fps
+                    self.fps = round(1. / frametime)
+
+                    # source frames needed for the target frame rate
+                    if self.target_fps is not None and self.target_fps != self.fps and fnum > 0:
+                        sampling = resample_indices(fnum, self.fps, self.target_fps)
+                        frame_needed = np.zeros(fnum, dtype=bool)
+                        frame_needed[sampling[0]] = True
+                        frame_needed[sampling[1]] = True
                     continue
 
-                dmatch = line.strip().split(' ')
+                dmatch = line.split()
                 if dmatch:
-                    data_block = np.array(list(map(float, dmatch)), dtype=np.float32)
-                    data_block = data_block[self._valid_channel_idx]
-
-                    root_pos = data_block[0:3] * self.scale
-                    joint_rots = data_block[3:].reshape(skeleton.num_joints, 3)
-                    local_quats = n_euler.to_quat(joint_rots, order, radians=False)
-                    self.poses.append(Pose(skeleton, local_quats, root_pos))
-                    i += 1
-
-        # self.poses = self.poses[1::sampling_step]
+                    if frame_needed is None or (frame_idx < fnum and frame_needed[frame_idx]):
+                        data_blocks.append(np.array(list(map(float, dmatch)), dtype=np.float32))
+                    frame_idx += 1
+
+        # convert all frames at once
+        data_blocks = np.stack(data_blocks, axis=0)[:, self._valid_channel_idx] # (T, 3 + 3J)
+
+        self.skeleton = skeleton
+        self.root_pos = data_blocks[:, 0:3] * self.scale
+        joint_rots = data_blocks[:, 3:].reshape(-1, skeleton.num_joints, 3)
+        self.local_quats = n_euler.to_quat(joint_rots, order, radians=False).astype(np.float32)
+
+        # resample the parsed frames
+        if sampling is not None:
+            parsed_idx = np.cumsum(frame_needed) - 1
+            idx0, idx1, t = parsed_idx[sampling[0]], parsed_idx[sampling[1]], sampling[2]
+            self.local_quats, self.root_pos = resample(self.local_quats, self.root_pos, idx0, idx1, t)
+    
+    @property
+    def poses(self):
+        return [Pose(self.skeleton, self.local_quats[i], self.root_pos[i]) for i in range(len(self.local_quats))]
     
     def motion(self):
         name = os.path.splitext(os.path.basename(self.filename))[0]
-        res = Motion(self.poses, fps=self.target_fps, name=name)
+        fps = self.fps if self.target_fps is None else self.target_fps
+        res = Motion.from_numpy(self.skeleton, self.local_quats, self.root_pos, fps=fps, name=name)
         return res
     
     def model(self):
-        return Model(meshes=None, skeleton=self.poses[0].skeleton)
\ No newline at end of file
+        return Model(meshes=None, skeleton=self.skeleton)
\ No newline at end of file
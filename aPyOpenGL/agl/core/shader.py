@@ -62,6 +62,9 @@ class Shader:
         # transpose because glm is column-major while numpy is row-major
         if len(values) == 0:
             return np.array([], dtype=np.float32).ctypes.data_as(ctypes.POINTER(ctypes.c_float))
+        if isinstance(values, np.ndarray):
+            float_array = np.ascontiguousarray(np.swapaxes(values, -1, -2), dtype=np.float32).ravel()
+            return float_array.ctypes.data_as(ctypes.POINTER(ctypes.c_float))
         float_array = np.concatenate([np.asarray(value, dtype=np.float32).transpose().flatten() for value in values])
         return float_array.ctypes.data_as(ctypes.POINTER(ctypes.c_float))
 
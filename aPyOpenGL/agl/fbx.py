@@ -10,7 +10,7 @@ import pickle
 from tqdm import tqdm
 
 from . import core
-from .motion   import Skeleton, Pose, Motion
+from .motion   import Skeleton, Motion
 from .material import Material
 from .model    import Model
 from .texture  import TextureType, TextureLoader
@@ -163,11 +163,7 @@ class Parser:
         # create motion
         motion_set = []
         for rot, pos in rotations_and_positions:
-            poses = []
-            for i in range(len(rot)):
-                poses.append(Pose(skeleton, local_quats=rot[i], root_pos=pos[i]))
-            
-            motion = Motion(poses, fps=self.parser.get_scene_fps(), name=self.parser.filepath)
+            motion = Motion.from_numpy(skeleton, rot, pos, fps=self.parser.get_scene_fps(), name=self.parser.filepath)
             motion_set.append(motion)
         
         if len(motion_set) > 0:
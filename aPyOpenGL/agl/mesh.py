@@ -1,27 +1,44 @@
 from __future__ import annotations
 from OpenGL.GL import *
-import glm
 import copy
+import numpy as np
 
-from .motion import Skeleton, Pose
+from .motion import Skeleton, FrozenSkeleton, Pose
 from .core   import MeshGL
 
+class _CompiledJointMap:
+    """
+    Joint map resolved into index arrays for a source skeleton, so that the skinning buffer is
+        buffer = global_xforms[src_idx] @ bind_xforms_inv
+    followed by identity matrices for the mesh joints that are not driven by any source joint.
+
+    Attributes:
+        src_idx         (np.ndarray): (M,) source joint index of each mesh joint
+        bind_xforms_inv (np.ndarray): (M, 4, 4) inverse bind transformation applied to each mesh joint
+        identity        (np.ndarray): (M,) mask of the mesh joints left as identity
+    """
+    def __init__(self, src_idx, bind_idx, bind_xforms_inv):
+        self.identity = (src_idx < 0)
+        self.src_idx = np.where(self.identity, 0, src_idx)
+        self.bind_xforms_inv = bind_xforms_inv[np.maximum(bind_idx, 0)]
+
+
 class Mesh:
     def __init__(
         self,
         mesh_gl: MeshGL,
         materials    = None,
-        skeleton: Skeleton = None,
+        skeleton: Skeleton | FrozenSkeleton = None,
         joint_map: dict[str, str] = None,
     ):
         self.mesh_gl      = mesh_gl
         self.materials    = materials
 
         # skinning
-        self.skeleton     = skeleton
+        self.skeleton     = skeleton.freeze() if skeleton is not None else None
         self.joint_map    = joint_map
         self.use_skinning = (skeleton is not None)
-        self.buffer       = [glm.mat4(1.0)] * len(self.mesh_gl.joint_names)
+        self.buffer       = np.tile(np.identity(4, dtype=np.float32), (len(self.mesh_gl.joint_names), 1, 1)) # (M, 4, 4)
 
         if self.skeleton is None and self.joint_map is not None:
             raise ValueError("Joint map requires a skeleton")
@@ -32,50 +49,75 @@ class Mesh:
         memo[id(self)] = res
         return res
 
+    @property
+    def joint_map(self):
+        return self.__joint_map
+
+    @joint_map.setter
+    def joint_map(self, joint_map: dict[str, str]):
+        self.__joint_map = joint_map
+        self.__compiled: dict = {} # compiled joint maps by source skeleton
+
     def set_materials(self, materials):
         self.materials = materials
 
+    def compile_joint_map(self, skeleton) -> _CompiledJointMap:
+        """
+        Resolves the joint map for poses of the given source skeleton.
+        This is done once per source skeleton, and `update_mesh` reuses the result for every frame.
+        """
+        skeleton = skeleton.freeze()
+        compiled = self.__compiled.get(skeleton, None)
+        if compiled is None:
+            if self.__joint_map is None:
+                compiled = self.__compile_without_joint_map()
+            else:
+                compiled = self.__compile_with_joint_map(skeleton)
+            self.__compiled[skeleton] = compiled
+        return compiled
+
     def update_mesh(self, pose: Pose):
         if self.skeleton is None:
             return
-        
-        self.buffer = [glm.mat4(1.0) for _ in range(len(self.mesh_gl.joint_names))]
-        if self.joint_map is None:
-            self._update_without_joint_map(pose)
-        else:
-            self._update_with_joint_map(pose)
-
-    
-    def _update_with_joint_map(self, pose: Pose):
-        global_xforms = pose.global_xforms
-        buffer_updated = [False for _ in range(len(self.mesh_gl.joint_names))]
-        for i in range(len(pose.skeleton.joints)):
-            # get joint names
-            src_jname = pose.skeleton.joints[i].name
-            tgt_jname = self.joint_map.get(src_jname, None)
-            if tgt_jname is None:
-                continue
-            tgt_idx = self.mesh_gl.name_to_idx.get(tgt_jname, None)
+
+        compiled = self.compile_joint_map(pose.skeleton)
+        global_xforms = pose.global_xforms # (J, 4, 4)
+        np.matmul(global_xforms[compiled.src_idx], compiled.bind_xforms_inv, out=self.buffer)
+        self.buffer[compiled.identity] = np.identity(4, dtype=np.float32)
+
+    def __bind_xforms_inv(self):
+        if len(self.mesh_gl.bind_xform_inv) == 0:
+            return np.zeros((0, 4, 4), dtype=np.float32)
+        return np.stack([np.asarray(xform, dtype=np.float32) for xform in self.mesh_gl.bind_xform_inv], axis=0) # (M, 4, 4)
+
+    def __compile_with_joint_map(self, src_skeleton) -> _CompiledJointMap:
+        num_mesh_joints = len(self.mesh_gl.joint_names)
+
+        # (source joint, inverse bind index) of each mesh joint, where later source joints overwrite earlier ones
+        src_idx = np.full(num_mesh_joints, -1, dtype=np.int64)
+        bind_idx = np.full(num_mesh_joints, -1, dtype=np.int64)
+        for i, src_joint in enumerate(src_skeleton.joints):
+            tgt_jname = self.__joint_map.get(src_joint.name, None)
+            tgt_idx = self.mesh_gl.name_to_idx.get(tgt_jname, None) if tgt_jname is not None else None
             if tgt_idx is None:
                 continue
+            src_idx[tgt_idx] = i
+            bind_idx[tgt_idx] = tgt_idx
+
+        # unmapped mesh joints follow their parents in the mesh skeleton, resolved in the mesh joint order
+        mapped = (src_idx >= 0)
+        for i in np.nonzero(~mapped)[0]:
+            jidx = self.skeleton.idx_by_name.get(self.mesh_gl.joint_names[i], None)
+            if jidx is None or self.skeleton.parent_idx[jidx] < 0:
+                continue
+            pjoint_name = self.skeleton.joints[self.skeleton.parent_idx[jidx]].name
+            pidx = self.mesh_gl.name_to_idx.get(pjoint_name, None)
+            if pidx is not None:
+                src_idx[i], bind_idx[i] = src_idx[pidx], bind_idx[pidx]
+
+        return _CompiledJointMap(src_idx, bind_idx, self.__bind_xforms_inv())
 
-            # map global xform
-            global_xform = glm.mat4(*global_xforms[i].T.ravel())
-            bind_xform_inv = self.mesh_gl.bind_xform_inv[tgt_idx]
-            self.buffer[tgt_idx] = global_xform * bind_xform_inv
-            buffer_updated[tgt_idx] = True
-
-        for i, updated in enumerate(buffer_updated):
-            if not updated:
-                jname = self.mesh_gl.joint_names[i]
-                parent_idx = self.skeleton.parent_idx[self.skeleton.idx_by_name[jname]]
-                pjoint_name = self.skeleton.joints[parent_idx].name
-                self.buffer[i] = self.buffer[self.mesh_gl.name_to_idx[pjoint_name]]
-
-    def _update_without_joint_map(self, pose: Pose):
-        global_xforms = pose.global_xforms
-        for i in range(len(self.mesh_gl.joint_names)):
-            jidx = self.skeleton.idx_by_name[self.mesh_gl.joint_names[i]]
-            global_xform = glm.mat4(*global_xforms[jidx].T.ravel())
-            bind_xform_inv = self.mesh_gl.bind_xform_inv[i]
-            self.buffer[i] = global_xform * bind_xform_inv
\ No newline at end of file
+    def __compile_without_joint_map(self) -> _CompiledJointMap:
+        src_idx = np.array([self.skeleton.idx_by_name[jname] for jname in self.mesh_gl.joint_names], dtype=np.int64)
+        bind_idx = np.arange(len(self.mesh_gl.joint_names), dtype=np.int64)
+        return _CompiledJointMap(src_idx, bind_idx, self.__bind_xforms_inv())
\ No newline at end of file
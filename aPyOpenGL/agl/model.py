@@ -3,14 +3,14 @@ from OpenGL.GL import *
 
 from .core import MeshGL
 from .material import Material
-from .motion import Skeleton, Pose
+from .motion import Skeleton, FrozenSkeleton, Pose
 from .mesh import Mesh
 
 class Model:
     def __init__(
         self,
         meshes: list[tuple[MeshGL, Material]] = None,
-        skeleton: Skeleton = None,
+        skeleton: Skeleton | FrozenSkeleton = None,
         joint_map: dict[str, str] = None,
     ):
         if meshes is None and skeleton is None:
@@ -18,7 +18,7 @@ class Model:
         if skeleton is None and joint_map is not None:
             raise ValueError("Joint map requires a skeleton")
         
-        self.skeleton = skeleton
+        self.skeleton = skeleton.freeze() if skeleton is not None else None
         self.meshes = [Mesh(meshes[i][0], meshes[i][1], skeleton=skeleton, joint_map=joint_map) for i in range(len(meshes))] if meshes is not None else []
     
     def set_identity_joint_map(self):
@@ -27,9 +27,15 @@ class Model:
         joint_map = {joint.name: joint.name for joint in self.skeleton.joints}
         self.set_joint_map(joint_map)
 
-    def set_joint_map(self, joint_map: dict[str, str]):
+    def set_joint_map(self, joint_map: dict[str, str], src_skeleton: Skeleton | FrozenSkeleton = None):
+        """
+        Sets the map from source joint names to mesh joint names.
+        The map is compiled into index arrays once per source skeleton, on the first pose of that skeleton or here if given.
+        """
         for mesh in self.meshes:
             mesh.joint_map = joint_map
+            if src_skeleton is not None and mesh.skeleton is not None:
+                mesh.compile_joint_map(src_skeleton)
 
     def set_pose(self, pose: Pose):
         for mesh in self.meshes:
@@ -1,4 +1,8 @@
 from .joint import Joint
-from .skeleton import Skeleton
+from .skeleton import Skeleton, FrozenSkeleton
 from .pose import Pose
-from .motion import Motion
\ No newline at end of file
+from .motion import Motion
+from .dataset import MotionDataset
+from .codec import EncodedMotion
+from .keyframe import KeyframedMotion
+from .matching import MotionDatabase
\ No newline at end of file
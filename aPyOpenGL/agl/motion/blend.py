@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import numpy as np
+
+from aPyOpenGL.transforms import n_quat
+
+"""
+Root alignment and blending of motion arrays.
+The world up axis is y, and the root faces +z when its local rotation is identity.
+"""
+def headings(skeleton, root_quats):
+    """
+    Heading angles of the root around the y-axis.
+
+    Args:
+        skeleton:   skeleton of the motion
+        root_quats: (..., 4) local rotations of the root
+    Returns:
+        headings:   (...,) angles in radians, 0 when the root faces +z
+    """
+    pre_quat = skeleton.pre_quats[0]
+    forward = n_quat.mul_vec(n_quat.inv(pre_quat), np.array([0, 0, 1], dtype=np.float32)) # forward in the root's local frame
+    global_quats = n_quat.mul(pre_quat, root_quats)
+    forward = n_quat.mul_vec(global_quats, np.broadcast_to(forward, global_quats.shape[:-1] + (3,)))
+    return np.arctan2(forward[..., 0], forward[..., 2])
+
+
+def align(skeleton, local_quats, root_pos, frame, target_pos, target_heading):
+    """
+    Rotates a motion around the y-axis and translates it on the xz-plane,
+    so that the root at `frame` is at the horizontal target position and faces the target heading.
+    The height of the root is not changed.
+
+    Args:
+        local_quats:    (T, J, 4)
+        root_pos:       (T, 3)
+        frame:          frame to align
+        target_pos:     (3,) target root position, only x and z are used
+        target_heading: target heading angle in radians
+    Returns:
+        aligned local_quats (T, J, 4) and root_pos (T, 3)
+    """
+    delta = target_heading - headings(skeleton, local_quats[frame, 0])
+    delta_quat = n_quat.from_aaxis(np.array([0, delta, 0], dtype=np.float32))
+
+    # global root rotation: delta * pre * local = pre * (pre^-1 * delta * pre) * local
+    pre_quat = skeleton.pre_quats[0]
+    local_delta = n_quat.mul(n_quat.inv(pre_quat), n_quat.mul(delta_quat, pre_quat))
+
+    local_quats = local_quats.copy()
+    local_quats[:, 0] = n_quat.mul(local_delta, local_quats[:, 0])
+
+    xz = np.array([1, 0, 1], dtype=np.float32)
+    offset = (root_pos - root_pos[frame] * xz).astype(np.float32)
+    root_pos = n_quat.mul_vec(delta_quat, offset) + np.asarray(target_pos, dtype=np.float32) * xz
+
+    return local_quats, root_pos.astype(np.float32)
+
+
+def blend(local_quats0, root_pos0, local_quats1, root_pos1, weights):
+    """
+    Slerps local rotations and lerps root positions of two motions of the same length.
+
+    Args:
+        local_quats0, local_quats1: (T, J, 4)
+        root_pos0, root_pos1:       (T, 3)
+        weights: weights of the second motion, either a float, (T,) or (T, J) where the root position uses the weights of the root
+    Returns:
+        local_quats (T, J, 4) and root_pos (T, 3)
+    """
+    nof, noj = local_quats0.shape[:2]
+    weights = np.asarray(weights, dtype=np.float32)
+    if weights.ndim == 0:
+        weights = np.full((nof, 1), weights, dtype=np.float32)
+    elif weights.ndim == 1:
+        weights = weights[:, None]
+    weights = np.broadcast_to(weights, (nof, weights.shape[-1]))
+    if weights.shape[-1] not in (1, noj):
+        raise ValueError(f"weights must be a float, (T,) or (T, J), but got {weights.shape}.")
+
+    local_quats = n_quat.slerp(local_quats0, local_quats1, weights) # (T, J, 4)
+    root_pos = root_pos0 + (root_pos1 - root_pos0) * weights[:, 0:1] # (T, 3)
+    return local_quats.astype(np.float32), root_pos.astype(np.float32)
@@ -0,0 +1,216 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+import numpy as np
+
+from aPyOpenGL.transforms import n_quat
+from .skeleton import _global_xforms_to_skeleton_xforms
+
+CHUNK_SIZE = 256
+MAX_CHUNKS = 64
+
+class _Chunk:
+    def __init__(self, start, stop):
+        self.start = start
+        self.stop = stop
+        self.global_xforms = None
+        self.skeleton_xforms = None
+        self.stale = np.zeros(stop - start, dtype=bool)
+
+
+class GlobalXformCache:
+    """
+    Lazily evaluated global and skeleton transformations of a motion.
+    Frames are evaluated in chunks of `chunk_size` frames on first access,
+    and at most `max_chunks` chunks are kept in memory (least recently used ones are evicted).
+
+    Attributes:
+        skeleton    (Skeleton)     : The skeleton of the motion.
+        local_quats (numpy.ndarray): Local rotations of all frames. (T, J, 4)
+        root_pos    (numpy.ndarray): Root positions of all frames. (T, 3)
+        chunk_size  (int)          : Number of frames evaluated at once.
+        max_chunks  (int)          : Maximum number of chunks kept in memory.
+    """
+    def __init__(self, skeleton, local_quats, root_pos, chunk_size=CHUNK_SIZE, max_chunks=MAX_CHUNKS):
+        if chunk_size < 1 or max_chunks < 1:
+            raise ValueError(f"chunk_size and max_chunks must be positive, but got {chunk_size} and {max_chunks}.")
+
+        self.skeleton    = skeleton
+        self.local_quats = local_quats
+        self.root_pos    = root_pos
+        self.chunk_size  = int(chunk_size)
+        self.max_chunks  = int(max_chunks)
+        self.__chunks: OrderedDict[int, _Chunk] = OrderedDict()
+
+    @property
+    def num_frames(self):
+        return self.local_quats.shape[0]
+
+    @property
+    def num_cached_frames(self):
+        return sum(chunk.stop - chunk.start for chunk in self.__chunks.values())
+
+    def global_xforms(self, frames=slice(None)):
+        return self.__gather(frames, skeleton=False)
+
+    def skeleton_xforms(self, frames=slice(None)):
+        return self.__gather(frames, skeleton=True)
+
+    def invalidate(self, frames=slice(None)):
+        """
+        Marks the given frames to be re-evaluated on the next access.
+        """
+        if isinstance(frames, slice) and frames == slice(None):
+            self.__chunks.clear()
+            return
+
+        frames = np.arange(self.num_frames)[frames].reshape(-1)
+        for cidx in np.unique(frames // self.chunk_size):
+            chunk = self.__chunks.get(int(cidx), None)
+            if chunk is not None:
+                in_chunk = frames[(frames >= chunk.start) & (frames < chunk.stop)]
+                chunk.stale[in_chunk - chunk.start] = True
+
+    def clear(self):
+        self.__chunks.clear()
+
+    def resize(self, chunk_size=CHUNK_SIZE, max_chunks=MAX_CHUNKS):
+        if chunk_size < 1 or max_chunks < 1:
+            raise ValueError(f"chunk_size and max_chunks must be positive, but got {chunk_size} and {max_chunks}.")
+        self.chunk_size = int(chunk_size)
+        self.max_chunks = int(max_chunks)
+        self.__chunks.clear()
+
+    def view(self, start, step, num_frames):
+        return GlobalXformCacheView(self, start, step, num_frames)
+
+    def __gather(self, frames, skeleton):
+        # single frame
+        if np.isscalar(frames):
+            frame = int(frames)
+            chunk = self.__chunk(frame // self.chunk_size, skeleton)
+            res = chunk.skeleton_xforms if skeleton else chunk.global_xforms
+            return res[frame - chunk.start]
+
+        # contiguous range in a single chunk: zero-copy view of the chunk
+        if isinstance(frames, slice):
+            start, stop, step = frames.indices(self.num_frames)
+            if step == 1 and stop > start and (start // self.chunk_size) == ((stop - 1) // self.chunk_size):
+                chunk = self.__chunk(start // self.chunk_size, skeleton)
+                res = chunk.skeleton_xforms if skeleton else chunk.global_xforms
+                return res[start - chunk.start:stop - chunk.start]
+
+        # otherwise, gather from multiple chunks
+        frames = np.arange(self.num_frames)[frames]
+        noj = self.skeleton.num_joints
+        res = np.empty(frames.shape + ((noj - 1) if skeleton else noj, 4, 4), dtype=np.float32)
+        chunk_idx = frames // self.chunk_size
+        for cidx in np.unique(chunk_idx):
+            mask = (chunk_idx == cidx)
+            chunk = self.__chunk(int(cidx), skeleton)
+            src = chunk.skeleton_xforms if skeleton else chunk.global_xforms
+            res[mask] = src[frames[mask] - chunk.start]
+        return res
+
+    def __chunk(self, cidx, skeleton):
+        chunk = self.__chunks.get(cidx, None)
+        if chunk is None:
+            start = cidx * self.chunk_size
+            stop  = min(start + self.chunk_size, self.num_frames)
+            chunk = _Chunk(start, stop)
+            chunk.global_xforms = self.__eval_global(start, stop)
+
+            # evict the least recently used chunks
+            self.__chunks[cidx] = chunk
+            while len(self.__chunks) > self.max_chunks:
+                self.__chunks.popitem(last=False)
+        else:
+            self.__chunks.move_to_end(cidx)
+
+            # re-evaluate stale frames only
+            if chunk.stale.any():
+                stale = np.nonzero(chunk.stale)[0]
+                chunk.global_xforms[stale] = self.__eval_global(chunk.start + stale, None)
+                if chunk.skeleton_xforms is not None:
+                    chunk.skeleton_xforms[stale] = _global_xforms_to_skeleton_xforms(chunk.global_xforms[stale], self.skeleton.parent_idx)
+                chunk.stale[:] = False
+
+        if skeleton and chunk.skeleton_xforms is None:
+            chunk.skeleton_xforms = _global_xforms_to_skeleton_xforms(chunk.global_xforms, self.skeleton.parent_idx)
+
+        return chunk
+
+    def __eval_global(self, start, stop):
+        frames = slice(start, stop) if stop is not None else start
+        gq, gp = n_quat.fk(self.local_quats[frames], self.root_pos[frames], self.skeleton)
+        gx = np.empty(gq.shape[:-1] + (4, 4), dtype=np.float32)
+        n_quat.to_rotmat(gq, out=gx[..., :3, :3])
+        gx[..., :3,  3] = gp
+        gx[..., 3, :] = np.array([0, 0, 0, 1], dtype=np.float32)
+        return gx
+
+
+class GlobalXformCacheView:
+    """
+    Strided range of frames of a GlobalXformCache, used by motion views.
+    Frames are mapped to `start + step * frame` of the base cache,
+    so that the views share the evaluated chunks with the motion they come from.
+
+    Attributes:
+        base  (GlobalXformCache): The cache that owns the evaluated frames.
+        start (int)             : The first frame in the base cache.
+        step  (int)             : The stride in the base cache.
+    """
+    def __init__(self, base: GlobalXformCache, start, step, num_frames):
+        self.base = base
+        self.start = int(start)
+        self.step = int(step)
+        self.__num_frames = int(num_frames)
+
+    @property
+    def num_frames(self):
+        return self.__num_frames
+
+    @property
+    def num_cached_frames(self):
+        return self.base.num_cached_frames
+
+    @property
+    def chunk_size(self):
+        return self.base.chunk_size
+
+    @property
+    def max_chunks(self):
+        return self.base.max_chunks
+
+    def global_xforms(self, frames=slice(None)):
+        return self.base.global_xforms(self.base_frames(frames))
+
+    def skeleton_xforms(self, frames=slice(None)):
+        return self.base.skeleton_xforms(self.base_frames(frames))
+
+    def invalidate(self, frames=slice(None)):
+        self.base.invalidate(self.base_frames(frames))
+
+    def clear(self):
+        self.base.invalidate(self.base_frames(slice(None)))
+
+    def resize(self, chunk_size=CHUNK_SIZE, max_chunks=MAX_CHUNKS):
+        self.base.resize(chunk_size, max_chunks)
+
+    def base_frames(self, frames):
+        """
+        Frame indices of this view in the base cache, keeping slices as slices when possible.
+        """
+        if np.isscalar(frames):
+            return self.start + self.step * (int(frames) % self.__num_frames)
+
+        if isinstance(frames, slice):
+            start, stop, step = frames.indices(self.__num_frames)
+            if self.step > 0 and step > 0 and stop > start:
+                return slice(self.start + self.step * start, self.start + self.step * stop, self.step * step)
+
+        return self.start + self.step * np.arange(self.__num_frames)[frames]
+
+    def view(self, start, step, num_frames):
+        return GlobalXformCacheView(self.base, self.start + self.step * start, self.step * step, num_frames)
@@ -0,0 +1,266 @@
+from __future__ import annotations
+
+import zlib
+import numpy as np
+
+"""
+Compact codec for motion arrays.
+
+Rotations are quantized with the smallest-three encoding: the largest component of a unit quaternion
+is dropped (after flipping the quaternion so that it is positive), and the other three, which lie in [-1/sqrt(2), 1/sqrt(2)],
+are quantized uniformly together with the 2-bit index of the dropped component.
+    32 bits: 10 bits per component, packed into a uint32.               Max angular error 0.26 degrees.
+    48 bits: 15 bits per component, packed into three uint16 values.    Max angular error 0.008 degrees.
+The angular error is the angle of the rotation between the original and the decoded quaternion
+(see MAX_ANGULAR_ERROR, measured over 10^7 random rotations and rounded up).
+
+Root positions are stored as float16 offsets from the root position of the first frame, which is kept in float32.
+The error is at most 2^-11 of the distance from the first frame, e.g. 0.5 cm at 10 m.
+
+Optionally, the encoded frames are compressed with zlib in blocks of frames, so that a range of frames
+can be decoded without decompressing the whole motion.
+"""
+QUAT_BITS = (32, 48)
+MAX_ANGULAR_ERROR = {
+    32: np.deg2rad(0.26),
+    48: np.deg2rad(0.008),
+}
+BLOCK_SIZE = 256
+
+# indices of the three stored components for each dropped component
+_REST_IDX = np.array([
+    [1, 2, 3],
+    [0, 2, 3],
+    [0, 1, 3],
+    [0, 1, 2],
+], dtype=np.int64)
+_SQRT2 = np.sqrt(2.0)
+
+def _component_bits(bits):
+    if bits not in QUAT_BITS:
+        raise ValueError(f"Quaternion bits must be one of {QUAT_BITS}, but got {bits}.")
+    return 10 if bits == 32 else 15
+
+
+def code_shape(bits):
+    """
+    Shape and dtype of the code of a quaternion.
+    """
+    return ((), np.uint32) if _component_bits(bits) == 10 else ((3,), np.uint16)
+
+
+def encode_quats(quats, bits=32):
+    """
+    Args:
+        quats: (..., 4) quaternions, normalized before quantization
+        bits:  32 or 48
+    Returns:
+        codes: (...) uint32 for 32 bits, (..., 3) uint16 for 48 bits
+    """
+    nb = _component_bits(bits)
+    levels = (1 << nb) - 1
+
+    q = np.asarray(quats, dtype=np.float64)
+    q = q / np.linalg.norm(q, axis=-1, keepdims=True)
+
+    largest = np.argmax(np.abs(q), axis=-1) # (...)
+    sign = np.where(np.take_along_axis(q, largest[..., None], axis=-1) < 0, -1.0, 1.0)
+    rest = np.take_along_axis(q, _REST_IDX[largest], axis=-1) * sign # (..., 3)
+
+    u = np.rint((rest * _SQRT2 + 1.0) * (0.5 * levels))
+    u = np.clip(u, 0, levels).astype(np.uint32)
+
+    if nb == 10:
+        return (largest.astype(np.uint32) << 30) | (u[..., 0] << 20) | (u[..., 1] << 10) | u[..., 2]
+
+    # the index of the dropped component goes to the top bits of the first two values
+    largest = largest.astype(np.uint32)
+    u[..., 0] |= (largest >> 1) << 15
+    u[..., 1] |= (largest & 1) << 15
+    return u.astype(np.uint16)
+
+
+def decode_quats(codes, bits=32):
+    """
+    Args:
+        codes: output of encode_quats()
+        bits:  32 or 48
+    Returns:
+        quats: (..., 4) float32 unit quaternions
+    """
+    nb = _component_bits(bits)
+    levels = (1 << nb) - 1
+    mask = np.uint32(levels)
+
+    if nb == 10:
+        codes = np.asarray(codes, dtype=np.uint32)
+        largest = (codes >> 30).astype(np.int64)
+        u = np.stack([(codes >> 20) & mask, (codes >> 10) & mask, codes & mask], axis=-1)
+    else:
+        codes = np.asarray(codes, dtype=np.uint16).astype(np.uint32)
+        largest = (((codes[..., 0] >> 15) << 1) | (codes[..., 1] >> 15)).astype(np.int64)
+        u = codes & mask
+
+    rest = (u.astype(np.float32) * np.float32(2.0 / levels) - 1.0) / np.float32(_SQRT2) # (..., 3)
+    w = np.sqrt(np.maximum(1.0 - np.sum(rest * rest, axis=-1, keepdims=True), 0.0))
+
+    res = np.empty(rest.shape[:-1] + (4,), dtype=np.float32)
+    np.put_along_axis(res, _REST_IDX[largest], rest, axis=-1)
+    np.put_along_axis(res, largest[..., None], w, axis=-1)
+    res /= np.linalg.norm(res, axis=-1, keepdims=True)
+    return res
+
+
+def encode_root_pos(root_pos):
+    """
+    Args:
+        root_pos: (T, 3)
+    Returns:
+        start: (3,) float32 root position of the first frame
+        delta: (T, 3) float16 offsets from the first frame
+    """
+    root_pos = np.asarray(root_pos, dtype=np.float32)
+    return root_pos[0].copy(), (root_pos - root_pos[0]).astype(np.float16)
+
+
+def decode_root_pos(start, delta):
+    return np.asarray(delta, dtype=np.float32) + np.asarray(start, dtype=np.float32)
+
+
+def compress_blocks(arrays, block_size=BLOCK_SIZE, level=6):
+    """
+    Compresses frame-major arrays with zlib, `block_size` frames at a time.
+
+    Args:
+        arrays: list of arrays with the same number of frames in the first axis
+    Returns:
+        list of bytes, one per block
+    """
+    nof = len(arrays[0])
+    return [
+        zlib.compress(b"".join(np.ascontiguousarray(array[start:start + block_size]).tobytes() for array in arrays), level)
+        for start in range(0, nof, block_size)
+    ]
+
+
+def decompress_blocks(blocks, specs, num_frames, block_size=BLOCK_SIZE, start=0, stop=None):
+    """
+    Decompresses the blocks that cover frames [start, stop).
+
+    Args:
+        blocks: output of compress_blocks()
+        specs:  list of (shape without the frame axis, dtype) of each array
+    Returns:
+        list of arrays of frames [start, stop)
+    """
+    stop = num_frames if stop is None else stop
+    first, last = start // block_size, (stop - 1) // block_size
+
+    parts = [[] for _ in specs]
+    for b in range(first, last + 1):
+        data = zlib.decompress(blocks[b])
+        nof = min(block_size, num_frames - b * block_size)
+        pos = 0
+        for i, (shape, dtype) in enumerate(specs):
+            count = nof * int(np.prod(shape, dtype=np.int64))
+            parts[i].append(np.frombuffer(data, dtype=dtype, count=count, offset=pos).reshape((nof,) + tuple(shape)))
+            pos += count * np.dtype(dtype).itemsize
+
+    lo = start - first * block_size
+    return [np.concatenate(part, axis=0)[lo:lo + stop - start] for part in parts]
+
+
+class EncodedMotion:
+    """
+    Motion in the compact codec. Keeps only the encoded frames, e.g. for archival or streaming playback,
+    and decodes frames on demand.
+
+    Attributes:
+        skeleton    (FrozenSkeleton): The skeleton of the motion.
+        bits        (int)           : Bits per quaternion, 32 or 48.
+        level       (int)           : zlib compression level, or None if the frames are not compressed.
+        block_size  (int)           : The number of frames per compressed block.
+        fps         (float)         : The number of frames per second.
+        name        (str)           : The name of the motion.
+    """
+    def __init__(self, skeleton, local_quats, root_pos, fps=30.0, name="default", bits=32, level=None, block_size=BLOCK_SIZE):
+        self.__skeleton   = skeleton.freeze()
+        self.__bits       = bits
+        self.__level      = level
+        self.__block_size = block_size
+        self.__num_frames = len(local_quats)
+        self.fps          = fps
+        self.name         = name
+
+        codes = encode_quats(local_quats, bits) # (T, J) or (T, J, 3)
+        self.__root_start, root_delta = encode_root_pos(root_pos)
+
+        if level is None:
+            self.__codes, self.__root_delta, self.__blocks = codes, root_delta, None
+        else:
+            self.__codes, self.__root_delta = None, None
+            self.__blocks = compress_blocks([codes, root_delta], block_size, level)
+
+
+    @classmethod
+    def from_motion(cls, motion, bits=32, level=None, block_size=BLOCK_SIZE):
+        return cls(motion.skeleton, motion.local_quats, motion.root_pos, motion.fps, motion.name, bits, level, block_size)
+
+
+    @property
+    def skeleton(self):
+        return self.__skeleton
+
+    @property
+    def num_frames(self):
+        return self.__num_frames
+
+    @property
+    def bits(self):
+        return self.__bits
+
+    @property
+    def level(self):
+        return self.__level
+
+    @property
+    def block_size(self):
+        return self.__block_size
+
+    @property
+    def nbytes(self):
+        """
+        Size of the encoded frames in bytes.
+        """
+        if self.__blocks is not None:
+            return sum(len(block) for block in self.__blocks) + self.__root_start.nbytes
+        return self.__codes.nbytes + self.__root_delta.nbytes + self.__root_start.nbytes
+
+
+    def decode(self, start=0, stop=None):
+        """
+        Decodes frames [start, stop).
+
+        Returns:
+            local_quats: (T', J, 4)
+            root_pos:    (T', 3)
+        """
+        start, stop, _ = slice(start, stop).indices(self.__num_frames)
+        if stop <= start:
+            raise ValueError(f"Cannot decode an empty range of frames [{start}, {stop}).")
+
+        if self.__blocks is None:
+            codes, root_delta = self.__codes[start:stop], self.__root_delta[start:stop]
+        else:
+            shape, dtype = code_shape(self.__bits)
+            specs = [((self.__skeleton.num_joints,) + shape, dtype), ((3,), np.float16)]
+            codes, root_delta = decompress_blocks(self.__blocks, specs, self.__num_frames, self.__block_size, start, stop)
+
+        return decode_quats(codes, self.__bits), decode_root_pos(self.__root_start, root_delta)
+
+
+    def to_motion(self, start=0, stop=None):
+        from .motion import Motion
+
+        local_quats, root_pos = self.decode(start, stop)
+        return Motion.from_numpy(self.__skeleton, local_quats, root_pos, self.fps, self.name)
@@ -0,0 +1,308 @@
+from __future__ import annotations
+from typing import Union
+
+import numpy as np
+
+from .skeleton import Skeleton, FrozenSkeleton
+from .motion import Motion
+from . import store
+
+from aPyOpenGL.transforms import n_quat
+from aPyOpenGL.ops import motionops, featureops
+
+
+def _readonly(array):
+    view = array.view()
+    view.flags.writeable = False
+    return view
+
+
+class MotionDataset:
+    """
+    Clips of a shared skeleton packed into contiguous buffers.
+    Frames of clip i are local_quats[offsets[i]:offsets[i+1]], so that dataset-wide operations
+    run on the whole buffer at once instead of looping over clips.
+
+    A dataset opened from a store in the compact codec keeps only the encoded frames (see store.EncodedFrames).
+    Clips, windows and fk() of some frames decode only those frames, while the buffer properties
+    and the dataset-wide operations (features(), contacts(), mirror(), scaled()) decode all frames on each call.
+
+    Attributes:
+        skeleton    (FrozenSkeleton): The skeleton shared by all clips.
+        local_quats (numpy.ndarray) : Local rotations of all frames. (ΣT, J, 4)
+        root_pos    (numpy.ndarray) : Root positions of all frames. (ΣT, 3)
+        offsets     (numpy.ndarray) : Start frame of each clip and the total number of frames. (N+1,)
+        names       (tuple[str])    : Name of each clip.
+        fps         (numpy.ndarray) : Frame rate of each clip. (N,)
+    """
+    def __init__(
+        self,
+        skeleton: Union[Skeleton, FrozenSkeleton],
+        local_quats: np.ndarray,
+        root_pos: np.ndarray,
+        offsets: np.ndarray,
+        names: list[str] = None,
+        fps: Union[float, np.ndarray] = 30.0,
+    ):
+        self.__skeleton    = skeleton.freeze()
+        self.__local_quats = np.ascontiguousarray(local_quats, dtype=np.float32)
+        self.__root_pos    = np.ascontiguousarray(root_pos, dtype=np.float32)
+        self.__encoded     = None
+
+        nof = self.__local_quats.shape[0]
+        if self.__local_quats.shape != (nof, self.__skeleton.num_joints, 4):
+            raise ValueError(f"Local quaternions must be of shape (ΣT, {self.__skeleton.num_joints}, 4), but got {self.__local_quats.shape}.")
+        if self.__root_pos.shape != (nof, 3):
+            raise ValueError(f"Root positions must be of shape ({nof}, 3), but got {self.__root_pos.shape}.")
+        self.__setup_clips(offsets, names, fps, nof)
+
+
+    def __setup_clips(self, offsets, names, fps, nof):
+        self.__offsets = np.asarray(offsets, dtype=np.int64).reshape(-1)
+        noc = len(self.__offsets) - 1
+        if noc < 0 or self.__offsets[0] != 0 or self.__offsets[-1] != nof or np.any(np.diff(self.__offsets) < 0):
+            raise ValueError(f"Offsets must increase from 0 to the number of frames {nof}.")
+
+        self.__names = tuple(f"clip_{i}" for i in range(noc)) if names is None else tuple(names)
+        self.__fps   = np.broadcast_to(np.asarray(fps, dtype=np.float32), (noc,)).copy()
+        if len(self.__names) != noc:
+            raise ValueError(f"Number of names {len(self.__names)} must be the number of clips {noc}.")
+
+        # clip index of each frame, computed on first use so that opening a memory-mapped store does not allocate per-frame arrays
+        self.__clip_idx = None
+
+
+    @classmethod
+    def _from_encoded(cls, skeleton, frames: store.EncodedFrames, names=None, fps=30.0):
+        """
+        Dataset on the encoded frames of a store, decoded on demand.
+        """
+        dataset = cls.__new__(cls)
+        dataset.__skeleton = skeleton.freeze()
+        dataset.__local_quats, dataset.__root_pos = None, None
+        dataset.__encoded = frames
+        dataset.__setup_clips(frames.offsets, names, fps, frames.num_frames)
+        return dataset
+
+
+    def __frames(self, frames=slice(None)):
+        # local rotations and root positions of the given frames, decoded if the dataset is encoded
+        if self.__encoded is not None:
+            return self.__encoded.decode(frames)
+        return self.__local_quats[frames], self.__root_pos[frames]
+
+
+    @classmethod
+    def from_motions(cls, motions: list[Motion]):
+        if len(motions) == 0:
+            raise ValueError("Cannot create a dataset without motions.")
+
+        skeleton = motions[0].skeleton
+        for motion in motions[1:]:
+            if motion.skeleton != skeleton:
+                raise ValueError(f"All motions must share the same skeleton, but {motion.name} does not.")
+
+        lengths = np.array([motion.num_frames for motion in motions], dtype=np.int64)
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        local_quats = np.concatenate([motion.local_quats for motion in motions], axis=0)
+        root_pos = np.concatenate([motion.root_pos for motion in motions], axis=0)
+        return cls(skeleton, local_quats, root_pos, offsets, [motion.name for motion in motions], [motion.fps for motion in motions])
+
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        """
+        Opens a store written by save(). See store.load().
+        """
+        return store.load(path, mmap_mode)
+
+
+    def save(self, path, bits=None, level=None, block_size=store.codec.BLOCK_SIZE):
+        """
+        Writes the dataset into a store directory, optionally in the compact codec. See store.save().
+        """
+        store.save(path, self, bits, level, block_size)
+
+
+    def __len__(self):
+        return self.num_clips
+
+    def __getitem__(self, idx) -> Motion:
+        return self.motion(idx)
+
+    def __iter__(self):
+        for i in range(self.num_clips):
+            yield self.motion(i)
+
+    @property
+    def skeleton(self):
+        return self.__skeleton
+
+    @property
+    def num_clips(self):
+        return len(self.__offsets) - 1
+
+    @property
+    def num_frames(self):
+        return int(self.__offsets[-1])
+
+    @property
+    def is_encoded(self):
+        return self.__encoded is not None
+
+    @property
+    def local_quats(self):
+        return _readonly(self.__frames()[0])
+
+    @property
+    def root_pos(self):
+        return _readonly(self.__frames()[1])
+
+    @property
+    def offsets(self):
+        return _readonly(self.__offsets)
+
+    @property
+    def lengths(self):
+        return np.diff(self.__offsets)
+
+    @property
+    def names(self):
+        return self.__names
+
+    @property
+    def fps(self):
+        return _readonly(self.__fps)
+
+    @property
+    def clip_idx(self):
+        """
+        Clip index of each frame. (ΣT,)
+        """
+        if self.__clip_idx is None:
+            self.__clip_idx = np.repeat(np.arange(self.num_clips, dtype=np.int64), self.lengths)
+        return _readonly(self.__clip_idx)
+
+
+    def clip_range(self, idx):
+        return int(self.__offsets[idx]), int(self.__offsets[idx + 1])
+
+
+    def motion(self, idx) -> Motion:
+        """
+        Clip as a Motion.
+        If the buffers are writeable (in memory, or a store opened with mmap_mode "r+" or "c"), the clip shares them,
+        so in-place edits of the clip (setters, two_bone_ik(), solve_ik()) write through to the dataset, and to the files with "r+".
+        If the buffers are read-only (a store opened with mmap_mode "r"), the clip is copied when it is built,
+        so it can still be edited in place, but the edits do not reach the dataset. Clips of an encoded dataset are decoded copies.
+        """
+        start, stop = self.clip_range(idx)
+        local_quats, root_pos = self.__frames(slice(start, stop))
+        return Motion.from_numpy(self.__skeleton, local_quats, root_pos, float(self.__fps[idx]), self.__names[idx])
+
+
+    def fk(self, frames=slice(None)):
+        """
+        Global rotations and positions of the given frames of the packed buffer, evaluated in one batch.
+
+        Returns:
+            global_quats: (..., J, 4)
+            global_pos:   (..., J, 3)
+        """
+        local_quats, root_pos = self.__frames(frames)
+        return n_quat.fk(local_quats, root_pos, self.__skeleton)
+
+
+    def diff(self, values, scale_by_fps=True):
+        """
+        Backward differences of per-frame values along the packed buffer that do not cross clip boundaries.
+        The first frame of each clip takes the difference of its next frame.
+
+        Args:
+            values: (ΣT, ...) per-frame values, e.g. global positions
+            scale_by_fps: multiply by the frame rate of each clip to get velocities
+        Returns:
+            differences: (ΣT, ...)
+        """
+        values = np.asarray(values)
+        res = np.empty_like(values)
+        res[1:] = values[1:] - values[:-1]
+
+        starts = self.__offsets[:-1][self.lengths > 1]
+        res[starts] = res[starts + 1]
+        res[self.__offsets[:-1][self.lengths == 1]] = 0
+
+        if scale_by_fps:
+            res *= self.__fps[self.clip_idx].reshape((-1,) + (1,) * (values.ndim - 1))
+        return res
+
+
+    def features(self, future_frames=(10, 20, 30)):
+        """
+        Features of all frames in one batched pass, without crossing clip boundaries. See featureops.motion_features().
+        """
+        global_quats, global_pos = self.fk()
+        return featureops.motion_features(global_quats, global_pos, self.__skeleton, self.__fps[self.clip_idx], future_frames, self.__offsets)
+
+
+    def contacts(self, feet=featureops.FOOT_JOINTS, heightmap=None, **kwargs):
+        """
+        Foot contact labels of all frames. (ΣT, F) See featureops.foot_contacts() for the thresholds.
+        """
+        _, global_pos = self.fk()
+        return featureops.foot_contacts(global_pos, self.__skeleton, feet, self.__fps[self.clip_idx], self.__offsets, heightmap=heightmap, **kwargs)
+
+
+    def window_starts(self, length, stride=1):
+        """
+        Start frames in the packed buffer of all windows that fit in a clip.
+        """
+        if length < 1 or stride < 1:
+            raise ValueError(f"length and stride must be positive, but got {length} and {stride}.")
+
+        num_windows = np.maximum((self.lengths - length) // stride + 1, 0)
+        clip_idx = np.repeat(np.arange(self.num_clips), num_windows)
+        first = np.concatenate([[0], np.cumsum(num_windows)[:-1]])
+        local_idx = np.arange(num_windows.sum()) - np.repeat(first, num_windows)
+        return self.__offsets[clip_idx] + local_idx * stride
+
+
+    def sample_windows(self, batch_size, length, rng: np.random.Generator = None):
+        """
+        Random windows of `length` frames, uniformly over all windows in the dataset.
+
+        Returns:
+            local_quats: (B, L, J, 4)
+            root_pos:    (B, L, 3)
+            starts:      (B,) start frames in the packed buffer
+        """
+        rng = np.random.default_rng() if rng is None else rng
+
+        num_windows = np.maximum(self.lengths - length + 1, 0)
+        total = num_windows.sum()
+        if total == 0:
+            raise ValueError(f"No clip has {length} frames or more.")
+
+        # window index -> (clip, start)
+        window_idx = rng.integers(0, total, size=batch_size)
+        cum = np.cumsum(num_windows)
+        clip_idx = np.searchsorted(cum, window_idx, side="right")
+        starts = self.__offsets[clip_idx] + window_idx - (cum[clip_idx] - num_windows[clip_idx])
+
+        frames = starts[:, None] + np.arange(length)
+        local_quats, root_pos = self.__frames(frames)
+        return local_quats, root_pos, starts
+
+
+    def mirror(self, pair_indices=None, sym_axis=None):
+        local_quats, root_pos = motionops.mirror(*self.__frames(), self.__skeleton, pair_indices, sym_axis)
+        return MotionDataset(self.__skeleton, local_quats, root_pos, self.__offsets, [name + "_mirrored" for name in self.__names], self.__fps)
+
+
+    def scaled(self, scale_factor, **kwargs):
+        """
+        Dataset of the clips scaled on the xz-plane with the feet adjusted by two-bone IK, all clips in one pass.
+        Clips for which the scale factor is not proper are dropped, and None is returned if there are none.
+        See motionops.scale_motions() for the options.
+        """
+        return motionops.scaled_motion(self, scale_factor, **kwargs)
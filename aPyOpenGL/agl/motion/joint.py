@@ -18,7 +18,8 @@ class Joint:
         pre_quat: np.ndarray = None,
         local_pos: np.ndarray = None
     ):
-        self.name = str(name)
+        self.__name = str(name)
+        self.__frozen = False
         self.__pre_quat = np.array([1, 0, 0, 0], dtype=np.float32) if pre_quat is None else np.array(pre_quat, dtype=np.float32)
         self.__local_pos = np.array([0, 0, 0], dtype=np.float32) if local_pos is None else np.array(local_pos, dtype=np.float32)
 
@@ -29,6 +30,14 @@ class Joint:
         
         self._recompute_pre_xform()
 
+    @property
+    def name(self):
+        return self.__name
+
+    @property
+    def frozen(self):
+        return self.__frozen
+
     @property
     def pre_quat(self):
         return self.__pre_quat.copy()
@@ -41,8 +50,14 @@ class Joint:
     def pre_xform(self):
         return self.__pre_xform.copy()
     
+    @name.setter
+    def name(self, value):
+        self.__check_mutable()
+        self.__name = str(value)
+
     @pre_quat.setter
     def pre_quat(self, value):
+        self.__check_mutable()
         self.__pre_quat = np.array(value, dtype=np.float32)
         if self.__pre_quat.shape != (4,):
             raise ValueError(f"Pre-rotation quaternion must be a 4-dimensional vector, but got {self.__pre_quat.shape}.")
@@ -50,11 +65,23 @@ class Joint:
     
     @local_pos.setter
     def local_pos(self, value):
+        self.__check_mutable()
         self.__local_pos = np.array(value, dtype=np.float32)
         if self.__local_pos.shape != (3,):
             raise ValueError(f"Local position must be a 3-dimensional vector, but got {self.__local_pos.shape}.")
         self._recompute_pre_xform()
 
+    def freeze(self):
+        """
+        Makes this joint read-only and returns itself.
+        """
+        self.__frozen = True
+        return self
+
+    def __check_mutable(self):
+        if self.__frozen:
+            raise AttributeError(f"Joint {self.__name} is frozen. Use FrozenSkeleton.edit() to get a mutable copy.")
+
     def _recompute_pre_xform(self):
         pre_rotmat = n_quat.to_rotmat(self.__pre_quat)
         self.__pre_xform = n_rotmat.to_xform(pre_rotmat, translation=self.__local_pos)
\ No newline at end of file
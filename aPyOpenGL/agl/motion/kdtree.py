@@ -0,0 +1,164 @@
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+"""
+Balanced KD-tree with bounding boxes for batched weighted k-nearest-neighbor queries.
+The tree is stored in arrays in heap order (children of node i are 2i+1 and 2i+2), and all leaves are at the same depth.
+Points are permuted so that the points of each leaf are contiguous.
+
+Queries run level by level for a batch at once:
+    1. each query descends to the leaf with the smallest box distance, whose k-th distance bounds the search,
+    2. (query, node) pairs whose box distance is below the bound are expanded down to the leaves,
+    3. the points of the remaining leaves are scanned and the k nearest are kept.
+Distances are weighted squared Euclidean distances sum_d w_d (x_d - q_d)^2, so that the weights can change per query.
+"""
+def _box_distances(lo, hi, queries, weights):
+    # lo, hi: (P, D), queries: (P, D), weights: (P, D) or (D,) -> (P,)
+    gap = np.maximum(np.maximum(lo - queries, queries - hi), 0)
+    return np.sum(weights * gap * gap, axis=-1)
+
+
+class KDTree:
+    """
+    Attributes:
+        points      (numpy.ndarray): Points in leaf order. (N, D)
+        index       (numpy.ndarray): Original index of each point in leaf order. (N,)
+        depth       (int)          : Depth of the leaves.
+        lo, hi      (numpy.ndarray): Bounding box of each node. (2^(depth+1) - 1, D)
+        leaf_starts (numpy.ndarray): First point of each leaf. (2^depth + 1,)
+    """
+    def __init__(self, points, index, depth, lo, hi, leaf_starts):
+        self.points      = points
+        self.index       = index
+        self.depth       = depth
+        self.lo          = lo
+        self.hi          = hi
+        self.leaf_starts = leaf_starts
+        self.leaf_size   = int(np.diff(leaf_starts).max(initial=0))
+
+
+    @classmethod
+    def build(cls, points, leaf_size=32, workers=None):
+        """
+        Median splits along the widest dimension of each node.
+        Nodes of the same level are split in parallel by `workers` threads (numpy releases the GIL while partitioning).
+        """
+        points = np.ascontiguousarray(points, dtype=np.float32)
+        nop = len(points)
+        depth = max(int(np.ceil(np.log2(max(nop, 1) / leaf_size))), 0)
+
+        perm = np.arange(nop, dtype=np.int64)
+        starts = np.array([0, nop], dtype=np.int64) # node boundaries of the current level
+        def split(node):
+            start, stop = starts[node], starts[node + 1]
+            segment = perm[start:stop]
+            if len(segment) < 2:
+                return start + len(segment) // 2
+            values = points[segment]
+            dim = np.argmax(values.max(axis=0) - values.min(axis=0))
+            half = len(segment) // 2
+            perm[start:stop] = segment[np.argpartition(values[:, dim], half)]
+            return start + half
+
+        with ThreadPoolExecutor(workers) as executor:
+            for _ in range(depth):
+                mids = np.fromiter(executor.map(split, range(len(starts) - 1)), dtype=np.int64, count=len(starts) - 1)
+                starts = np.stack([starts[:-1], mids], axis=-1).reshape(-1)
+                starts = np.append(starts, nop)
+
+        points = points[perm]
+        nol, dim = len(starts) - 1, points.shape[-1]
+        lo = np.full((2 * nol - 1, dim), np.inf, dtype=np.float32)
+        hi = np.full((2 * nol - 1, dim), -np.inf, dtype=np.float32)
+
+        # leaf boxes, then parents bottom-up
+        nonempty = np.nonzero(np.diff(starts) > 0)[0]
+        lo[nol - 1 + nonempty] = np.minimum.reduceat(points, starts[nonempty], axis=0)
+        hi[nol - 1 + nonempty] = np.maximum.reduceat(points, starts[nonempty], axis=0)
+        for level in range(depth - 1, -1, -1):
+            nodes = np.arange(2**level - 1, 2**(level + 1) - 1)
+            lo[nodes] = np.minimum(lo[2 * nodes + 1], lo[2 * nodes + 2])
+            hi[nodes] = np.maximum(hi[2 * nodes + 1], hi[2 * nodes + 2])
+
+        return cls(points, perm, depth, lo, hi, starts)
+
+
+    def __leaf_candidates(self, queries, weights, pairs_q, leaves, k):
+        # distances of all points of the given (query, leaf) pairs, and the candidates in a dense (Q, C) matrix
+        offsets = np.arange(self.leaf_size)
+        starts, counts = self.leaf_starts[leaves], np.diff(self.leaf_starts)[leaves]
+        idx = starts[:, None] + offsets # (P, S)
+        valid = offsets < counts[:, None]
+        idx = np.where(valid, idx, 0)
+
+        diff = self.points[idx] - queries[pairs_q][:, None]
+        w = weights[pairs_q][:, None] if weights.ndim == 2 else weights
+        dist = np.where(valid, np.sum(w * diff * diff, axis=-1), np.inf) # (P, S)
+
+        # rank of each pair within its query
+        noq = len(queries)
+        order = np.argsort(pairs_q, kind="stable")
+        pairs_q, idx, dist = pairs_q[order], idx[order], dist[order]
+        num_pairs = np.bincount(pairs_q, minlength=noq)
+        first = np.concatenate([[0], np.cumsum(num_pairs)[:-1]])
+        rank = np.arange(len(pairs_q)) - first[pairs_q]
+
+        width = max(int(num_pairs.max(initial=0)) * self.leaf_size, k)
+        dense_dist = np.full((noq, width), np.inf, dtype=dist.dtype)
+        dense_idx = np.zeros((noq, width), dtype=np.int64)
+        cols = rank[:, None] * self.leaf_size + offsets
+        dense_dist[pairs_q[:, None], cols] = dist
+        dense_idx[pairs_q[:, None], cols] = idx
+        return dense_dist, dense_idx
+
+
+    def __topk(self, dense_dist, dense_idx, k):
+        part = np.argpartition(dense_dist, k - 1, axis=-1)[:, :k] if dense_dist.shape[-1] > k else np.broadcast_to(np.arange(dense_dist.shape[-1]), dense_dist.shape)
+        dist = np.take_along_axis(dense_dist, part, axis=-1)
+        order = np.argsort(dist, axis=-1, kind="stable")
+        return np.take_along_axis(dist, order, axis=-1), np.take_along_axis(np.take_along_axis(dense_idx, part, axis=-1), order, axis=-1)
+
+
+    def query(self, queries, k=1, weights=None):
+        """
+        Args:
+            queries: (Q, D)
+            k:       the number of neighbors
+            weights: (D,) or (Q, D) non-negative weights of the dimensions, or None for ones
+        Returns:
+            distances: (Q, k) weighted squared distances in increasing order, inf if there are less than k points
+            indices:   (Q, k) original indices of the points, -1 if there are less than k points
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        weights = np.ones(queries.shape[-1], dtype=np.float32) if weights is None else np.asarray(weights, dtype=np.float32)
+        noq = len(queries)
+        nol = len(self.leaf_starts) - 1
+        first_leaf = nol - 1
+        qidx = np.arange(noq)
+
+        # 1. descend to the closest leaf box
+        node = np.zeros(noq, dtype=np.int64)
+        for _ in range(self.depth):
+            left, right = 2 * node + 1, 2 * node + 2
+            dl = _box_distances(self.lo[left], self.hi[left], queries, weights)
+            dr = _box_distances(self.lo[right], self.hi[right], queries, weights)
+            node = np.where(dl <= dr, left, right)
+        dense_dist, _ = self.__leaf_candidates(queries, weights, qidx, node - first_leaf, k)
+        bound = np.sort(dense_dist, axis=-1)[:, k - 1] if dense_dist.shape[-1] >= k else np.full(noq, np.inf)
+
+        # 2. expand (query, node) pairs within the bound
+        pairs_q, pairs_n = qidx, np.zeros(noq, dtype=np.int64)
+        for _ in range(self.depth):
+            pairs_q = np.repeat(pairs_q, 2)
+            pairs_n = (2 * pairs_n[:, None] + np.array([1, 2])).reshape(-1)
+            w = weights if weights.ndim == 1 else weights[pairs_q]
+            keep = _box_distances(self.lo[pairs_n], self.hi[pairs_n], queries[pairs_q], w) <= bound[pairs_q]
+            pairs_q, pairs_n = pairs_q[keep], pairs_n[keep]
+
+        # 3. scan the leaves
+        dense_dist, dense_idx = self.__leaf_candidates(queries, weights, pairs_q, pairs_n - first_leaf, k)
+        dist, idx = self.__topk(dense_dist, dense_idx, k)
+        found = np.isfinite(dist)
+        return dist, np.where(found, self.index[idx], -1)
@@ -0,0 +1,290 @@
+from __future__ import annotations
+
+import numpy as np
+
+from aPyOpenGL.transforms import n_aaxis
+
+"""
+Keyframe reduction of dense motions.
+Each joint rotation is converted to a continuous log-map (axis * angle), and each of its 3 channels
+and the 3 channels of the root position is fitted independently with piecewise linear or cubic curves
+through a subset of its frames (keys), so that the curve is within the tolerance at every frame.
+Nearly static channels keep only their first and last frames.
+
+Since the exponential map does not increase distances, a rotation tolerance `rot_tol` per channel
+bounds the angular error of each joint rotation by sqrt(3) * rot_tol.
+
+Keys are stored channel by channel:
+    key_offsets: (C+1,) keys of channel c are [key_offsets[c], key_offsets[c+1])
+    key_frames:  (K,) frame of each key, increasing within a channel, uint16 if the motion has less than 65536 frames
+    key_values:  (K,) value of each key
+"""
+METHODS = ("linear", "cubic")
+
+def quats_to_logmap(quats):
+    """
+    Log-maps of quaternions that are continuous in time, i.e. without flips at 180 degrees.
+
+    Args:
+        quats: (T, ..., 4)
+    Returns:
+        logmaps: (T, ..., 3)
+    """
+    q = np.asarray(quats, dtype=np.float64)
+    q = q / np.linalg.norm(q, axis=-1, keepdims=True)
+
+    # keep each quaternion on the hemisphere of the previous frame
+    dots = np.sum(q[1:] * q[:-1], axis=-1, keepdims=True)
+    sign = np.cumprod(np.where(dots < 0, -1.0, 1.0), axis=0)
+    q[1:] *= sign
+    q *= np.where(q[0:1, ..., 0:1] < 0, -1.0, 1.0)
+
+    # angle in [0, 2pi] is continuous along a continuous path of quaternions
+    length = np.linalg.norm(q[..., 1:], axis=-1, keepdims=True)
+    angle = 2.0 * np.arctan2(length, q[..., 0:1])
+    scale = np.where(length < 1e-8, 2.0, angle / np.maximum(length, 1e-8))
+    return q[..., 1:] * scale
+
+
+def interpolate(key_frames, key_values, key_offsets, frames, method="linear"):
+    """
+    Evaluates the curves of all channels at the given frames.
+
+    Args:
+        key_frames, key_values, key_offsets: keys of C channels
+        frames: (F,) frames to evaluate
+        method: "linear" or "cubic" (Catmull-Rom with non-uniform key spacing)
+    Returns:
+        values: (F, C)
+    """
+    if method not in METHODS:
+        raise ValueError(f"Method must be one of {METHODS}, but got {method}.")
+
+    frames = np.asarray(frames, dtype=np.int64)
+    key_frames = np.asarray(key_frames, dtype=np.int64)
+    noc = len(key_offsets) - 1
+    first, last = key_offsets[:-1], key_offsets[1:] - 1
+
+    # search the keys of all channels at once in (channel, frame) order
+    stride = max(int(frames.max(initial=0)), int(key_frames.max(initial=0))) + 1
+    channel = np.repeat(np.arange(noc, dtype=np.int64), np.diff(key_offsets))
+    flat_keys = channel * stride + key_frames
+    queries = np.arange(noc, dtype=np.int64) * stride + frames[:, None] # (F, C)
+
+    i0 = np.clip(np.searchsorted(flat_keys, queries, side="right") - 1, first, last)
+    i1 = np.minimum(i0 + 1, last)
+
+    f0, f1 = key_frames[i0], key_frames[i1]
+    v0, v1 = key_values[i0], key_values[i1]
+    span = (f1 - f0).astype(np.float64)
+    t = np.where(span > 0, (frames[:, None] - f0) / np.maximum(span, 1.0), 0.0)
+    t = np.clip(t, 0.0, 1.0)
+
+    if method == "linear":
+        return v0 + (v1 - v0) * t
+
+    # tangents of the keys from their neighbors in the same channel
+    idx = np.arange(len(key_frames))
+    prev = np.maximum(idx - 1, first[channel])
+    next = np.minimum(idx + 1, last[channel])
+    dt = (key_frames[next] - key_frames[prev]).astype(np.float64)
+    tangents = np.where(dt > 0, (key_values[next] - key_values[prev]) / np.maximum(dt, 1.0), 0.0)
+
+    t2, t3 = t * t, t * t * t
+    h00 = 2 * t3 - 3 * t2 + 1
+    h10 = t3 - 2 * t2 + t
+    h01 = -2 * t3 + 3 * t2
+    h11 = t3 - t2
+    return h00 * v0 + h10 * span * tangents[i0] + h01 * v1 + h11 * span * tangents[i1]
+
+
+def _segment_errors(flat_keys, flat_values, segments, nof, method):
+    """
+    Errors of the interior frames of segments between consecutive keys, evaluated as interpolate() does.
+
+    Args:
+        flat_keys:   (K,) sorted keys of all channels as channel * T + frame
+        flat_values: (C * T,) values of all frames, channel by channel
+        segments:    (S,) index in flat_keys of the first key of each segment, with at least one interior frame
+    Returns:
+        flat index (F,) and error (F,) of the interior frames, the segment of each frame (F,) and the first frame of each segment (S,)
+    """
+    k0, k1 = flat_keys[segments], flat_keys[segments + 1]
+    counts = k1 - k0 - 1
+    starts = np.cumsum(counts) - counts
+    seg = np.repeat(np.arange(len(segments)), counts)
+    offset = np.arange(len(seg)) - starts[seg] + 1
+    flat = k0[seg] + offset
+
+    v0, v1 = flat_values[k0], flat_values[k1]
+    span = (k1 - k0).astype(np.float64)
+    t = offset / span[seg]
+
+    if method == "linear":
+        curve = v0[seg] + (v1 - v0)[seg] * t
+    else:
+        # tangents of the two keys from their neighbors in the same channel
+        channel = k0 // nof
+        def tangents(idx):
+            prev = np.where((idx > 0) & (flat_keys[idx - 1] // nof == channel), idx - 1, idx)
+            next = np.where((idx < len(flat_keys) - 1) & (flat_keys[np.minimum(idx + 1, len(flat_keys) - 1)] // nof == channel), idx + 1, idx)
+            dt = (flat_keys[next] - flat_keys[prev]).astype(np.float64)
+            return np.where(dt > 0, (flat_values[flat_keys[next]] - flat_values[flat_keys[prev]]) / np.maximum(dt, 1.0), 0.0)
+
+        t2, t3 = t * t, t * t * t
+        h00 = 2 * t3 - 3 * t2 + 1
+        h10 = t3 - 2 * t2 + t
+        h01 = -2 * t3 + 3 * t2
+        h11 = t3 - t2
+        curve = h00 * v0[seg] + h10 * span[seg] * tangents(segments)[seg] + h01 * v1[seg] + h11 * span[seg] * tangents(segments + 1)[seg]
+
+    return flat, np.abs(curve - flat_values[flat]), seg, starts
+
+
+def fit_keys(values, tol, method="linear"):
+    """
+    Greedy keyframe reduction of all channels at once.
+    Starting from the first and the last frames, the frame with the largest error of each segment between two keys
+    becomes a key until every frame is within the tolerance.
+
+    Only the segments whose curves changed are re-evaluated after each round of new keys:
+    the two halves of each split segment, and for cubic curves also their neighbors, whose tangents depend on the new key.
+    The keys are the same as re-evaluating all frames every round, in O(T log T) per channel for balanced splits.
+
+    Args:
+        values: (T, C) values of all frames
+        tol:    float or (C,) tolerance of each channel
+    Returns:
+        key_frames (K,), key_values (K,), key_offsets (C+1,)
+    """
+    if method not in METHODS:
+        raise ValueError(f"Method must be one of {METHODS}, but got {method}.")
+
+    values = np.asarray(values, dtype=np.float64)
+    nof, noc = values.shape
+    tol = np.broadcast_to(np.asarray(tol, dtype=np.float64), (noc,))
+    flat_values = np.ascontiguousarray(values.T).ravel() # (C * T,)
+
+    # keys of all channels as sorted channel * T + frame
+    flat_keys = np.unique(np.arange(noc, dtype=np.int64)[:, None] * nof + np.array([0, nof - 1]))
+    segments = np.arange(len(flat_keys) - 1)
+    reach = np.array([1, 0] if method == "linear" else [2, 1, 0, -1]) # segments to re-evaluate, before each new key
+
+    while True:
+        k0, k1 = flat_keys[segments], flat_keys[segments + 1]
+        segments = segments[(k0 // nof == k1 // nof) & (k1 - k0 > 1)]
+        if len(segments) == 0:
+            break
+        flat, error, seg, starts = _segment_errors(flat_keys, flat_values, segments, nof, method)
+
+        # the frame with the largest error of each segment, the last one if tied
+        worst_error = np.maximum.reduceat(error, starts)
+        worst = np.maximum.reduceat(np.where(error == worst_error[seg], np.arange(len(seg)), -1), starts)
+        worst = worst[worst_error > tol[flat_keys[segments] // nof]]
+        if len(worst) == 0:
+            break
+
+        # new keys are in increasing order, at most one per segment
+        new_keys = flat[worst]
+        insert_at = np.searchsorted(flat_keys, new_keys)
+        flat_keys = np.insert(flat_keys, insert_at, new_keys)
+        pos = insert_at + np.arange(len(new_keys))
+        segments = np.unique(np.clip(pos[:, None] - reach, 0, len(flat_keys) - 2))
+
+    channels, frames = np.divmod(flat_keys, nof)
+    key_offsets = np.searchsorted(flat_keys, np.arange(noc + 1, dtype=np.int64) * nof).astype(np.int64)
+    dtype = np.uint16 if nof <= np.iinfo(np.uint16).max else np.int32
+    return frames.astype(dtype), values[frames, channels].astype(np.float32), key_offsets
+
+
+class KeyframedMotion:
+    """
+    Motion reduced to keyframes of each joint rotation channel and root position channel.
+    Any range of frames is decompressed at once.
+
+    Attributes:
+        skeleton    (FrozenSkeleton): The skeleton of the motion.
+        num_frames  (int)           : The number of frames of the original motion.
+        method      (str)           : Interpolation between keys, "linear" or "cubic".
+        key_frames  (numpy.ndarray) : Frame of each key. (K,)
+        key_values  (numpy.ndarray) : Value of each key. (K,)
+        key_offsets (numpy.ndarray) : Keys of each channel, J*3 log-map channels followed by 3 root position channels. (C+1,)
+        fps         (float)         : The number of frames per second.
+        name        (str)           : The name of the motion.
+    """
+    def __init__(self, skeleton, local_quats, root_pos, fps=30.0, name="default", rot_tol=1e-3, pos_tol=1e-3, method="linear"):
+        self.__skeleton   = skeleton.freeze()
+        self.__num_frames = len(local_quats)
+        self.__method     = method
+        self.fps          = fps
+        self.name         = name
+
+        noj = self.__skeleton.num_joints
+        logmaps = quats_to_logmap(local_quats).reshape(self.__num_frames, noj * 3)
+        values = np.concatenate([logmaps, np.asarray(root_pos, dtype=np.float64)], axis=-1) # (T, J*3 + 3)
+        tol = np.concatenate([np.full(noj * 3, rot_tol), np.full(3, pos_tol)])
+
+        self.__key_frames, self.__key_values, self.__key_offsets = fit_keys(values, tol, method)
+
+
+    @classmethod
+    def from_motion(cls, motion, rot_tol=1e-3, pos_tol=1e-3, method="linear"):
+        return cls(motion.skeleton, motion.local_quats, motion.root_pos, motion.fps, motion.name, rot_tol, pos_tol, method)
+
+
+    @property
+    def skeleton(self):
+        return self.__skeleton
+
+    @property
+    def num_frames(self):
+        return self.__num_frames
+
+    @property
+    def method(self):
+        return self.__method
+
+    @property
+    def key_frames(self):
+        return self.__key_frames
+
+    @property
+    def key_values(self):
+        return self.__key_values
+
+    @property
+    def key_offsets(self):
+        return self.__key_offsets
+
+    @property
+    def num_keys(self):
+        return len(self.__key_frames)
+
+    @property
+    def nbytes(self):
+        return self.__key_frames.nbytes + self.__key_values.nbytes + self.__key_offsets.nbytes
+
+
+    def decode(self, start=0, stop=None):
+        """
+        Decompresses frames [start, stop) of all channels at once.
+
+        Returns:
+            local_quats: (T', J, 4)
+            root_pos:    (T', 3)
+        """
+        start, stop, _ = slice(start, stop).indices(self.__num_frames)
+        if stop <= start:
+            raise ValueError(f"Cannot decode an empty range of frames [{start}, {stop}).")
+
+        values = interpolate(self.__key_frames, self.__key_values, self.__key_offsets, np.arange(start, stop), self.__method)
+        logmaps = values[:, :-3].reshape(stop - start, self.__skeleton.num_joints, 3)
+        local_quats = n_aaxis.to_quat(logmaps).astype(np.float32)
+        return local_quats, values[:, -3:].astype(np.float32)
+
+
+    def to_motion(self, start=0, stop=None):
+        from .motion import Motion
+
+        local_quats, root_pos = self.decode(start, stop)
+        return Motion.from_numpy(self.__skeleton, local_quats, root_pos, self.fps, self.name)
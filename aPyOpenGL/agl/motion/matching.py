@@ -0,0 +1,217 @@
+from __future__ import annotations
+
+import json
+import numpy as np
+
+from .kdtree import KDTree
+from aPyOpenGL.ops import featureops
+
+"""
+Feature database for motion matching.
+Each frame of a dataset is described by groups of features (see featureops.motion_features()):
+
+    joint_pos   (n*3) root-relative positions of the matched joints
+    joint_vel   (n*3) root-relative velocities of the matched joints
+    root_vel    (3)   root velocity in the facing frame
+    future_pos  (K*2) future root positions on the xz-plane
+    future_dir  (K*2) future facing directions on the xz-plane
+
+Each group is normalized by its mean and the mean standard deviation of its dimensions,
+so that a group weight scales the whole group regardless of its size and units.
+"""
+FEATURE_GROUPS = ("joint_pos", "joint_vel", "root_vel", "future_pos", "future_dir")
+MATCH_JOINTS   = ("LeftFoot", "RightFoot", "Hips")
+FUTURE_FRAMES  = (20, 40, 60)
+
+def extract_features(global_quats, global_pos, skeleton, fps=30.0, joints=MATCH_JOINTS, future_frames=FUTURE_FRAMES, offsets=None):
+    """
+    Raw feature vectors of all frames.
+
+    Returns:
+        features: (..., T, D)
+        groups:   dict of group name -> (start, stop) dimensions in the feature vector
+    """
+    idx = [skeleton.idx_by_name[joint] if isinstance(joint, str) else int(joint) for joint in joints]
+    feats = featureops.motion_features(global_quats, global_pos, skeleton, fps, future_frames, offsets)
+
+    batch = feats["facing"].shape[:-1]
+    values = {
+        "joint_pos" : feats["local_pos"][..., idx, :].reshape(batch + (-1,)),
+        "joint_vel" : feats["local_vel"][..., idx, :].reshape(batch + (-1,)),
+        "root_vel"  : feats["root_vel"],
+        "future_pos": feats["future_pos"].reshape(batch + (-1,)),
+        "future_dir": feats["future_dir"].reshape(batch + (-1,)),
+    }
+
+    groups, start = {}, 0
+    for name in FEATURE_GROUPS:
+        groups[name] = (start, start + values[name].shape[-1])
+        start = groups[name][1]
+    return np.concatenate([values[name] for name in FEATURE_GROUPS], axis=-1), groups
+
+
+class MotionDatabase:
+    """
+    Normalized features of the frames of a dataset, indexed by a KD-tree for batched weighted k-NN queries.
+    With PCA, the tree is built on the projection of the weighted features, and the weights are fixed at build time.
+
+    Attributes:
+        mean        (numpy.ndarray): Mean of each feature dimension. (D,)
+        scale       (numpy.ndarray): Normalization scale of each feature dimension. (D,)
+        weights     (numpy.ndarray): Default weight of each feature dimension. (D,)
+        groups      (dict)         : Feature group name -> (start, stop) dimensions.
+        components  (numpy.ndarray): PCA basis (D, P), or None.
+        frames      (numpy.ndarray): Frame index in the dataset buffer of each database entry. (M,)
+        offsets     (numpy.ndarray): Clip boundaries of the dataset. (N+1,)
+        config      (dict)         : Joints and future frames used to extract the features.
+    """
+    def __init__(self, tree: KDTree, mean, scale, weights, groups, components, frames, offsets, config):
+        self.tree       = tree
+        self.mean       = mean
+        self.scale      = scale
+        self.weights    = weights
+        self.groups     = groups
+        self.components = components
+        self.frames     = frames
+        self.offsets    = offsets
+        self.config     = config
+
+
+    @classmethod
+    def build(
+        cls,
+        dataset,
+        joints=MATCH_JOINTS,
+        future_frames=FUTURE_FRAMES,
+        weights=None,
+        pca_dims=None,
+        frames=None,
+        leaf_size=32,
+        workers=None,
+    ):
+        """
+        Args:
+            dataset:       MotionDataset
+            joints:        names or indices of the joints of the pose features
+            future_frames: future frame offsets of the trajectory features
+            weights:       dict of group name -> weight, 1 for groups not given
+            pca_dims:      the number of principal components, or None to index the features as they are
+            frames:        frames of the dataset buffer to index, e.g. to exclude the ends of clips, or None for all
+            leaf_size:     the maximum number of frames per leaf of the tree
+            workers:       the number of threads to build the tree
+        """
+        global_quats, global_pos = dataset.fk()
+        features, groups = extract_features(global_quats, global_pos, dataset.skeleton, np.asarray(dataset.fps)[dataset.clip_idx], joints, future_frames, dataset.offsets)
+
+        frames = np.arange(len(features)) if frames is None else np.asarray(frames, dtype=np.int64)
+        features = features[frames]
+
+        mean = features.mean(axis=0)
+        scale = np.empty_like(mean)
+        for start, stop in groups.values():
+            scale[start:stop] = features[:, start:stop].std(axis=0).mean() + 1e-8
+
+        group_weights = {} if weights is None else dict(weights)
+        dim_weights = np.ones_like(mean)
+        for name, (start, stop) in groups.items():
+            dim_weights[start:stop] = group_weights.get(name, 1.0)
+
+        config = {"joints": list(joints), "future_frames": [int(f) for f in future_frames]}
+        normalized = (features - mean) / scale
+
+        components = None
+        if pca_dims is not None:
+            weighted = normalized * np.sqrt(dim_weights)
+            sample = weighted[np.random.default_rng(0).choice(len(weighted), min(len(weighted), 100000), replace=False)]
+            _, _, vt = np.linalg.svd(sample - sample.mean(axis=0), full_matrices=False)
+            components = vt[:pca_dims].T.astype(np.float32) # (D, P)
+            normalized = weighted @ components
+
+        tree = KDTree.build(normalized, leaf_size, workers)
+        return cls(tree, mean.astype(np.float32), scale.astype(np.float32), dim_weights.astype(np.float32), groups, components, frames, np.asarray(dataset.offsets), config)
+
+
+    def normalize(self, features):
+        """
+        Database coordinates of raw feature vectors from extract_features(). (..., D) -> (..., D) or (..., P)
+        """
+        normalized = (np.asarray(features, dtype=np.float32) - self.mean) / self.scale
+        if self.components is not None:
+            normalized = (normalized * np.sqrt(self.weights)) @ self.components
+        return normalized
+
+
+    def query(self, features, k=1, weights=None, batch_size=1024):
+        """
+        Batched k-nearest-neighbor search.
+
+        Args:
+            features: (Q, D) raw feature vectors
+            k:        the number of neighbors
+            weights:  dict of group name -> weight, (D,) or (Q, D) per-dimension weights, or None for the build weights.
+                      Not available with PCA.
+        Returns:
+            distances: (Q, k) weighted squared distances
+            frames:    (Q, k) frames in the dataset buffer, -1 if not found
+        """
+        queries = self.normalize(features)
+        if self.components is not None:
+            if weights is not None:
+                raise ValueError("Query weights are not available with PCA, since the weights are fixed at build time.")
+            weights = np.ones(queries.shape[-1], dtype=np.float32)
+        elif weights is None:
+            weights = self.weights
+        elif isinstance(weights, dict):
+            dim_weights = self.weights.copy()
+            for name, weight in weights.items():
+                start, stop = self.groups[name]
+                dim_weights[start:stop] = weight
+            weights = dim_weights
+
+        weights = np.asarray(weights, dtype=np.float32)
+        dist, idx = [], []
+        for start in range(0, len(queries), batch_size):
+            w = weights[start:start + batch_size] if weights.ndim == 2 else weights
+            d, i = self.tree.query(queries[start:start + batch_size], k, w)
+            dist.append(d)
+            idx.append(i)
+        dist, idx = np.concatenate(dist, axis=0), np.concatenate(idx, axis=0)
+        return dist, np.where(idx >= 0, self.frames[np.maximum(idx, 0)], -1)
+
+
+    def clip_frames(self, frames):
+        """
+        Clip index and frame within the clip of frames in the dataset buffer.
+        """
+        frames = np.asarray(frames)
+        clip = np.searchsorted(self.offsets, frames, side="right") - 1
+        return clip, frames - self.offsets[clip]
+
+
+    def save(self, filename):
+        arrays = {
+            "points"      : self.tree.points,
+            "index"       : self.tree.index,
+            "lo"          : self.tree.lo,
+            "hi"          : self.tree.hi,
+            "leaf_starts" : self.tree.leaf_starts,
+            "mean"        : self.mean,
+            "scale"       : self.scale,
+            "weights"     : self.weights,
+            "frames"      : self.frames,
+            "offsets"     : self.offsets,
+        }
+        if self.components is not None:
+            arrays["components"] = self.components
+        meta = {"depth": self.tree.depth, "groups": self.groups, "config": self.config}
+        np.savez(filename, meta=np.array(json.dumps(meta)), **arrays)
+
+
+    @classmethod
+    def load(cls, filename):
+        data = np.load(filename, allow_pickle=False)
+        meta = json.loads(str(data["meta"]))
+        tree = KDTree(data["points"], data["index"], meta["depth"], data["lo"], data["hi"], data["leaf_starts"])
+        groups = {name: tuple(dims) for name, dims in meta["groups"].items()}
+        components = data["components"] if "components" in data else None
+        return cls(tree, data["mean"], data["scale"], data["weights"], groups, components, data["frames"], data["offsets"], meta["config"])
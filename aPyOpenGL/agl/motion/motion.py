@@ -1,40 +1,70 @@
 from __future__ import annotations
+from collections.abc import Sequence
 import numpy as np
-import copy
 import os
 
 from .pose import Pose
+from .cache import GlobalXformCache, CHUNK_SIZE, MAX_CHUNKS
+from .resample import decimation_step, resample_indices, resample
+from . import blend as blendops
+from .codec import EncodedMotion, BLOCK_SIZE
+from .keyframe import KeyframedMotion
 
 from aPyOpenGL.transforms import n_quat
+from aPyOpenGL.ops import motionops, featureops, ikops
 
 
-def _global_xforms_to_skeleton_xforms(global_xforms, parent_idx):
-    nof, noj = global_xforms.shape[:2]
+class _Poses(Sequence):
+    """
+    Read-only sequence of zero-copy pose views of a motion.
+    """
+    def __init__(self, motion: Motion):
+        self.__motion = motion
 
-    skeleton_xforms = np.stack([np.identity(4, dtype=np.float32) for _ in range(noj - 1)], axis=0)
-    skeleton_xforms = np.stack([skeleton_xforms for _ in range(nof)], axis=0)
+    def __len__(self):
+        return self.__motion.num_frames
 
-    for i in range(1, noj):
-        parent_pos = global_xforms[:, parent_idx[i], :3, 3]
-        
-        target_dir = global_xforms[:, i, :3, 3] - parent_pos
-        target_dir = target_dir / (np.linalg.norm(target_dir, axis=-1, keepdims=True) + 1e-8)
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self.__motion.pose_at(i) for i in range(*idx.indices(len(self)))]
+        return self.__motion.pose_at(idx)
+
+
+def _readonly(array):
+    view = array.view()
+    view.flags.writeable = False
+    return view
+
+
+def _writeable(array):
+    # contiguous float32 array, copied if it cannot be written to (e.g. a read-only view or a read-only memmap)
+    array = np.ascontiguousarray(array, dtype=np.float32)
+    return array if array.flags.writeable else array.copy()
 
-        quat = n_quat.between_vecs(np.array([0, 1, 0], dtype=np.float32), target_dir)
 
-        skeleton_xforms[:, i-1, :3, :3] = n_quat.to_rotmat(quat)
-        skeleton_xforms[:, i-1, :3,  3] = (parent_pos + global_xforms[:, i, :3, 3]) / 2
+def _detached(array):
+    # copy of a view into a cache chunk, which is overwritten in place when its frames are re-evaluated
+    return array.copy() if array.base is not None else array
 
-    return skeleton_xforms
 
 class Motion:
     """
     Motion class that contains the skeleton and its sequence of poses.
+    Local rotations and root positions of all frames are stored in contiguous arrays,
+    and each pose in `poses` is a zero-copy view of a frame.
+    Global transformations are evaluated lazily in chunks of frames on first access (see GlobalXformCache).
+
+    Slicing a motion (`motion[a:b]`, `motion[::k]`) or `windows()` returns motion views
+    that share the arrays and the evaluated global transformations with this motion.
+    Writing to a view writes through to the motion it comes from.
 
     Attributes:
-        poses     (list[Pose]): A sequence of poses.
-        fps       (float)     : The number of frames per second.
-        name      (str)       : The name of the motion.
+        skeleton    (FrozenSkeleton): The skeleton shared by all poses.
+        poses       (Sequence[Pose]): A sequence of pose views.
+        local_quats (numpy.ndarray) : Local rotations of all frames in quaternion. (T, J, 4)
+        root_pos    (numpy.ndarray) : Root positions of all frames in world space. (T, 3)
+        fps         (float)         : The number of frames per second.
+        name        (str)           : The name of the motion.
     """
     def __init__(
         self,
@@ -42,73 +72,328 @@ class Motion:
         fps   : float = 30.0,
         name  : str   = "default",
     ):
-        self.__poses : list[Pose] = poses
-        self.__name  : str        = name
-        self.fps   : float      = fps
+        if len(poses) == 0:
+            raise ValueError("Cannot create a motion without poses.")
+        
+        local_quats = np.stack([pose.local_quats for pose in poses], axis=0) # (T, J, 4)
+        root_pos    = np.stack([pose.root_pos for pose in poses], axis=0) # (T, 3)
+        self.__setup(poses[0].skeleton, local_quats, root_pos, fps, name)
+
+
+    def __setup(self, skeleton, local_quats, root_pos, fps, name, chunk_size=CHUNK_SIZE, max_chunks=MAX_CHUNKS):
+        self.__skeleton    = skeleton.freeze()
+        self.__local_quats = _writeable(local_quats)
+        self.__root_pos    = _writeable(root_pos)
+        self.__name : str  = name
+        self.fps    : float = fps
+
+        nof = self.__local_quats.shape[0]
+        if self.__local_quats.shape != (nof, skeleton.num_joints, 4):
+            raise ValueError(f"Local quaternions must be of shape (T, {skeleton.num_joints}, 4), but got {self.__local_quats.shape}.")
+        if self.__root_pos.shape != (nof, 3):
+            raise ValueError(f"Root positions must be of shape ({nof}, 3), but got {self.__root_pos.shape}.")
+
+        # global transformations, evaluated on demand
+        self.__cache = GlobalXformCache(self.__skeleton, self.__local_quats, self.__root_pos, chunk_size, max_chunks)
+
+        # motion that owns the data if this motion is a view
+        self.__base = None
+
+
+    def __view(self, frames: slice) -> Motion:
+        start, stop, step = frames.indices(self.num_frames)
+        nof = len(range(start, stop, step))
+        if nof == 0:
+            raise ValueError(f"Cannot create an empty view of a motion with {self.num_frames} frames: {frames}.")
+
+        motion = Motion.__new__(Motion)
+        motion.__skeleton    = self.__skeleton
+        motion.__local_quats = self.__local_quats[frames]
+        motion.__root_pos    = self.__root_pos[frames]
+        motion.__name        = self.__name
+        motion.fps           = self.fps / abs(step)
+        motion.__cache       = self.__cache.view(start, step, nof)
+        motion.__base        = self if self.__base is None else self.__base
+        return motion
+
+
+    @classmethod
+    def from_numpy(cls, skeleton, local_quats, root_pos, fps=30.0, name="default"):
+        """
+        Motion on the given arrays. Writeable contiguous float32 arrays are used without copying, so the motion shares them with the caller.
+        Other arrays, including read-only views such as `Motion.local_quats` and read-only memmaps, are copied.
+        """
+        motion = cls.__new__(cls)
+        motion.__setup(skeleton, local_quats, root_pos, fps, name)
+        return motion
+    
+
+    @classmethod
+    def from_torch(cls, skeleton, local_quats, root_pos, fps=30.0, name="default"):
+        return cls.from_numpy(skeleton, local_quats.cpu().numpy(), root_pos.cpu().numpy(), fps, name)
 
-        self.update_global_xform(verbose=True)
 
     def __len__(self):
-        return len(self.__poses)
+        return self.__local_quats.shape[0]
+
+
+    def __getitem__(self, idx):
+        """
+        A pose view for an integer index, and a motion view sharing the same data for a slice.
+        """
+        if isinstance(idx, slice):
+            return self.__view(idx)
+        if isinstance(idx, (int, np.integer)):
+            return self.pose_at(int(idx))
+        raise TypeError(f"Motion indices must be integers or slices, not {type(idx).__name__}.")
+
+
+    def __reduce__(self):
+        # pickle only the data, without the evaluated global transformations
+        return (Motion.from_numpy, (self.__skeleton, np.array(self.__local_quats), np.array(self.__root_pos), self.fps, self.__name))
     
     @property
     def num_frames(self):
-        return len(self.__poses)
+        return self.__local_quats.shape[0]
     
     
     @property
     def skeleton(self):
-        return self.__poses[0].skeleton
+        return self.__skeleton
     
 
     @property
     def poses(self):
-        return self.__poses.copy()
+        return _Poses(self)
     
 
     @property
     def name(self):
         return str(self.__name)
+
+
+    @property
+    def is_view(self):
+        return self.__base is not None
+
+
+    @property
+    def local_quats(self):
+        return _readonly(self.__local_quats)
+    
+
+    @property
+    def root_pos(self):
+        return _readonly(self.__root_pos)
+    
+
+    @property
+    def global_xforms(self):
+        return _detached(self.__cache.global_xforms())
+    
+
+    @property
+    def skeleton_xforms(self):
+        return _detached(self.__cache.skeleton_xforms())
     
 
     @poses.setter
     def poses(self, value: list[Pose]):
-        self.__poses = value.copy()
+        local_quats = np.stack([pose.local_quats for pose in value], axis=0)
+        root_pos = np.stack([pose.root_pos for pose in value], axis=0)
+        self.__setup(value[0].skeleton, local_quats, root_pos, self.fps, self.__name, self.__cache.chunk_size, self.__cache.max_chunks)
+
+
+    @local_quats.setter
+    def local_quats(self, value):
+        self.__local_quats[...] = value
+        self.__cache.invalidate()
+    
+
+    @root_pos.setter
+    def root_pos(self, value):
+        self.__root_pos[...] = value
+        self.__cache.invalidate()
+
+
+    def pose_at(self, frame: int) -> Pose:
+        nof = self.num_frames
+        if not -nof <= frame < nof:
+            raise IndexError(f"Frame {frame} is out of range for a motion with {nof} frames.")
+        frame = frame % nof
+        return Pose._view(self, frame, self.__skeleton, self.__local_quats[frame], self.__root_pos[frame])
     
     
     def remove_joint_by_name(self, joint_name):
-        remove_indices = self.skeleton.remove_joint_by_name(joint_name)
-        for pose in self.__poses:
-            pose.skeleton = self.skeleton
-            pose.local_quats = np.delete(pose.local_quats, remove_indices, axis=0)
+        skeleton, gather_idx = self.__skeleton.prune(joint_name)
+        local_quats = self.__local_quats[:, gather_idx]
+        self.__setup(skeleton, local_quats, self.__root_pos, self.fps, self.__name, self.__cache.chunk_size, self.__cache.max_chunks)
+
+
+    def prune(self, remove):
+        """
+        New motion without the given joints (names or indices) and their descendants.
+        """
+        skeleton, gather_idx = self.__skeleton.prune(remove)
+        return Motion.from_numpy(skeleton, self.__local_quats[:, gather_idx], self.__root_pos.copy(), self.fps, self.__name)
+
+
+    def subset(self, keep):
+        """
+        New motion with only the given joints (names or indices) and their ancestors.
+        """
+        skeleton, gather_idx = self.__skeleton.subset(keep)
+        return Motion.from_numpy(skeleton, self.__local_quats[:, gather_idx], self.__root_pos.copy(), self.fps, self.__name)
 
 
     def export_as_bvh(self, filename, rot_order="XYZ"):
         self.__save(filename, rot_order=rot_order)
 
     
-    def update_global_xform(self, verbose=False):
-        local_quats = np.stack([pose.local_quats for pose in self.__poses], axis=0) # (T, J, 4)
-        root_pos = np.stack([pose.root_pos for pose in self.__poses], axis=0) # (T, 3)
-
-        # fk
-        gq, gp = n_quat.fk(local_quats, root_pos, self.skeleton)
-        gr = n_quat.to_rotmat(gq)
-        gx = np.stack([np.identity(4, dtype=np.float32) for _ in range(self.skeleton.num_joints)], axis=0)
-        gx = np.stack([gx for _ in range(len(self.__poses))], axis=0)
-        gx[..., :3, :3] = gr
-        gx[..., :3,  3] = gp
+    def global_xforms_at(self, frames):
+        """
+        Global transformations of the given frames, evaluating only the chunks they belong to.
+        frames can be an integer, a slice, or an array of frame indices.
+        The result is a copy, so it does not change when the frames are edited and re-evaluated.
+        """
+        return _detached(self.__cache.global_xforms(frames))
+    
 
-        # skeleton xforms
-        sx = _global_xforms_to_skeleton_xforms(gx, self.skeleton.parent_idx)
+    def skeleton_xforms_at(self, frames):
+        return _detached(self.__cache.skeleton_xforms(frames))
+
+
+    def set_cache_size(self, chunk_size=CHUNK_SIZE, max_chunks=MAX_CHUNKS):
+        """
+        Resizes the cache of global transformations, which is shared with the motion views.
+        """
+        self.__cache.resize(chunk_size, max_chunks)
+
+
+    def resample(self, fps):
+        """
+        Motion at the given frame rate, slerping local rotations and lerping root positions.
+        If the frame rate is divided by an integer, the result is a strided view of this motion.
+        """
+        step = decimation_step(self.fps, fps)
+        if step is not None:
+            return self.__view(slice(None, None, step))
+
+        idx0, idx1, t = resample_indices(self.num_frames, self.fps, fps)
+        local_quats, root_pos = resample(self.__local_quats, self.__root_pos, idx0, idx1, t)
+        return Motion.from_numpy(self.__skeleton, local_quats, root_pos, fps, self.__name)
+
+
+    def concat(self, others, blend_frames=0, align=True):
+        """
+        Concatenates motions after this motion.
+        With `align`, each motion is rotated around the y-axis and translated on the xz-plane
+        so that its first frame continues from the seam with the same heading.
+        The last `blend_frames` frames before each seam are crossfaded with the first frames of the next motion.
+
+        Args:
+            others: a motion or a list of motions with the same skeleton
+            blend_frames: number of frames to crossfade at each seam
+            align: whether to align the root trajectory at each seam
+        Returns:
+            a new motion with the frame rate and the name of this motion
+        """
+        others = [others] if isinstance(others, Motion) else list(others)
+        n = int(blend_frames)
+        if n < 0:
+            raise ValueError(f"blend_frames must be non-negative, but got {n}.")
+
+        skeleton = self.__skeleton
+        lq_parts, rp_parts = [self.__local_quats], [self.__root_pos]
+        for other in others:
+            if other.skeleton != skeleton:
+                raise ValueError(f"Cannot concatenate {other.name} with a different skeleton.")
+
+            prev_lq, prev_rp = lq_parts[-1], rp_parts[-1]
+            if len(prev_lq) < max(n, 1) or other.num_frames < n:
+                raise ValueError(f"Motions must have at least {max(n, 1)} frames to blend {n} frames at each seam.")
+
+            lq, rp = other.local_quats, other.root_pos
+            if align:
+                # seam: first blended frame, or one step after the last frame
+                if n > 0:
+                    target_pos = prev_rp[-n]
+                    target_heading = blendops.headings(skeleton, prev_lq[-n, 0])
+                else:
+                    target_pos = prev_rp[-1] if len(prev_rp) < 2 else 2 * prev_rp[-1] - prev_rp[-2]
+                    target_heading = blendops.headings(skeleton, prev_lq[-1, 0])
+                lq, rp = blendops.align(skeleton, lq, rp, 0, target_pos, target_heading)
+
+            if n > 0:
+                weights = np.arange(1, n + 1, dtype=np.float32) / (n + 1)
+                blend_lq, blend_rp = blendops.blend(prev_lq[-n:], prev_rp[-n:], lq[:n], rp[:n], weights)
+                lq_parts[-1], rp_parts[-1] = prev_lq[:-n], prev_rp[:-n]
+                lq_parts.append(blend_lq)
+                rp_parts.append(blend_rp)
+            lq_parts.append(lq[n:])
+            rp_parts.append(rp[n:])
+
+        local_quats = np.concatenate(lq_parts, axis=0)
+        root_pos = np.concatenate(rp_parts, axis=0)
+        return Motion.from_numpy(skeleton, local_quats, root_pos, self.fps, self.__name)
+
+
+    def blend(self, other, weights, align=True):
+        """
+        Blends this motion with another motion of the same length and skeleton.
+        With `align`, the other motion is first aligned to the position and heading of this motion at the first frame.
+
+        Args:
+            other: motion to blend with
+            weights: weights of the other motion, either a float, (T,) or (T, J) where the root position uses the weights of the root
+            align: whether to align the root trajectory of the other motion
+        Returns:
+            a new motion with the frame rate and the name of this motion
+        """
+        if other.skeleton != self.__skeleton:
+            raise ValueError(f"Cannot blend {other.name} with a different skeleton.")
+        if other.num_frames != self.num_frames:
+            raise ValueError(f"Cannot blend motions of different lengths: {self.num_frames} and {other.num_frames}.")
+
+        lq, rp = other.local_quats, other.root_pos
+        if align:
+            lq, rp = blendops.align(self.__skeleton, lq, rp, 0, self.__root_pos[0], blendops.headings(self.__skeleton, self.__local_quats[0, 0]))
+
+        local_quats, root_pos = blendops.blend(self.__local_quats, self.__root_pos, lq, rp, weights)
+        return Motion.from_numpy(self.__skeleton, local_quats, root_pos, self.fps, self.__name)
+
+
+    def windows(self, length, stride=1):
+        """
+        Motion views of `length` frames starting every `stride` frames.
+        The last frames that do not fill a window are dropped.
+        """
+        if length < 1 or stride < 1:
+            raise ValueError(f"length and stride must be positive, but got {length} and {stride}.")
+        return [self.__view(slice(start, start + length)) for start in range(0, self.num_frames - length + 1, stride)]
 
-        for i in range(len(self.__poses)):
-            self.__poses[i].set_global_xform(gx[i], sx[i])
+    
+    def update_global_xform(self, verbose=False):
+        """
+        Re-evaluates the global transformations of all frames.
+        Only the most recently evaluated chunks remain in the cache.
+        """
+        self.__cache.invalidate()
+        for start in range(0, self.num_frames, self.__cache.chunk_size):
+            self.__cache.skeleton_xforms(start)
 
         if verbose:
             print(f" > Global transformations of {self.name} updated.")
 
 
+    def _frame_global_xforms(self, frame):
+        return self.__cache.global_xforms(frame), self.__cache.skeleton_xforms(frame)
+    
+
+    def _invalidate_frames(self, frames):
+        self.__cache.invalidate(frames)
+
+
     def __save(self, filename, scale=100.0, rot_order="ZXY", verbose=False):
         if verbose:
             print(" >  >  Save BVH file: %s" % filename)
@@ -123,38 +408,20 @@ class Motion:
             """ Write data """
             if verbose:
                 print(" >  >  >  >  Write BVH data")
-            t_start = 0
             dt = 1.0 / self.fps
             num_frames = self.num_frames
             f.write("MOTION\n")
             f.write("Frames: %d\n" % num_frames)
             f.write("Frame Time: %f\n" % dt)
-            t = t_start
-
-            for i in range(num_frames):
-                if verbose and i % self.fpsjoint.local_pos == 0:
-                    print(
-                        "\r >  >  >  >  %d/%d processed (%d FPS)"
-                        % (i + 1, num_frames, self.fps),
-                        end=" ",
-                    )
-                pose = self.__poses[i]
-
-                p = self.__poses[i].root_pos
-                p *= scale
-                f.write("%f %f %f " % (p[0], p[1], p[2]))
-                for quat in self.__poses[i].local_quats:
-                    # R = self._Q2E(quat, rot_order)
-                    R = n_quat.to_euler(quat, rot_order, radians=False)
-                    f.write("%f %f %f " % (R[0], R[1], R[2]))
-                f.write("\n")
-                t += dt
-                if verbose and i == num_frames - 1:
-                    print(
-                        "\r >  >  >  >  %d/%d processed (%d FPS)"
-                        % (i + 1, num_frames, self.fps)
-                    )
-            f.close()
+
+            # convert all frames at once
+            root_pos = self.__root_pos * scale # (T, 3)
+            eulers = n_quat.to_euler(self.__local_quats, rot_order, radians=False) # (T, J, 3)
+            data = np.concatenate([root_pos, eulers.reshape(num_frames, -1)], axis=-1) # (T, 3 + 3J)
+            np.savetxt(f, data, fmt="%f", delimiter=" ", newline=" \n")
+
+            if verbose:
+                print(" >  >  >  >  %d/%d processed (%d FPS)" % (num_frames, num_frames, self.fps))
 
     def _write_hierarchy(self, file, skeleton, joint_idx, scale=1.0, rot_order="XYZ", tab=""):
         def rot_order_to_str(order):
@@ -209,24 +476,86 @@ class Motion:
 
     #     return Rotation.from_quat(modifiedQ).as_euler(order, degrees=degrees)
     
-    def mirror(self, pair_indices, sym_axis=None):
-        local_quats = np.stack([pose.local_quats for pose in self.__poses], axis=0)
-        root_pos = np.stack([pose.root_pos for pose in self.__poses], axis=0)
-
-        # swap joint indices
-        local_quats = local_quats[:, pair_indices]
-
-        # mirror by symmetry axis
-        if sym_axis is None:
-            sym_axis = self.skeleton.find_symmetry_axis(pair_indices)
-        else:
-            assert sym_axis in ["x", "y", "z"], f"Invalid axis {sym_axis} for symmetry axis, must be one of ['x', 'y', 'z']"
-
-        idx = {"x": 0, "y": 1, "z": 2}[sym_axis]
-        local_quats[:, :, (0, idx+1)] *= -1
-        root_pos[:, idx] *= -1
-
-        mirrored_poses = []
-        for i in range(len(self.__poses)):
-            mirrored_poses.append(Pose(self.skeleton, local_quats[i], root_pos[i]))
-        return Motion(mirrored_poses, self.fps, str(self.__name) + "_mirrored")
+    def mirror(self, pair_indices=None, sym_axis=None):
+        """
+        Mirrored motion. Pair indices and the symmetry axis are taken from the skeleton cache if not given.
+        """
+        local_quats, root_pos = motionops.mirror(self.__local_quats, self.__root_pos, self.__skeleton, pair_indices, sym_axis)
+        return Motion.from_numpy(self.__skeleton, local_quats, root_pos, self.fps, str(self.__name) + "_mirrored")
+
+
+    def scaled(self, scale_factor, **kwargs):
+        """
+        Motion scaled on the xz-plane with the feet adjusted by two-bone IK, or None if the scale factor is not proper.
+        See motionops.scale_motions() for the options.
+        """
+        return motionops.scaled_motion(self, scale_factor, **kwargs)
+
+
+    def features(self, future_frames=(10, 20, 30)):
+        """
+        Features of all frames in one batched pass. See featureops.motion_features().
+        """
+        global_quats, global_pos = n_quat.fk(self.__local_quats, self.__root_pos, self.__skeleton)
+        return featureops.motion_features(global_quats, global_pos, self.__skeleton, self.fps, future_frames)
+
+
+    def contacts(self, feet=featureops.FOOT_JOINTS, heightmap=None, **kwargs):
+        """
+        Foot contact labels of all frames. (T, F) See featureops.foot_contacts() for the thresholds.
+        """
+        _, global_pos = n_quat.fk(self.__local_quats, self.__root_pos, self.__skeleton)
+        return featureops.foot_contacts(global_pos, self.__skeleton, feet, self.fps, heightmap=heightmap, **kwargs)
+
+
+    def encode(self, bits=32, level=None, block_size=BLOCK_SIZE) -> EncodedMotion:
+        """
+        Motion in the compact codec (see codec.py), e.g. for archival or streaming playback.
+        EncodedMotion.to_motion() decodes it back.
+
+        Args:
+            bits:       32 or 48 bits per quaternion
+            level:      zlib compression level of blocks of frames, or None to keep the frames uncompressed
+            block_size: the number of frames per compressed block
+        """
+        return EncodedMotion.from_motion(self, bits, level, block_size)
+
+
+    def reduce_keys(self, rot_tol=1e-3, pos_tol=1e-3, method="linear") -> KeyframedMotion:
+        """
+        Motion reduced to keyframes within the tolerances (see keyframe.py).
+        KeyframedMotion.decode() decompresses any range of frames.
+
+        Args:
+            rot_tol: tolerance of each log-map channel of the joint rotations in radians
+            pos_tol: tolerance of each root position channel
+            method:  "linear" or "cubic" interpolation between keys
+        """
+        return KeyframedMotion.from_motion(self, rot_tol, pos_tol, method)
+
+
+    def two_bone_ik(self, effectors, targets, poles=None):
+        """
+        Two-bone IK of all frames at once. Local rotations are updated in place. See ikops.two_bone_ik().
+
+        Args:
+            effectors: L names or indices of the effector joints
+            targets:   (T, L, 3) target positions of the effectors
+            poles:     (T, L, 3) directions in which the mid joints bend when the limbs are straight, or None
+        """
+        ikops.two_bone_ik(self.__local_quats, self.__root_pos, self.__skeleton, effectors, targets, poles)
+        self._invalidate_frames(slice(None))
+
+
+    def solve_ik(self, effectors, targets, method="jacobian", **kwargs):
+        """
+        Iterative multi-effector IK of all frames at once. Local rotations are updated in place.
+        See ikops.solve_ik() for the weights and the stopping criteria.
+
+        Args:
+            effectors: L names or indices of the effector joints
+            targets:   (T, L, 3) target positions of the effectors
+            method:    "fabrik", "ccd" or "jacobian"
+        """
+        ikops.solve_ik(self.__local_quats, self.__root_pos, self.__skeleton, effectors, targets, method, **kwargs)
+        self._invalidate_frames(slice(None))
\ No newline at end of file
@@ -2,30 +2,11 @@ from __future__ import annotations
 from typing import Union
 
 import numpy as np
-from copy import deepcopy
-
-from .skeleton import Skeleton
+from .skeleton import Skeleton, FrozenSkeleton, _global_xforms_to_skeleton_xforms
 from aPyOpenGL import transforms as trf
+from aPyOpenGL.ops import motionops, ikops
 
 
-def _global_xforms_to_skeleton_xforms(global_xforms, parent_idx):
-    noj = global_xforms.shape[0]
-
-    skeleton_xforms = np.stack([np.identity(4, dtype=np.float32) for _ in range(noj - 1)], axis=0)
-    for i in range(1, noj):
-        parent_pos = global_xforms[parent_idx[i], :3, 3]
-        
-        target_dir = global_xforms[i, :3, 3] - parent_pos
-        target_dir = target_dir / (np.linalg.norm(target_dir, axis=-1, keepdims=True) + 1e-8)
-
-        quat = trf.n_quat.between_vecs(np.array([0, 1, 0], dtype=np.float32), target_dir)
-
-        skeleton_xforms[i-1, :3, :3] = trf.n_quat.to_rotmat(quat)
-        skeleton_xforms[i-1, :3,  3] = (parent_pos + global_xforms[i, :3, 3]) / 2
-
-    return skeleton_xforms
-        
-
 class Pose:
     """
     Represents a pose of a skeleton.
@@ -33,19 +14,22 @@ class Pose:
 
     global_xforms[i] = global_xforms[parent_idx[i]] @ pre_xform[i] @ local_rots[i]
 
+    Global transformations are evaluated lazily. `set_local_quat` only marks the subtree of the modified joint dirty,
+    so that the next query re-evaluates only those joints and bones.
+
     Attributes:
-        skeleton    (Skeleton)     : The skeleton that this pose belongs to.
+        skeleton    (FrozenSkeleton): The skeleton that this pose belongs to, shared by reference.
         local_quats (numpy.ndarray): Local rotations of each joint in quaternion.
         root_pos    (numpy.ndarray): Root positoin in world space.
     """
     def __init__(
         self,
-        skeleton: Skeleton,
+        skeleton: Union[Skeleton, FrozenSkeleton],
         local_quats: Union[np.ndarray, list[np.ndarray]] = None,
         root_pos: np.ndarray = None,
     ):
         # set attributes
-        self.__skeleton    = skeleton
+        self.__skeleton    = skeleton.freeze()
         self.__local_quats = np.stack([trf.n_quat.identity()] * skeleton.num_joints, axis=0) if local_quats is None else np.array(local_quats, dtype=np.float32)
         self.__root_pos    = np.zeros(3, dtype=np.float32) if root_pos is None else np.array(root_pos, dtype=np.float32)
         
@@ -53,14 +37,35 @@ class Pose:
         if self.__skeleton.num_joints == 0:
             raise ValueError("Cannot create a pose for an empty skeleton.")
         
-        # global transformations
-        self.__global_updated = False
+        # global transformations and joints to re-evaluate
+        self.__dirty = np.ones(self.__skeleton.num_joints, dtype=bool)
+        self.__global_quats, self.__global_pos = None, None
         self.__global_xforms, self.__skeleton_xforms = None, None
-    
+
+        # motion that owns the data if this pose is a view
+        self.__motion, self.__frame = None, None
+
+
+    @classmethod
+    def _view(cls, motion, frame, skeleton, local_quats, root_pos):
+        """
+        Zero-copy view of a frame in a motion.
+        local_quats and root_pos are views of the motion buffers, so setting them writes through to the motion,
+        and global transformations are read from the motion.
+        """
+        pose = cls.__new__(cls)
+        pose.__skeleton = skeleton
+        pose.__local_quats, pose.__root_pos = local_quats, root_pos
+        pose.__dirty = np.ones(skeleton.num_joints, dtype=bool)
+        pose.__global_quats, pose.__global_pos = None, None
+        pose.__global_xforms, pose.__skeleton_xforms = None, None
+        pose.__motion, pose.__frame = motion, frame
+        return pose
+
     
     @property
     def skeleton(self):
-        return deepcopy(self.__skeleton)
+        return self.__skeleton
     
     
     @property
@@ -73,78 +78,122 @@ class Pose:
         return self.__root_pos.copy()
     
 
+    @property
+    def is_view(self):
+        return self.__motion is not None
+
+
     @property
     def global_xforms(self):
-        if not self.__global_updated:
-            self.update_global_xform()
+        if self.__motion is not None:
+            return self.__motion._frame_global_xforms(self.__frame)[0].copy()
+        self.update_global_xform()
         return self.__global_xforms.copy()
     
 
     @property
     def skeleton_xforms(self):
-        if not self.__global_updated:
-            self.update_global_xform()
+        if self.__motion is not None:
+            return self.__motion._frame_global_xforms(self.__frame)[1].copy()
+        self.update_global_xform()
         return self.__skeleton_xforms.copy()
     
     
     @local_quats.setter
     def local_quats(self, value):
-        self.__local_quats = np.array(value)
-        self.__global_updated = False
+        self.__local_quats[...] = value
+        self.__mark_modified()
 
     
     @root_pos.setter
     def root_pos(self, value):
-        self.__root_pos = np.array(value)
-        self.__global_updated = False
+        self.__root_pos[...] = value
+        self.__mark_modified()
+
+
+    def set_local_quat(self, joint_idx, quat):
+        """
+        Sets the local rotation of one or more joints and marks only their subtrees dirty.
+
+        Args:
+            joint_idx: index or indices of the joints
+            quat: (4,) or (len(joint_idx), 4) local rotations
+        """
+        joint_idx = np.atleast_1d(np.asarray(joint_idx, dtype=np.int64))
+        self.__local_quats[joint_idx] = quat
+        self.__mark_modified(joint_idx)
+
+
+    def __mark_modified(self, joint_idx=None):
+        if self.__motion is not None:
+            self.__motion._invalidate_frames(self.__frame)
+
+        if joint_idx is None:
+            self.__dirty[:] = True
+            return
+
+        tables = self.__skeleton.kinematic_tables
+        for jidx in joint_idx:
+            self.__dirty[tables.subtree(jidx)] = True
 
     
     def update_global_xform(self):
-        if self.__global_updated:
+        if self.__motion is not None:
+            self.__motion._frame_global_xforms(self.__frame)
             return
-        
-        # update global xform
-        gq, gp = trf.n_quat.fk(self.__local_quats, self.__root_pos, self.__skeleton)
-        gr = trf.n_quat.to_rotmat(gq)
-        gx = np.stack([np.identity(4, dtype=np.float32) for _ in range(self.__skeleton.num_joints)], axis=0)
-        gx[:, :3, :3] = gr
-        gx[:, :3,  3] = gp
+        if not self.__dirty.any():
+            return
+
+        skeleton = self.__skeleton
+        if self.__global_quats is None or self.__dirty.all():
+            # update every joint
+            gq, gp = trf.n_quat.fk(self.__local_quats, self.__root_pos, skeleton)
+            gx = np.stack([np.identity(4, dtype=np.float32) for _ in range(skeleton.num_joints)], axis=0)
+            trf.n_quat.to_rotmat(gq, out=gx[:, :3, :3])
+            gx[:, :3,  3] = gp
+
+            self.__global_quats, self.__global_pos = gq, gp
+            self.__global_xforms = gx
+            self.__skeleton_xforms = _global_xforms_to_skeleton_xforms(gx, skeleton.parent_idx)
+        else:
+            # update dirty joints only, level by level
+            gq, gp, dirty = self.__global_quats, self.__global_pos, self.__dirty
+            if dirty[0]:
+                gq[0] = trf.n_quat.mul(skeleton.pre_quats[0], self.__local_quats[0])
+                gp[0] = self.__root_pos
 
-        self.__global_xforms = gx
+            levels = [(joints[mask], parents[mask]) for joints, parents in skeleton.depth_levels if (mask := dirty[joints]).any()]
+            trf.n_kinematics.propagate(gq, gp, self.__local_quats, skeleton.pre_quats, skeleton.offsets, levels, trf.n_quat.mul, trf.n_quat.mul_vec)
 
-        # update skeleton xform
-        self.__skeleton_xforms = _global_xforms_to_skeleton_xforms(self.__global_xforms, self.__skeleton.parent_idx)
+            joints = np.nonzero(dirty)[0]
+            self.__global_xforms[joints, :3, :3] = trf.n_quat.to_rotmat(gq[joints])
+            self.__global_xforms[joints, :3,  3] = gp[joints]
+            _global_xforms_to_skeleton_xforms(self.__global_xforms, skeleton.parent_idx, joints=joints[joints > 0], out=self.__skeleton_xforms)
 
-        self.__global_updated = True
+        self.__dirty[:] = False
     
 
     def set_global_xform(self, global_xforms, skeleton_xforms):
+        if self.__motion is not None:
+            raise RuntimeError("Global transformations of a pose view are managed by its motion.")
         self.__global_xforms = np.array(global_xforms, dtype=np.float32)
         self.__skeleton_xforms = np.array(skeleton_xforms, dtype=np.float32)
-        self.__global_updated = True
+        self.__global_quats, self.__global_pos = None, None
+        self.__dirty[:] = False
 
     
     def remove_joint_by_name(self, joint_name):
-        joint_indices = self.__skeleton.remove_joint_by_name(joint_name)
-        self.__local_quats = np.delete(self.__local_quats, joint_indices, axis=0)
+        if self.__motion is not None:
+            raise RuntimeError("Cannot remove a joint from a pose view. Use Motion.remove_joint_by_name instead.")
+        self.__skeleton, gather_idx = self.__skeleton.prune(joint_name)
+        self.__local_quats = self.__local_quats[gather_idx]
+        self.__dirty = np.ones(self.__skeleton.num_joints, dtype=bool)
+        self.__global_quats, self.__global_pos = None, None
 
     
-    def mirror(self, pair_indices, sym_axis=None):
-        # swap joint indices
-        local_quats = self.local_quats[pair_indices]
-        root_pos = self.root_pos
-
-        # mirror by symmetry axis
-        if sym_axis is None:
-            sym_axis = self.__skeleton.find_symmetry_axis(pair_indices)
-        else:
-            assert sym_axis in ["x", "y", "z"], f"Invalid axis {sym_axis} for symmetry axis, must be one of ['x', 'y', 'z']"
-        
-        idx = {"x": 0, "y": 1, "z": 2}[sym_axis]
-        local_quats[:, (0, idx+1)] *= -1
-        root_pos[idx] *= -1
-
-        return Pose(deepcopy(self.__skeleton), local_quats, root_pos)
+    def mirror(self, pair_indices=None, sym_axis=None):
+        local_quats, root_pos = motionops.mirror(self.__local_quats, self.__root_pos, self.__skeleton, pair_indices, sym_axis)
+        return Pose(self.__skeleton, local_quats, root_pos)
 
     
     @classmethod
@@ -155,38 +204,31 @@ class Pose:
     def from_torch(cls, skeleton, local_quats, root_pos):
         return cls(skeleton, local_quats.cpu().numpy(), root_pos.cpu().numpy())
 
-    # """ IK functions """
-    # def two_bone_ik(self, base_idx, effector_idx, target_p, eps=1e-8, facing="forward"):
-    #     mid_idx = self.__skeleton.parent_idx[effector_idx]
-    #     if self.__skeleton.parent_idx[mid_idx] != base_idx:
-    #         raise ValueError(f"{base_idx} and {effector_idx} are not in a two bone IK hierarchy")
-
-    #     a = self.global_p[base_idx]
-    #     b = self.global_p[mid_idx]
-    #     c = self.global_p[effector_idx]
-
-    #     global_a_R = self.global_R[base_idx]
-    #     global_b_R = self.global_R[mid_idx]
-
-    #     lab = np.linalg.norm(b - a)
-    #     lcb = np.linalg.norm(b - c)
-    #     lat = np.clip(np.linalg.norm(target_p - a), eps, lab + lcb - eps)
-
-    #     ac_ab_0 = np.arccos(np.clip(np.dot(mathops.normalize(c - a), mathops.normalize(b - a)), -1, 1))
-    #     ba_bc_0 = np.arccos(np.clip(np.dot(mathops.normalize(a - b), mathops.normalize(c - b)), -1, 1))
-    #     ac_at_0 = np.arccos(np.clip(np.dot(mathops.normalize(c - a), mathops.normalize(target_p - a)), -1, 1))
-
-    #     ac_ab_1 = np.arccos(np.clip((lcb*lcb - lab*lab - lat*lat) / (-2*lab*lat), -1, 1))
-    #     ba_bc_1 = np.arccos(np.clip((lat*lat - lab*lab - lcb*lcb) / (-2*lab*lcb), -1, 1))
-
-    #     axis_0 = mathops.normalize(np.cross(c - a, self.forward if facing == "forward" else -self.forward))
-    #     axis_1 = mathops.normalize(np.cross(c - a, target_p - a))
-
-    #     r0 = rotation.A_to_R(ac_ab_1 - ac_ab_0, rotation.R_inv(global_a_R) @ axis_0)
-    #     r1 = rotation.A_to_R(ba_bc_1 - ba_bc_0, rotation.R_inv(global_b_R) @ axis_0)
-    #     r2 = rotation.A_to_R(ac_at_0, rotation.R_inv(global_a_R) @ axis_1)
-
-    #     self.local_R[base_idx] = self.local_R[base_idx] @ r0 @ r2
-    #     self.local_R[mid_idx] = self.local_R[mid_idx] @ r1
-
-    #     self.update()
\ No newline at end of file
+    """ IK functions """
+    def two_bone_ik(self, effectors, targets, poles=None):
+        """
+        Two-bone IK of one or more limbs. Only the subtrees of the modified base joints are marked dirty.
+        See ikops.two_bone_ik().
+
+        Args:
+            effectors: L names or indices of the effector joints
+            targets:   (L, 3) target positions of the effectors
+            poles:     (L, 3) directions in which the mid joints bend when the limbs are straight, or None
+        """
+        base_idx, _, _ = ikops.two_bone_chains(self.__skeleton, effectors)
+        ikops.two_bone_ik(self.__local_quats, self.__root_pos, self.__skeleton, effectors, np.reshape(targets, (-1, 3)),
+                          None if poles is None else np.reshape(poles, (-1, 3)))
+        self.__mark_modified(base_idx)
+
+
+    def solve_ik(self, effectors, targets, method="jacobian", **kwargs):
+        """
+        Iterative multi-effector IK. See ikops.solve_ik().
+
+        Args:
+            effectors: L names or indices of the effector joints
+            targets:   (L, 3) target positions of the effectors
+            method:    "fabrik", "ccd" or "jacobian"
+        """
+        ikops.solve_ik(self.__local_quats, self.__root_pos, self.__skeleton, effectors, np.reshape(targets, (-1, 3)), method, **kwargs)
+        self.__mark_modified()
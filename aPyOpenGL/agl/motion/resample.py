@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+import numpy as np
+
+from aPyOpenGL.transforms import n_quat
+
+EPSILON = 1e-6
+
+def decimation_step(src_fps, dst_fps):
+    """
+    Integer step k if dst_fps = src_fps / k, otherwise None.
+    """
+    ratio = src_fps / dst_fps
+    step = int(round(ratio))
+    return step if step >= 1 and abs(ratio - step) < EPSILON else None
+
+
+def resample_indices(num_frames, src_fps, dst_fps):
+    """
+    Source frames and interpolation weights of each frame at the target frame rate.
+    The first frame is kept, and the last target frame does not go beyond the last source frame.
+
+    Returns:
+        idx0 (np.ndarray): (T',) source frame before each target frame
+        idx1 (np.ndarray): (T',) source frame after each target frame
+        t    (np.ndarray): (T',) interpolation weight in [0, 1), 0 where a target frame falls on a source frame
+    """
+    if src_fps <= 0 or dst_fps <= 0:
+        raise ValueError(f"Frame rates must be positive, but got {src_fps} and {dst_fps}.")
+
+    ratio = src_fps / dst_fps
+    nof = int(np.floor((num_frames - 1) / ratio + EPSILON)) + 1
+    times = np.arange(nof, dtype=np.float64) * ratio
+
+    idx0 = np.minimum(np.floor(times + EPSILON).astype(np.int64), num_frames - 1)
+    idx1 = np.minimum(idx0 + 1, num_frames - 1)
+    t = np.clip(times - idx0, 0.0, 1.0)
+    t[t < EPSILON] = 0.0
+
+    return idx0, idx1, t.astype(np.float32)
+
+
+def resample(local_quats, root_pos, idx0, idx1, t):
+    """
+    Slerps local rotations and lerps root positions of all joints and frames at once.
+    Target frames that fall on source frames are copied without interpolation.
+
+    Args:
+        local_quats: (T, J, 4)
+        root_pos:    (T, 3)
+        idx0, idx1, t: output of resample_indices()
+    Returns:
+        local_quats: (T', J, 4)
+        root_pos:    (T', 3)
+    """
+    res_quats = local_quats[idx0]
+    res_pos   = root_pos[idx0]
+
+    interp = np.nonzero(t > 0)[0]
+    if len(interp) > 0:
+        i0, i1, w = idx0[interp], idx1[interp], t[interp]
+        res_quats[interp] = n_quat.slerp(local_quats[i0], local_quats[i1], w[:, None])
+        res_pos[interp]   = root_pos[i0] + (root_pos[i1] - root_pos[i0]) * w[:, None]
+
+    return res_quats, res_pos
@@ -1,12 +1,214 @@
 from __future__ import annotations
 
 import numpy as np
+from types import MappingProxyType
 
 from .joint import Joint
+from aPyOpenGL.transforms import n_quat, n_xform, n_kinematics
+
+
+def _readonly(array):
+    array.flags.writeable = False
+    return array
+
+
+def _find_symmetry_axis(offsets, pair_indices):
+    assert len(offsets) == len(pair_indices), f"number of pair indices {len(pair_indices)} must be same with the number of joints {len(offsets)}"
+
+    offsets = offsets - offsets[pair_indices]
+
+    x = np.max(np.abs(offsets[:, 0]))
+    y = np.max(np.abs(offsets[:, 1]))
+    z = np.max(np.abs(offsets[:, 2]))
+    
+    if x > y and x > z:
+        axis = "x"
+    elif y > x and y > z:
+        axis = "y"
+    elif z > x and z > y:
+        axis = "z"
+    else:
+        raise Exception("Symmetry axis not found")
+    
+    return axis
+
+
+def _joint_mask(skeleton, joints):
+    """
+    Boolean mask (J,) of the joints given by names, indices, or a boolean mask.
+    """
+    if isinstance(joints, np.ndarray) and joints.dtype == bool:
+        return joints.copy()
+    if isinstance(joints, (str, int, np.integer)):
+        joints = [joints]
+
+    mask = np.zeros(skeleton.num_joints, dtype=bool)
+    for joint in joints:
+        if isinstance(joint, str):
+            if joint not in skeleton.idx_by_name:
+                raise ValueError(f"Joint {joint} does not exist.")
+            joint = skeleton.idx_by_name[joint]
+        mask[joint] = True
+    return mask
+
+
+def _with_ancestors(parent_idx, mask):
+    mask = np.array(mask, dtype=bool)
+    for i in range(len(parent_idx) - 1, 0, -1):
+        if mask[i]:
+            mask[parent_idx[i]] = True
+    return mask
+
+
+def _prune(parent_idx, remove):
+    """
+    Removes the masked joints and all their descendants in O(J).
+
+    Args:
+        parent_idx: (J,) parent indices, where parents come before their children
+        remove: (J,) boolean mask of the joints to remove
+    Returns:
+        keep:       (J',) indices of the remaining joints, i.e. the gather index for (..., J, ...) arrays
+        parent_idx: (J',) parent indices of the remaining joints in the new skeleton
+    """
+    parent_idx = np.asarray(parent_idx, dtype=np.int64)
+    remove = np.array(remove, dtype=bool)
+    if remove[0]:
+        raise ValueError("Cannot remove the root joint.")
+
+    for i in range(1, len(parent_idx)):
+        remove[i] |= remove[parent_idx[i]]
+
+    keep = np.nonzero(~remove)[0]
+    remap = np.full(len(parent_idx), -1, dtype=np.int64)
+    remap[keep] = np.arange(len(keep))
+
+    parents = parent_idx[keep]
+    return keep, np.where(parents >= 0, remap[parents], -1)
+
+
+def _global_xforms_to_skeleton_xforms(global_xforms, parent_idx, joints=None, out=None):
+    """
+    Transformations of the bones, where bone i-1 connects joint i to its parent.
+    Each bone is located at the midpoint of the two joints, with its y-axis along the bone.
+
+    Args:
+        global_xforms: (..., J, 4, 4) global transformations of the joints
+        parent_idx:    (J,) parent indices
+        joints:        child joint indices of the bones to update, all non-root joints if None
+        out:           (..., J-1, 4, 4) bone transformations to update in place, allocated if None
+    Returns:
+        skeleton_xforms: (..., J-1, 4, 4)
+    """
+    noj = global_xforms.shape[-3]
+    joints = np.arange(1, noj) if joints is None else np.asarray(joints, dtype=np.int64)
+    parents = np.asarray(parent_idx)[joints]
+
+    if out is None:
+        out = np.zeros(global_xforms.shape[:-3] + (noj - 1, 4, 4), dtype=np.float32)
+        out[..., 3, 3] = 1
+
+    global_pos = global_xforms[..., :3, 3] # (..., J, 3)
+    joint_pos  = np.take(global_pos, joints, axis=-2) # (..., B, 3)
+    parent_pos = np.take(global_pos, parents, axis=-2) # (..., B, 3)
+    quats = n_quat.between_vecs(np.array([0, 1, 0], dtype=np.float32), joint_pos - parent_pos) # (..., B, 4)
+
+    bones = out[..., joints - 1, :, :] # (..., B, 4, 4)
+    bones[..., :3, :3] = n_quat.to_rotmat(quats)
+    bones[..., :3,  3] = (parent_pos + joint_pos) / 2
+    out[..., joints - 1, :, :] = bones
+    return out
+
+
+class _KinematicTables:
+    """
+    Per-skeleton constants for kinematics, computed once as contiguous read-only arrays
+    so that FK/IK can broadcast them over any batch without tiling or conversions.
+
+    Attributes:
+        pre_quats      (np.ndarray):  Pre-rotations as quaternions (J, 4)
+        pre_rotmats    (np.ndarray):  Pre-rotations as rotation matrices (J, 3, 3)
+        offsets        (np.ndarray):  Local positions relative to the parents (J, 3)
+        bone_lengths   (np.ndarray):  Length of the bone from each non-root joint to its parent (J-1,)
+        depth          (np.ndarray):  Depth of each joint, 0 for the root (J,)
+        depth_levels   (tuple):       (joint indices, parent indices) for depth 1, 2, ...
+        dfs_order      (np.ndarray):  Joint indices in depth-first order (J,)
+        subtree_ranges (np.ndarray):  [start, stop) of each joint's subtree in dfs_order (J, 2)
+
+    Mirroring pair indices, symmetry axes and the depth levels as torch index tensors of each device are cached on their first use.
+    """
+    def __init__(self, names, pre_xforms, parent_idx, children_idx):
+        noj = len(parent_idx)
+        self.__names = tuple(names)
+        self.__pair_indices = {}
+        self.__symmetry_axes = {}
+        self.__torch_levels = {}
+
+        self.pre_quats   = _readonly(np.ascontiguousarray(n_xform.to_quat(pre_xforms)))
+        self.pre_rotmats = _readonly(np.ascontiguousarray(n_xform.to_rotmat(pre_xforms)))
+        self.offsets     = _readonly(np.ascontiguousarray(n_xform.to_translation(pre_xforms)))
+        self.bone_lengths = _readonly(np.linalg.norm(self.offsets[1:], axis=-1))
+
+        levels = n_kinematics.depth_levels(parent_idx)
+        depth = np.zeros(noj, dtype=np.int64)
+        for d, (joints, _) in enumerate(levels, start=1):
+            depth[joints] = d
+        self.depth = _readonly(depth)
+        self.depth_levels = tuple((_readonly(joints), _readonly(parents)) for joints, parents in levels)
+
+        # pre-order traversal, so that every subtree is a contiguous range
+        dfs_order, stack = [], [0] if noj > 0 else []
+        while stack:
+            jidx = stack.pop()
+            dfs_order.append(jidx)
+            stack.extend(reversed(children_idx[jidx]))
+
+        subtree_size = np.ones(noj, dtype=np.int64)
+        for i in range(noj - 1, 0, -1):
+            subtree_size[parent_idx[i]] += subtree_size[i]
+
+        subtree_ranges = np.empty((noj, 2), dtype=np.int64)
+        subtree_ranges[dfs_order, 0] = np.arange(noj)
+        subtree_ranges[:, 1] = subtree_ranges[:, 0] + subtree_size
+        self.dfs_order = _readonly(np.array(dfs_order, dtype=np.int64))
+        self.subtree_ranges = _readonly(subtree_ranges)
+
+    def subtree(self, joint_idx):
+        start, stop = self.subtree_ranges[joint_idx]
+        return self.dfs_order[start:stop]
+
+    def pair_indices(self, left, right):
+        key = (left, right)
+        if key not in self.__pair_indices:
+            idx_by_name = { name: i for i, name in enumerate(self.__names) }
+            pairs = np.arange(len(self.__names), dtype=np.int64)
+            for i, name in enumerate(self.__names):
+                if left in name:
+                    pairs[i] = idx_by_name.get(name.replace(left, right), i)
+                elif right in name:
+                    pairs[i] = idx_by_name.get(name.replace(right, left), i)
+            self.__pair_indices[key] = _readonly(pairs)
+        return self.__pair_indices[key]
+
+    def torch_depth_levels(self, device):
+        # depth_levels as index tensors on the device, built once instead of on every torch FK call
+        import torch
+        device = torch.device(device)
+        if device not in self.__torch_levels:
+            self.__torch_levels[device] = tuple((torch.tensor(joints, device=device), torch.tensor(parents, device=device)) for joints, parents in self.depth_levels)
+        return self.__torch_levels[device]
+
+    def symmetry_axis(self, pair_indices):
+        key = tuple(int(i) for i in pair_indices)
+        if key not in self.__symmetry_axes:
+            self.__symmetry_axes[key] = _find_symmetry_axis(self.offsets, np.array(key, dtype=np.int64))
+        return self.__symmetry_axes[key]
+
 
 class Skeleton:
     """
-    Hierarchical structure of joints
+    Hierarchical structure of joints.
+    This is the mutable version used to build a skeleton. Poses and motions share its immutable snapshot from `freeze()`.
 
     Attributes:
         joints      (list[Joint]): List of joints
@@ -15,7 +217,29 @@ class Skeleton:
         parent_id   (list[int]): List of parent ids
         children_id (list[list[int]]): List of children ids
         id_by_name  (dict[str, int]): Dictionary of joint ids by name
+
+    Kinematic tables (pre_quats, pre_rotmats, offsets, bone_lengths, depth, depth_levels, dfs_order, subtree_ranges)
+    are computed on first access and recomputed after the skeleton is edited.
     """
+    @classmethod
+    def _from_parents(cls, joints: list[Joint], parent_idx) -> Skeleton:
+        """
+        Skeleton of copies of the joints, with the given parent indices.
+        """
+        skeleton = cls()
+        skeleton.__set_topology([Joint(joint.name, joint.pre_quat, joint.local_pos) for joint in joints], parent_idx)
+        return skeleton
+
+    def __set_topology(self, joints, parent_idx):
+        self.__joints = list(joints)
+        self.__parent_idx = [int(pidx) for pidx in parent_idx]
+        self.__children_idx = [[] for _ in range(len(self.__joints))]
+        for i, pidx in enumerate(self.__parent_idx):
+            if pidx >= 0:
+                self.__children_idx[pidx].append(i)
+        self.__idx_by_name = { joint.name: i for i, joint in enumerate(self.__joints) }
+        self.recompute_pre_xform()
+
     def __init__(
         self,
         joints: list[Joint] = None,
@@ -24,6 +248,8 @@ class Skeleton:
         self.__parent_idx: list[int]         = []
         self.__children_idx: list[list[int]] = []
         self.__idx_by_name: dict             = {}
+        self.__frozen: FrozenSkeleton        = None
+        self.__tables: _KinematicTables      = None
 
         if len(self.__joints) > 0:
             self.recompute_pre_xform()
@@ -51,9 +277,64 @@ class Skeleton:
     @property
     def idx_by_name(self):
         return self.__idx_by_name.copy()
+
+    @property
+    def kinematic_tables(self) -> _KinematicTables:
+        if self.__tables is None:
+            self.__tables = _KinematicTables([joint.name for joint in self.__joints], self.__pre_xforms, self.__parent_idx, self.__children_idx)
+        return self.__tables
+
+    @property
+    def pre_quats(self):
+        return self.kinematic_tables.pre_quats
+
+    @property
+    def pre_rotmats(self):
+        return self.kinematic_tables.pre_rotmats
+
+    @property
+    def offsets(self):
+        return self.kinematic_tables.offsets
+
+    @property
+    def bone_lengths(self):
+        return self.kinematic_tables.bone_lengths
+
+    @property
+    def depth(self):
+        return self.kinematic_tables.depth
+
+    @property
+    def depth_levels(self):
+        return self.kinematic_tables.depth_levels
+
+    @property
+    def dfs_order(self):
+        return self.kinematic_tables.dfs_order
+
+    @property
+    def subtree_ranges(self):
+        return self.kinematic_tables.subtree_ranges
+
+    def subtree(self, joint_idx):
+        """
+        Indices of the joint and all its descendants, in depth-first order.
+        """
+        return self.kinematic_tables.subtree(joint_idx)
     
     def recompute_pre_xform(self):
         self.__pre_xforms = np.stack([joint.pre_xform for joint in self.__joints])
+        self.__frozen = None
+        self.__tables = None
+
+    def freeze(self) -> FrozenSkeleton:
+        """
+        Immutable snapshot of this skeleton.
+        The snapshot is reused until the skeleton is modified.
+        """
+        if self.__frozen is None:
+            self.__frozen = FrozenSkeleton(self.__joints, self.__parent_idx)
+        return self.__frozen
     
     def add_joint(self, joint_name, pre_quat=None, local_pos=None, parent_idx=None):
         # add parent and children indices
@@ -81,50 +362,233 @@ class Skeleton:
         return self.remove_joint_by_idx(joint_idx)
 
     def remove_joint_by_idx(self, joint_idx):
-        remove_indices = [joint_idx]
-        
-        def dfs(jidx):
-            for cidx in self.__children_idx[jidx]:
-                remove_indices.append(cidx)
-                dfs(cidx)
-
-        dfs(joint_idx)
-        remove_indices.sort(reverse=True)
-
-        for ridx in remove_indices:
-            self.__children_idx[self.__parent_idx[ridx]].remove(ridx)
-            self.__joints.pop(ridx)
-            self.__parent_idx.pop(ridx)
-            self.__children_idx.pop(ridx)
-
-        for i in range(len(self.__joints)):
-            self.__parent_idx[i] = self.__parent_idx[i] - sum([1 for ridx in remove_indices if ridx < self.__parent_idx[i]])
-            self.__children_idx[i] = [cidx - sum([1 for ridx in remove_indices if ridx < cidx]) for cidx in self.__children_idx[i]]
-            
-        for i, joint in enumerate(self.__joints):
-            self.__idx_by_name[joint.name] = i
+        remove = np.zeros(self.num_joints, dtype=bool)
+        remove[joint_idx] = True
+        keep, parent_idx = _prune(self.__parent_idx, remove)
 
-        self.recompute_pre_xform()
+        remove_indices = sorted(set(range(self.num_joints)) - set(keep.tolist()), reverse=True)
+        self.__set_topology([self.__joints[i] for i in keep], parent_idx)
 
         return remove_indices
 
-    def find_symmetry_axis(self, pair_indices):
-        assert len(self.__joints) == len(pair_indices), f"number of pair indices {len(pair_indices)} must be same with the number of joints {len(self.__joints)}"
+    def prune(self, remove):
+        """
+        Skeleton without the given joints and their descendants. This skeleton is not modified.
 
-        offsets = self.pre_xforms[:, :3, -1].copy()
-        offsets = offsets - offsets[pair_indices]
+        Args:
+            remove: joint names or indices to remove
+        Returns:
+            skeleton (Skeleton): the pruned skeleton
+            gather_idx (np.ndarray): (J',) original indices of the remaining joints, e.g. local_quats[:, gather_idx]
+        """
+        keep, parent_idx = _prune(self.__parent_idx, _joint_mask(self, remove))
+        return Skeleton._from_parents([self.__joints[i] for i in keep], parent_idx), keep
 
-        x = np.max(np.abs(offsets[:, 0]))
-        y = np.max(np.abs(offsets[:, 1]))
-        z = np.max(np.abs(offsets[:, 2]))
-        
-        if x > y and x > z:
-            axis = "x"
-        elif y > x and y > z:
-            axis = "y"
-        elif z > x and z > y:
-            axis = "z"
+    def subset(self, keep):
+        """
+        Skeleton with only the given joints and their ancestors. This skeleton is not modified.
+
+        Args:
+            keep: joint names or indices to keep
+        Returns:
+            skeleton (Skeleton): the subset skeleton
+            gather_idx (np.ndarray): (J',) original indices of the remaining joints, e.g. local_quats[:, gather_idx]
+        """
+        return self.prune(~_with_ancestors(self.__parent_idx, _joint_mask(self, keep)))
+
+    def find_pair_indices(self, left="Left", right="Right"):
+        """
+        Index of the mirrored joint for each joint, found by swapping `left` and `right` in the joint names.
+        Joints without a counterpart are mapped to themselves. The result is cached.
+        """
+        return self.kinematic_tables.pair_indices(left, right)
+
+    def find_symmetry_axis(self, pair_indices=None):
+        """
+        Axis ("x", "y" or "z") along which the paired joints are mirrored. The result is cached.
+        """
+        if pair_indices is None:
+            pair_indices = self.find_pair_indices()
+        return self.kinematic_tables.symmetry_axis(pair_indices)
+
+
+class FrozenSkeleton:
+    """
+    Immutable and hashable skeleton that poses and motions share by reference.
+    Topology is exposed as read-only arrays, tuples and mappings, so accessing it does not copy anything.
+    Use `edit()` to get a mutable Skeleton.
+
+    Attributes:
+        joints       (tuple[Joint]):            Read-only joints
+        pre_xforms   (np.ndarray):              Pre-transformations of the joints (J, 4, 4)
+        parent_idx   (np.ndarray):              Parent indices of the joints (J,)
+        children_idx (tuple[tuple[int]]):       Children indices of the joints
+        idx_by_name  (Mapping[str, int]):       Joint indices by name
+
+    Kinematic tables (pre_quats, pre_rotmats, offsets, bone_lengths, depth, depth_levels, dfs_order, subtree_ranges)
+    are computed once on first access.
+    """
+    def __init__(
+        self,
+        joints: list[Joint],
+        parent_idx: list[int],
+    ):
+        if len(joints) != len(parent_idx):
+            raise ValueError(f"Number of joints {len(joints)} and parent indices {len(parent_idx)} must be the same.")
+
+        self.__joints = tuple(Joint(joint.name, joint.pre_quat, joint.local_pos).freeze() for joint in joints)
+        self.__parent_idx = _readonly(np.array(parent_idx, dtype=np.int64).reshape(-1))
+
+        children_idx = [[] for _ in range(len(joints))]
+        for i, pidx in enumerate(self.__parent_idx):
+            if pidx >= 0:
+                children_idx[pidx].append(i)
+        self.__children_idx = tuple(tuple(children) for children in children_idx)
+        self.__idx_by_name = MappingProxyType({ joint.name: i for i, joint in enumerate(self.__joints) })
+
+        if len(self.__joints) > 0:
+            self.__pre_xforms = _readonly(np.stack([joint.pre_xform for joint in self.__joints]))
         else:
-            raise Exception("Symmetry axis not found")
-        
-        return axis
\ No newline at end of file
+            self.__pre_xforms = _readonly(np.zeros((0, 4, 4), dtype=np.float32))
+
+        self.__key = (
+            tuple(joint.name for joint in self.__joints),
+            self.__parent_idx.tobytes(),
+            self.__pre_xforms.tobytes(),
+        )
+        self.__hash = hash(self.__key)
+        self.__tables = None
+
+    @property
+    def num_joints(self):
+        return len(self.__joints)
+
+    @property
+    def pre_xforms(self):
+        return self.__pre_xforms
+    
+    @property
+    def joints(self):
+        return self.__joints
+    
+    @property
+    def parent_idx(self):
+        return self.__parent_idx
+    
+    @property
+    def children_idx(self):
+        return self.__children_idx
+    
+    @property
+    def idx_by_name(self):
+        return self.__idx_by_name
+
+    @property
+    def kinematic_tables(self) -> _KinematicTables:
+        if self.__tables is None:
+            self.__tables = _KinematicTables([joint.name for joint in self.__joints], self.__pre_xforms, self.__parent_idx, self.__children_idx)
+        return self.__tables
+
+    @property
+    def pre_quats(self):
+        return self.kinematic_tables.pre_quats
+
+    @property
+    def pre_rotmats(self):
+        return self.kinematic_tables.pre_rotmats
+
+    @property
+    def offsets(self):
+        return self.kinematic_tables.offsets
+
+    @property
+    def bone_lengths(self):
+        return self.kinematic_tables.bone_lengths
+
+    @property
+    def depth(self):
+        return self.kinematic_tables.depth
+
+    @property
+    def depth_levels(self):
+        return self.kinematic_tables.depth_levels
+
+    @property
+    def dfs_order(self):
+        return self.kinematic_tables.dfs_order
+
+    @property
+    def subtree_ranges(self):
+        return self.kinematic_tables.subtree_ranges
+
+    def subtree(self, joint_idx):
+        """
+        Indices of the joint and all its descendants, in depth-first order.
+        """
+        return self.kinematic_tables.subtree(joint_idx)
+
+    def freeze(self):
+        return self
+
+    def edit(self) -> Skeleton:
+        """
+        Mutable copy of this skeleton.
+        """
+        return Skeleton._from_parents(self.__joints, self.__parent_idx)
+
+    def prune(self, remove):
+        """
+        Skeleton without the given joints and their descendants.
+
+        Args:
+            remove: joint names or indices to remove
+        Returns:
+            skeleton (FrozenSkeleton): the pruned skeleton
+            gather_idx (np.ndarray): (J',) original indices of the remaining joints, e.g. local_quats[:, gather_idx]
+        """
+        keep, parent_idx = _prune(self.__parent_idx, _joint_mask(self, remove))
+        return FrozenSkeleton([self.__joints[i] for i in keep], parent_idx), keep
+
+    def subset(self, keep):
+        """
+        Skeleton with only the given joints and their ancestors.
+
+        Args:
+            keep: joint names or indices to keep
+        Returns:
+            skeleton (FrozenSkeleton): the subset skeleton
+            gather_idx (np.ndarray): (J',) original indices of the remaining joints, e.g. local_quats[:, gather_idx]
+        """
+        return self.prune(~_with_ancestors(self.__parent_idx, _joint_mask(self, keep)))
+    
+    def find_pair_indices(self, left="Left", right="Right"):
+        """
+        Index of the mirrored joint for each joint, found by swapping `left` and `right` in the joint names.
+        Joints without a counterpart are mapped to themselves. The result is cached.
+        """
+        return self.kinematic_tables.pair_indices(left, right)
+
+    def find_symmetry_axis(self, pair_indices=None):
+        """
+        Axis ("x", "y" or "z") along which the paired joints are mirrored. The result is cached.
+        """
+        if pair_indices is None:
+            pair_indices = self.find_pair_indices()
+        return self.kinematic_tables.symmetry_axis(pair_indices)
+
+    def __eq__(self, other):
+        if not isinstance(other, FrozenSkeleton):
+            return NotImplemented
+        return self is other or (self.__hash == other.__hash and self.__key == other.__key)
+
+    def __hash__(self):
+        return self.__hash
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return (FrozenSkeleton, (list(self.__joints), self.__parent_idx.tolist()))
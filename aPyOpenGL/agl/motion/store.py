@@ -0,0 +1,257 @@
+from __future__ import annotations
+
+import json
+import os
+import numpy as np
+
+from .joint import Joint
+from .skeleton import FrozenSkeleton
+from . import codec
+
+"""
+On-disk motion store.
+A store is a directory with a JSON header for the skeleton and the clips,
+and one .npy file per packed array, so that it can be opened with np.memmap without reading the frames:
+
+    header.json       skeleton joints (name, parent, pre_quat, local_pos), clip names, frame rates and codec
+    local_quats.npy   (ΣT, J, 4) float32
+    root_pos.npy      (ΣT, 3) float32
+    offsets.npy       (N+1,) int64, frames of clip i are [offsets[i], offsets[i+1])
+
+With the compact codec (see codec.py), the frames are stored encoded instead of local_quats.npy and root_pos.npy:
+
+    quat_codes.npy    (ΣT, J) uint32 or (ΣT, J, 3) uint16
+    root_start.npy    (N, 3) float32 root position of the first frame of each clip
+    root_delta.npy    (ΣT, 3) float16 root offsets from the first frame of each clip
+
+and with zlib compression, the codes and the root offsets of each clip are compressed in blocks of frames:
+
+    blocks.bin        compressed blocks of all clips
+    block_offsets.npy (B+1,) int64, byte range of each block in blocks.bin
+    clip_blocks.npy   (N+1,) int64, blocks of clip i are [clip_blocks[i], clip_blocks[i+1])
+"""
+FORMAT_VERSION = 1
+HEADER_FILE    = "header.json"
+ARRAY_FILES    = {
+    "local_quats"  : "local_quats.npy",
+    "root_pos"     : "root_pos.npy",
+    "offsets"      : "offsets.npy",
+    "quat_codes"   : "quat_codes.npy",
+    "root_start"   : "root_start.npy",
+    "root_delta"   : "root_delta.npy",
+    "blocks"       : "blocks.bin",
+    "block_offsets": "block_offsets.npy",
+    "clip_blocks"  : "clip_blocks.npy",
+}
+
+def _skeleton_to_dict(skeleton: FrozenSkeleton):
+    return {
+        "names"     : [joint.name for joint in skeleton.joints],
+        "parent_idx": skeleton.parent_idx.tolist(),
+        "pre_quats" : [joint.pre_quat.tolist() for joint in skeleton.joints],
+        "local_pos" : [joint.local_pos.tolist() for joint in skeleton.joints],
+    }
+
+
+def _skeleton_from_dict(data) -> FrozenSkeleton:
+    joints = [Joint(name, pre_quat, local_pos) for name, pre_quat, local_pos in zip(data["names"], data["pre_quats"], data["local_pos"])]
+    return FrozenSkeleton(joints, data["parent_idx"])
+
+
+def _open_memmap(path, name, dtype, shape):
+    return np.lib.format.open_memmap(os.path.join(path, ARRAY_FILES[name]), mode="w+", dtype=dtype, shape=shape)
+
+
+def save(path, clips, bits=None, level=None, block_size=codec.BLOCK_SIZE):
+    """
+    Writes clips into a store directory. Clips are written one by one into memory-mapped files,
+    so that a list of motions does not have to be packed in memory first.
+
+    Args:
+        path:       directory of the store, created if it does not exist
+        clips:      MotionDataset or list of Motions with the same skeleton
+        bits:       32 or 48 to store quaternions in the compact codec, or None for float32
+        level:      zlib compression level of blocks of encoded frames, or None. Requires bits.
+        block_size: the number of frames per compressed block
+    """
+    clips = list(clips)
+    if len(clips) == 0:
+        raise ValueError("Cannot save a store without clips.")
+    if level is not None and bits is None:
+        raise ValueError("zlib compression requires the compact codec, but bits is None.")
+
+    skeleton = clips[0].skeleton
+    for clip in clips[1:]:
+        if clip.skeleton != skeleton:
+            raise ValueError(f"All clips must share the same skeleton, but {clip.name} does not.")
+
+    lengths = np.array([clip.num_frames for clip in clips], dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    nof     = int(offsets[-1])
+    noj     = skeleton.num_joints
+
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, ARRAY_FILES["offsets"]), offsets)
+
+    if bits is None:
+        local_quats = _open_memmap(path, "local_quats", np.float32, (nof, noj, 4))
+        root_pos    = _open_memmap(path, "root_pos", np.float32, (nof, 3))
+        for i, clip in enumerate(clips):
+            local_quats[offsets[i]:offsets[i+1]] = clip.local_quats
+            root_pos[offsets[i]:offsets[i+1]]    = clip.root_pos
+        local_quats.flush()
+        root_pos.flush()
+        del local_quats, root_pos
+
+    else:
+        shape, dtype = codec.code_shape(bits)
+        root_start = np.empty((len(clips), 3), dtype=np.float32)
+        if level is None:
+            codes      = _open_memmap(path, "quat_codes", dtype, (nof, noj) + shape)
+            root_delta = _open_memmap(path, "root_delta", np.float16, (nof, 3))
+        else:
+            block_offsets, clip_blocks = [0], [0]
+            blocks = open(os.path.join(path, ARRAY_FILES["blocks"]), "wb")
+
+        for i, clip in enumerate(clips):
+            clip_codes = codec.encode_quats(clip.local_quats, bits)
+            root_start[i], clip_delta = codec.encode_root_pos(clip.root_pos)
+            if level is None:
+                codes[offsets[i]:offsets[i+1]]      = clip_codes
+                root_delta[offsets[i]:offsets[i+1]] = clip_delta
+            else:
+                for block in codec.compress_blocks([clip_codes, clip_delta], block_size, level):
+                    blocks.write(block)
+                    block_offsets.append(block_offsets[-1] + len(block))
+                clip_blocks.append(len(block_offsets) - 1)
+
+        np.save(os.path.join(path, ARRAY_FILES["root_start"]), root_start)
+        if level is None:
+            codes.flush()
+            root_delta.flush()
+            del codes, root_delta
+        else:
+            blocks.close()
+            np.save(os.path.join(path, ARRAY_FILES["block_offsets"]), np.array(block_offsets, dtype=np.int64))
+            np.save(os.path.join(path, ARRAY_FILES["clip_blocks"]), np.array(clip_blocks, dtype=np.int64))
+
+    header = {
+        "version" : FORMAT_VERSION,
+        "skeleton": _skeleton_to_dict(skeleton),
+        "names"   : [clip.name for clip in clips],
+        "fps"     : [float(clip.fps) for clip in clips],
+        "codec"   : None if bits is None else {"bits": bits, "level": level, "block_size": block_size},
+    }
+    with open(os.path.join(path, HEADER_FILE), "w") as f:
+        json.dump(header, f)
+
+
+class EncodedFrames:
+    """
+    Frames of a store in the compact codec, decoded on demand.
+    The codes and the root offsets (or the compressed blocks) stay memory-mapped,
+    and only the frames that are asked for (or the blocks that cover them) are read and decoded.
+
+    Attributes:
+        bits        (int)          : Bits per quaternion, 32 or 48.
+        offsets     (numpy.ndarray): Clip boundaries. (N+1,)
+        num_joints  (int)          : The number of joints.
+    """
+    def __init__(self, bits, offsets, num_joints, root_start, codes=None, root_delta=None, blocks=None, clip_blocks=None, block_size=codec.BLOCK_SIZE):
+        self.bits         = bits
+        self.offsets      = offsets
+        self.num_joints   = num_joints
+        self.__root_start = root_start
+        self.__codes      = codes
+        self.__root_delta = root_delta
+        self.__blocks     = blocks
+        self.__clip_blocks = clip_blocks
+        self.__block_size = block_size
+
+    @property
+    def num_frames(self):
+        return int(self.offsets[-1])
+
+    def decode(self, frames=slice(None)):
+        """
+        Decodes the given frames, an integer, a slice, or an array of frame indices.
+
+        Returns:
+            local_quats: (..., J, 4)
+            root_pos:    (..., 3)
+        """
+        index = np.arange(*frames.indices(self.num_frames)) if isinstance(frames, slice) else np.asarray(frames, dtype=np.int64)
+        flat = index.reshape(-1)
+        flat = np.where(flat < 0, flat + self.num_frames, flat)
+        clip = np.searchsorted(self.offsets, flat, side="right") - 1
+
+        if self.__blocks is None:
+            select = frames if isinstance(frames, slice) else flat # slices of a memmap read contiguous pages
+            codes, root_delta = self.__codes[select], self.__root_delta[select]
+        else:
+            shape, dtype = codec.code_shape(self.bits)
+            specs = [((self.num_joints,) + shape, dtype), ((3,), np.float16)]
+            codes = np.empty((len(flat), self.num_joints) + shape, dtype=dtype)
+            root_delta = np.empty((len(flat), 3), dtype=np.float16)
+
+            # the range of frames asked for in each clip, from the blocks that cover it
+            for c in np.unique(clip):
+                mask = clip == c
+                local = flat[mask] - self.offsets[c]
+                lo, hi = int(local.min()), int(local.max()) + 1
+                clip_codes, clip_delta = codec.decompress_blocks(
+                    self.__blocks[self.__clip_blocks[c]:self.__clip_blocks[c+1]], specs,
+                    int(self.offsets[c+1] - self.offsets[c]), self.__block_size, lo, hi
+                )
+                codes[mask], root_delta[mask] = clip_codes[local - lo], clip_delta[local - lo]
+
+        local_quats = codec.decode_quats(codes, self.bits)
+        root_pos    = codec.decode_root_pos(self.__root_start[clip], root_delta)
+        return local_quats.reshape(index.shape + local_quats.shape[1:]), root_pos.reshape(index.shape + (3,))
+
+
+def _load_encoded(path, header, offsets, num_joints, mmap_mode):
+    bits, level, block_size = header["codec"]["bits"], header["codec"]["level"], header["codec"]["block_size"]
+    root_start = np.load(os.path.join(path, ARRAY_FILES["root_start"]))
+
+    if level is None:
+        codes      = np.load(os.path.join(path, ARRAY_FILES["quat_codes"]), mmap_mode=mmap_mode)
+        root_delta = np.load(os.path.join(path, ARRAY_FILES["root_delta"]), mmap_mode=mmap_mode)
+        return EncodedFrames(bits, offsets, num_joints, root_start, codes=codes, root_delta=root_delta)
+
+    blocks_path = os.path.join(path, ARRAY_FILES["blocks"])
+    if mmap_mode is None or os.path.getsize(blocks_path) == 0:
+        with open(blocks_path, "rb") as f:
+            data = f.read()
+    else:
+        data = np.memmap(blocks_path, dtype=np.uint8, mode="r")
+    block_offsets = np.load(os.path.join(path, ARRAY_FILES["block_offsets"]))
+    clip_blocks   = np.load(os.path.join(path, ARRAY_FILES["clip_blocks"]))
+    blocks = [data[block_offsets[b]:block_offsets[b+1]] for b in range(len(block_offsets) - 1)]
+    return EncodedFrames(bits, offsets, num_joints, root_start, blocks=blocks, clip_blocks=clip_blocks, block_size=block_size)
+
+
+def load(path, mmap_mode="r"):
+    """
+    Opens a store as a MotionDataset.
+    With a mmap_mode ("r", "r+" or "c", see np.load), the frames are memory-mapped and only the pages that are accessed are read,
+    so that processes opening the same store share the page cache. With None, the frames are read into memory.
+    Stores in the compact codec keep the encoded frames memory-mapped in the same way (see EncodedFrames),
+    and the dataset decodes only the frames that are accessed, e.g. a clip or a batch of windows.
+    """
+    from .dataset import MotionDataset
+
+    with open(os.path.join(path, HEADER_FILE), "r") as f:
+        header = json.load(f)
+    if header.get("version", None) != FORMAT_VERSION:
+        raise ValueError(f"Unsupported motion store version {header.get('version', None)} in {path}.")
+
+    skeleton = _skeleton_from_dict(header["skeleton"])
+    offsets  = np.load(os.path.join(path, ARRAY_FILES["offsets"]))
+    if header.get("codec", None) is not None:
+        frames = _load_encoded(path, header, offsets, skeleton.num_joints, mmap_mode)
+        return MotionDataset._from_encoded(skeleton, frames, header["names"], header["fps"])
+
+    local_quats = np.load(os.path.join(path, ARRAY_FILES["local_quats"]), mmap_mode=mmap_mode)
+    root_pos    = np.load(os.path.join(path, ARRAY_FILES["root_pos"]), mmap_mode=mmap_mode)
+    return MotionDataset(skeleton, local_quats, root_pos, offsets, header["names"], header["fps"])
@@ -195,16 +195,16 @@ class Render:
     
     @staticmethod
     def skeleton(pose: Pose, render_mode="pbr"):
-        skeleton_xforms = pose.skeleton_xforms()
+        skeleton = pose.skeleton
+        skeleton_xforms = pose.skeleton_xforms
 
-        ro = Render.pyramid(radius=1, height=1, render_mode=render_mode).instance_num(pose.skeleton.num_joints - 1)
+        ro = Render.pyramid(radius=1, height=1, render_mode=render_mode).instance_num(skeleton.num_joints - 1)
 
         positions, orientations, scales = [], [], []
-        for idx, joint in enumerate(pose.skeleton.joints[1:]):
+        for idx, bone_len in enumerate(skeleton.bone_lengths.tolist()):
             positions.append(glm.vec3(skeleton_xforms[idx, :3, 3].ravel()))
             orientations.append(glm.mat3(*skeleton_xforms[idx, :3, :3].T.ravel()))
 
-            bone_len = np.linalg.norm(joint.local_pos)
             radius = max(min(bone_len, 1), 0.1) * 0.1
             scales.append(glm.vec3(radius, bone_len, radius))
         
@@ -857,7 +857,7 @@ class RenderOptionsVec:
 
     def update_skeleton(self, model: Model):
         """ Only used for Render.skeleton """
-        xforms = model.pose.skeleton_xforms()
+        xforms = model.pose.skeleton_xforms
         for idx, option in enumerate(self.options):
             position = glm.vec3(*xforms[idx, :3, 3].ravel())
             orientation = glm.mat3(*xforms[idx, :3, :3].T.ravel())
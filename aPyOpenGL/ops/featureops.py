@@ -0,0 +1,325 @@
+import torch
+import numpy as np
+
+"""
+Batched motion features for learning, in numpy and torch.
+The world up axis is y, and the root faces +z when its local rotation is identity (see agl/motion/blend.py).
+
+Features are expressed in the facing frame of each frame: the origin is the root projected onto the xz-plane,
+the z-axis is the facing direction, and the y-axis is up.
+Inputs are global rotations and positions of shape (..., T, J, *) from n_quat.fk() or t_quat.fk(), where T is the time axis.
+For a packed dataset buffer (ΣT, J, *), `offsets` gives the clip boundaries so that no feature crosses clips.
+
+Numpy and torch versions run the same sequence of element-wise operations on the same indices,
+so that they give the same results for the same float32 inputs. Square roots and arctangents are evaluated in double precision,
+since the vectorized float32 kernels of the two libraries round differently.
+"""
+
+####################################################################################
+
+def _is_torch(x):
+    if isinstance(x, torch.Tensor):
+        return True
+    elif isinstance(x, np.ndarray):
+        return False
+    else:
+        raise TypeError(f"Type must be torch.Tensor or numpy.ndarray, but got {type(x)}")
+
+def _take(x, idx, axis):
+    # idx: (N,) numpy int64 indices along axis
+    if _is_torch(x):
+        return torch.index_select(x, axis % x.ndim, torch.tensor(idx, device=x.device))
+    return np.take(x, idx, axis=axis)
+
+def _like(values, x):
+    if _is_torch(x):
+        return torch.tensor(values, dtype=x.dtype, device=x.device)
+    return np.asarray(values, dtype=x.dtype)
+
+def _stack(xs, axis):
+    return torch.stack(xs, dim=axis) if _is_torch(xs[0]) else np.stack(xs, axis=axis)
+
+def _sqrt(x):
+    if _is_torch(x):
+        return torch.sqrt(x.double()).to(x.dtype)
+    return np.sqrt(x.astype(np.float64)).astype(x.dtype)
+
+def _atan2(y, x):
+    if _is_torch(y):
+        return torch.atan2(y.double(), x.double()).to(y.dtype)
+    return np.arctan2(y.astype(np.float64), x.astype(np.float64)).astype(y.dtype)
+
+def _where(cond, x, y):
+    return torch.where(cond, x, y) if _is_torch(cond) else np.where(cond, x, y)
+
+def _cummax(x, axis):
+    return torch.cummax(x, dim=axis).values if _is_torch(x) else np.maximum.accumulate(x, axis=axis)
+
+def _per_frame(values, like, trailing):
+    # scalar or (T,) per-frame values broadcastable to (..., T, *trailing)
+    if np.ndim(values) == 0:
+        return float(values)
+    values = np.asarray(values, dtype=np.float32).reshape((-1,) + (1,) * trailing)
+    return torch.tensor(values, dtype=like.dtype, device=like.device) if _is_torch(like) else values.astype(like.dtype)
+
+####################################################################################
+
+def time_indices(num_frames, offsets=None):
+    """
+    Frame indices for backward differences and future samples that do not cross clip boundaries.
+
+    Args:
+        num_frames: the number of frames T
+        offsets:    (N+1,) clip boundaries, or None for a single clip
+    Returns:
+        prev:     (T,) v[t] = x[curr[t]] - x[prev[t]], the first frame of a clip takes the difference of its next frame
+        curr:     (T,)
+        clip_end: (T,) last frame of the clip of each frame
+    """
+    offsets = np.array([0, num_frames], dtype=np.int64) if offsets is None else np.asarray(offsets, dtype=np.int64)
+    lengths = np.diff(offsets)
+    clip_end = np.repeat(offsets[1:] - 1, lengths)
+
+    curr = np.arange(num_frames, dtype=np.int64)
+    prev = curr - 1
+    starts = offsets[:-1][lengths > 0]
+    prev[starts] = starts
+    curr[starts] = np.minimum(starts + 1, clip_end[starts])
+    return prev, curr, clip_end
+
+####################################################################################
+
+def facing_directions(global_root_quats, skeleton):
+    """
+    Args:
+        global_root_quats: (..., T, 4) global rotations of the root
+        skeleton: skeleton of the motion
+    Returns:
+        facing directions (..., T, 3), unit vectors on the xz-plane
+    """
+    # forward in the root's local frame, i.e. pre_quat^-1 * +z
+    w, x, y, z = [float(c) for c in skeleton.pre_quats[0]]
+    forward = (2 * (x*z - w*y), 2 * (y*z + w*x), w*w - x*x - y*y + z*z)
+
+    # q * forward, same as quat.mul_vec written per component
+    q = global_root_quats
+    qw, qx, qy, qz = q[..., 0], q[..., 1], q[..., 2], q[..., 3]
+    vx, vy, vz = forward
+    tx = 2.0 * (qy * vz - qz * vy)
+    ty = 2.0 * (qz * vx - qx * vz)
+    tz = 2.0 * (qx * vy - qy * vx)
+    fx = vx + qw * tx + (qy * tz - qz * ty)
+    fz = vz + qw * tz + (qx * ty - qy * tx)
+
+    norm = _sqrt(fx * fx + fz * fz) + 1e-8
+    fx, fz = fx / norm, fz / norm
+    return _stack([fx, fz * 0.0, fz], axis=-1)
+
+
+def to_facing_frame(vectors, facing):
+    """
+    Rotates world vectors into the facing frame.
+
+    Args:
+        vectors: (..., T, *, 3)
+        facing:  (..., T, 3) broadcastable to vectors without the * axes
+    Returns:
+        vectors in the facing frame (..., T, *, 3)
+    """
+    extra = vectors.ndim - facing.ndim
+    fx = facing[..., 0].reshape(facing.shape[:-1] + (1,) * extra)
+    fz = facing[..., 2].reshape(facing.shape[:-1] + (1,) * extra)
+    x, y, z = vectors[..., 0], vectors[..., 1], vectors[..., 2]
+    return _stack([x * fz - z * fx, y, x * fx + z * fz], axis=-1)
+
+####################################################################################
+
+def root_relative_positions(global_pos, facing):
+    """
+    Joint positions relative to the root projected onto the xz-plane, in the facing frame. (..., T, J, 3)
+    """
+    base = global_pos[..., 0:1, :] * _like([1.0, 0.0, 1.0], global_pos)
+    return to_facing_frame(global_pos - base, facing)
+
+
+def velocities(values, fps=30.0, offsets=None, axis=-3):
+    """
+    Backward differences along the time axis, scaled by the frame rate. See time_indices().
+
+    Args:
+        values: (..., T, ...) per-frame values
+        fps:    float or (T,) per-frame frame rates
+        axis:   time axis
+    """
+    prev, curr, _ = time_indices(values.shape[axis], offsets)
+    diff = _take(values, curr, axis) - _take(values, prev, axis)
+    return diff * _per_frame(fps, values, -axis - 1)
+
+
+def root_relative_velocities(global_pos, facing, fps=30.0, offsets=None):
+    """
+    Joint velocities in the facing frame. (..., T, J, 3)
+    """
+    return to_facing_frame(velocities(global_pos, fps, offsets, axis=-3), facing)
+
+
+def root_angular_velocity(facing, fps=30.0, offsets=None):
+    """
+    Angular velocity of the facing direction around the y-axis, counterclockwise seen from above. (..., T)
+    """
+    prev, curr, _ = time_indices(facing.shape[-2], offsets)
+    f0, f1 = _take(facing, prev, -2), _take(facing, curr, -2)
+    cross = f0[..., 2] * f1[..., 0] - f0[..., 0] * f1[..., 2]
+    dot   = f0[..., 0] * f1[..., 0] + f0[..., 2] * f1[..., 2]
+    return _atan2(cross, dot) * _per_frame(fps, facing, 0)
+
+
+def joint_speeds(velocities):
+    """
+    Speeds of velocities (..., T, J, 3). (..., T, J)
+    """
+    vx, vy, vz = velocities[..., 0], velocities[..., 1], velocities[..., 2]
+    return _sqrt(vx * vx + vy * vy + vz * vz)
+
+
+def future_trajectory(root_pos, facing, frames=(10, 20, 30), offsets=None):
+    """
+    Root positions and facing directions on the xz-plane at future frames, in the facing frame of the current frame.
+    Frames beyond the end of a clip take its last frame.
+
+    Args:
+        root_pos: (..., T, 3)
+        facing:   (..., T, 3)
+        frames:   (K,) future frame offsets
+    Returns:
+        positions:  (..., T, K, 2) x and z in the facing frame
+        directions: (..., T, K, 2)
+    """
+    nof = root_pos.shape[-2]
+    _, _, clip_end = time_indices(nof, offsets)
+    idx = np.minimum(np.arange(nof)[:, None] + np.asarray(frames, dtype=np.int64), clip_end[:, None]) # (T, K)
+
+    future_pos    = _take(root_pos, idx.reshape(-1), -2).reshape(root_pos.shape[:-2] + idx.shape + (3,))
+    future_facing = _take(facing, idx.reshape(-1), -2).reshape(facing.shape[:-2] + idx.shape + (3,))
+
+    positions  = to_facing_frame(future_pos - root_pos[..., None, :], facing)
+    directions = to_facing_frame(future_facing, facing)
+    return positions[..., 0::2], directions[..., 0::2]
+
+####################################################################################
+
+def motion_features(global_quats, global_pos, skeleton, fps=30.0, future_frames=(10, 20, 30), offsets=None):
+    """
+    All features in one batched pass.
+
+    Args:
+        global_quats:  (..., T, J, 4) or (..., T, 4) global rotations, only the root is used
+        global_pos:    (..., T, J, 3)
+        skeleton:      skeleton of the motion
+        fps:           float or (T,) per-frame frame rates
+        future_frames: (K,) future frame offsets of the trajectory
+        offsets:       (N+1,) clip boundaries of a packed buffer, or None
+    Returns:
+        dict of
+            facing            (..., T, 3)
+            local_pos         (..., T, J, 3) root-relative joint positions
+            local_vel         (..., T, J, 3) root-relative joint velocities
+            root_vel          (..., T, 3)    root linear velocity in the facing frame
+            root_ang_vel      (..., T)       root angular velocity around the y-axis
+            joint_speeds      (..., T, J)
+            future_pos        (..., T, K, 2)
+            future_dir        (..., T, K, 2)
+    """
+    root_quats = global_quats[..., 0, :] if global_quats.ndim == global_pos.ndim else global_quats
+    facing = facing_directions(root_quats, skeleton)
+
+    local_pos = root_relative_positions(global_pos, facing)
+    local_vel = root_relative_velocities(global_pos, facing, fps, offsets)
+    future_pos, future_dir = future_trajectory(global_pos[..., 0, :], facing, future_frames, offsets)
+
+    return {
+        "facing"       : facing,
+        "local_pos"    : local_pos,
+        "local_vel"    : local_vel,
+        "root_vel"     : local_vel[..., 0, :],
+        "root_ang_vel" : root_angular_velocity(facing, fps, offsets),
+        "joint_speeds" : joint_speeds(local_vel),
+        "future_pos"   : future_pos,
+        "future_dir"   : future_dir,
+    }
+
+####################################################################################
+
+FOOT_JOINTS = ("LeftFoot", "LeftToeBase", "RightFoot", "RightToeBase")
+
+def hysteresis(enter, leave, offsets=None):
+    """
+    Two-threshold filter along the time axis: the state turns on at frames where `enter` is true,
+    turns off where `leave` is true, and keeps its previous value otherwise. It is off at the start of each clip.
+
+    Args:
+        enter, leave: (..., T, F) boolean arrays
+        offsets:      (N+1,) clip boundaries, or None for a single clip
+    Returns:
+        state (..., T, F) boolean array
+    """
+    nof = enter.shape[-2]
+    offsets = np.array([0, nof], dtype=np.int64) if offsets is None else np.asarray(offsets, dtype=np.int64)
+    clip_start = np.repeat(offsets[:-1], np.diff(offsets))[:, None] # (T, 1)
+    frames = np.arange(nof, dtype=np.int64)[:, None]
+    if _is_torch(enter):
+        clip_start = torch.tensor(clip_start, device=enter.device)
+        frames = torch.tensor(frames, device=enter.device)
+
+    # most recent frame that turned the state on and off
+    last_enter = _cummax(_where(enter, frames, -1), axis=-2)
+    last_leave = _cummax(_where(leave, frames, -1), axis=-2)
+    return (last_enter > last_leave) & (last_enter >= clip_start)
+
+
+def foot_contacts(
+    global_pos,
+    skeleton,
+    feet=FOOT_JOINTS,
+    fps=30.0,
+    offsets=None,
+    velocity_threshold=0.5,
+    height_threshold=0.12,
+    hysteresis_ratio=1.5,
+    heightmap=None,
+):
+    """
+    Contact labels of foot joints from their speeds and heights.
+    A contact starts when the speed and the height are both below the thresholds,
+    and ends when either exceeds the thresholds scaled by `hysteresis_ratio`, so that labels do not flicker near the thresholds.
+
+    Args:
+        global_pos:         (..., T, J, 3) global joint positions
+        skeleton:           skeleton of the motion
+        feet:               (F,) names or indices of the foot joints
+        fps:                float or (T,) per-frame frame rates
+        offsets:            (N+1,) clip boundaries of a packed buffer, or None
+        velocity_threshold: float or (F,) speed threshold in units per second
+        height_threshold:   float or (F,) height threshold above the ground
+        hysteresis_ratio:   ratio of the leaving thresholds to the entering thresholds, at least 1
+        heightmap:          Heightmap of the ground, or None for the plane y = 0
+    Returns:
+        contacts (..., T, F) boolean array
+    """
+    if hysteresis_ratio < 1:
+        raise ValueError(f"hysteresis_ratio must be at least 1, but got {hysteresis_ratio}.")
+
+    idx = np.array([skeleton.idx_by_name[foot] if isinstance(foot, str) else int(foot) for foot in feet], dtype=np.int64)
+    foot_pos = _take(global_pos, idx, -2) # (..., T, F, 3)
+
+    speed = joint_speeds(velocities(foot_pos, fps, offsets, axis=-3))
+    height = foot_pos[..., 1]
+    if heightmap is not None:
+        height = height - heightmap.sample(foot_pos[..., 0], foot_pos[..., 2])
+
+    velocity_threshold = _like(np.broadcast_to(velocity_threshold, idx.shape), speed)
+    height_threshold = _like(np.broadcast_to(height_threshold, idx.shape), speed)
+
+    enter = (speed < velocity_threshold) & (height < height_threshold)
+    leave = (speed > velocity_threshold * hysteresis_ratio) | (height > height_threshold * hysteresis_ratio)
+    return hysteresis(enter, leave, offsets)
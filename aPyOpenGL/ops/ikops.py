@@ -0,0 +1,455 @@
+import torch
+import numpy as np
+
+from aPyOpenGL.transforms import n_quat, t_quat, n_kinematics, t_kinematics
+
+"""
+Batched inverse kinematics in numpy and torch.
+Local rotations (..., J, 4) are updated in place for all frames at once, where ... is any batch shape, e.g. (T,).
+Global rotations and positions (from n_quat.fk() or t_quat.fk()) are kept in sync by re-evaluating only
+the subtrees of the modified joints.
+
+    two_bone_ik  analytic solution of limbs with two bones
+    solve_ik     iterative multi-effector solutions (FABRIK, CCD or damped least squares)
+"""
+
+####################################################################################
+
+def _is_torch(x):
+    if isinstance(x, torch.Tensor):
+        return True
+    elif isinstance(x, np.ndarray):
+        return False
+    else:
+        raise TypeError(f"Type must be torch.Tensor or numpy.ndarray, but got {type(x)}")
+
+def _quat(x):
+    return t_quat if _is_torch(x) else n_quat
+
+def _like(values, x):
+    if _is_torch(x):
+        if isinstance(values, torch.Tensor):
+            return values.to(dtype=x.dtype, device=x.device)
+        return torch.tensor(np.asarray(values), dtype=x.dtype, device=x.device)
+    return np.asarray(values, dtype=x.dtype)
+
+def _norm(x):
+    return torch.linalg.norm(x, dim=-1, keepdim=True) if _is_torch(x) else np.linalg.norm(x, axis=-1, keepdims=True)
+
+def _normalize(x, eps=1e-8):
+    return x / (_norm(x) + eps)
+
+def _dot(x, y):
+    return (x * y).sum(-1, keepdim=True) if _is_torch(x) else (x * y).sum(-1, keepdims=True)
+
+def _cross(x, y):
+    if _is_torch(x):
+        x, y = torch.broadcast_tensors(x, y)
+        return torch.cross(x, y, dim=-1)
+    return np.cross(x, y, axis=-1)
+
+def _clip(x, lo, hi):
+    return torch.minimum(torch.clamp(x, min=lo), hi) if _is_torch(x) else np.minimum(np.maximum(x, lo), hi)
+
+def _where(cond, x, y):
+    return torch.where(cond, x, y) if _is_torch(cond) else np.where(cond, x, y)
+
+def _atan2(y, x):
+    return torch.atan2(y, x) if _is_torch(y) else np.arctan2(y, x)
+
+def _safe_norm(x):
+    # norm with a finite gradient at zero
+    return (x * x).sum(-1, keepdim=True).add(1e-12).sqrt() if _is_torch(x) else np.sqrt((x * x).sum(-1, keepdims=True) + 1e-12)
+
+def _einsum(eq, *xs):
+    return torch.einsum(eq, *xs) if _is_torch(xs[-1]) else np.einsum(eq, *xs)
+
+def _swap_axes(x, axis0, axis1):
+    return x.transpose(axis0, axis1) if _is_torch(x) else np.swapaxes(x, axis0, axis1)
+
+def _stack(xs, axis):
+    return torch.stack(xs, dim=axis) if _is_torch(xs[0]) else np.stack(xs, axis=axis)
+
+def _amax(x, axis):
+    return torch.amax(x, dim=axis) if _is_torch(x) else np.max(x, axis=axis)
+
+def _acos(x):
+    return torch.acos(torch.clamp(x, -1, 1)) if _is_torch(x) else np.arccos(np.clip(x, -1, 1))
+
+def _angle_axis(angle, axis):
+    # angle: (..., 1), axis: (..., 3) unit vectors -> (..., 4)
+    if _is_torch(angle):
+        return torch.cat([torch.cos(angle / 2), torch.sin(angle / 2) * axis], dim=-1)
+    return np.concatenate([np.cos(angle / 2), np.sin(angle / 2) * axis], axis=-1)
+
+def _aaxis_to_quat(aaxis):
+    angle = _safe_norm(aaxis)
+    return _angle_axis(angle, aaxis / angle)
+
+def _rotation_between(v_from, v_to):
+    # axis-angle of the shortest rotation from v_from to v_to (..., 3)
+    cross = _cross(v_from, v_to)
+    sin = _safe_norm(cross)
+    return cross * (_atan2(sin, _dot(v_from, v_to)) / sin)
+
+def _rotate_global(local_quats, global_quats, joints, rots):
+    # applies rotations (..., n, 4) in world space to the joints, i.e. local * G^-1 * R * G,
+    # normalized so that rounding errors do not accumulate over iterations
+    quat = _quat(local_quats)
+    g = global_quats[..., joints, :]
+    local_quats[..., joints, :] = _normalize(quat.mul(local_quats[..., joints, :], quat.mul(quat.inv(g), quat.mul(rots, g))), eps=0)
+
+def _joint_indices(skeleton, joints):
+    return np.array([skeleton.idx_by_name[joint] if isinstance(joint, str) else int(joint) for joint in np.atleast_1d(joints)], dtype=np.int64)
+
+def two_bone_chains(skeleton, effectors):
+    """
+    Base (grandparent), mid (parent) and effector joint indices of two-bone limbs, each of shape (L,).
+    """
+    skeleton = skeleton.freeze()
+    eff_idx  = _joint_indices(skeleton, effectors)
+    mid_idx  = skeleton.parent_idx[eff_idx]
+    base_idx = skeleton.parent_idx[np.maximum(mid_idx, 0)]
+    if (mid_idx < 0).any() or (base_idx < 0).any():
+        raise ValueError(f"Effectors must have a parent and a grandparent, but got {effectors}.")
+    return base_idx, mid_idx, eff_idx
+
+####################################################################################
+
+def refresh_subtrees(global_quats, global_pos, local_quats, root_pos, skeleton, joint_idx):
+    """
+    Re-evaluates the global rotations and positions of the subtrees of the given joints in place.
+
+    Args:
+        global_quats: (..., J, 4)
+        global_pos:   (..., J, 3)
+        local_quats:  (..., J, 4)
+        root_pos:     (..., 3)
+        joint_idx:    indices of the modified joints
+    """
+    dirty = np.zeros(skeleton.num_joints, dtype=bool)
+    for jidx in np.atleast_1d(joint_idx):
+        dirty[skeleton.subtree(int(jidx))] = True
+    return _propagate_joints(global_quats, global_pos, local_quats, root_pos, skeleton, dirty)
+
+
+def _propagate_joints(global_quats, global_pos, local_quats, root_pos, skeleton, dirty):
+    # re-evaluates the joints of the (J,) mask, whose parents must be up to date
+    quat = _quat(local_quats)
+    pre_quats, pre_pos = _like(skeleton.pre_quats, local_quats), _like(skeleton.offsets, local_quats)
+    if dirty[0]:
+        global_quats[..., 0, :] = quat.mul(pre_quats[0], local_quats[..., 0, :])
+        global_pos[..., 0, :]   = root_pos
+
+    levels = [(joints[mask], parents[mask]) for joints, parents in skeleton.depth_levels if (mask := dirty[joints]).any()]
+    kinematics = t_kinematics if _is_torch(local_quats) else n_kinematics
+    kinematics.propagate(global_quats, global_pos, local_quats, pre_quats, pre_pos, levels, quat.mul, quat.mul_vec)
+    return global_quats, global_pos
+
+
+def _independent_stages(skeleton, base_idx):
+    # groups limbs so that no limb of a stage is in the subtree of another limb of the same stage
+    stages = []
+    for limb, base in enumerate(base_idx):
+        start, stop = skeleton.subtree_ranges[base]
+        stage = stages[-1] if stages else None
+        if stage is None or any(s < stop and start < e for s, e in (skeleton.subtree_ranges[base_idx[l]] for l in stage)):
+            stages.append([limb])
+        else:
+            stage.append(limb)
+    return stages
+
+
+def two_bone_ik(local_quats, root_pos, skeleton, effectors, targets, poles=None, global_quats=None, global_pos=None, eps=1e-5):
+    """
+    Analytic two-bone IK of any number of limbs for all frames at once.
+    For each limb, the base (grandparent of the effector) and the mid joint (parent of the effector) are rotated
+    so that the effector reaches its target, or points toward it when it is out of reach.
+    The mid joint bends in its current plane, or in the plane spanned by the pole where the limb is fully extended.
+
+    Args:
+        local_quats:  (..., J, 4) local rotations, updated in place
+        root_pos:     (..., 3) root positions
+        skeleton:     skeleton of the motion
+        effectors:    L names or indices of the effector joints
+        targets:      (..., L, 3) target positions of the effectors
+        poles:        (..., L, 3) directions in which the mid joints bend when the limbs are straight, or None
+        global_quats: (..., J, 4) global rotations of local_quats to update in place, or None to evaluate them
+        global_pos:   (..., J, 3) global positions of local_quats to update in place, or None to evaluate them
+    Returns:
+        global_quats: (..., J, 4) global rotations after IK
+        global_pos:   (..., J, 3) global positions after IK
+    """
+    quat = _quat(local_quats)
+    skeleton = skeleton.freeze()
+    base_idx, mid_idx, eff_idx = two_bone_chains(skeleton, effectors)
+
+    if global_quats is None or global_pos is None:
+        global_quats, global_pos = quat.fk(local_quats, root_pos, skeleton)
+
+    targets = _like(targets, local_quats)
+    poles = None if poles is None else _like(poles, local_quats)
+    for stage in _independent_stages(skeleton, base_idx):
+        base, mid, eff = base_idx[stage], mid_idx[stage], eff_idx[stage]
+        t = targets[..., stage, :] # (..., L', 3)
+        a, b, c = global_pos[..., base, :], global_pos[..., mid, :], global_pos[..., eff, :]
+        a_gq, b_gq = global_quats[..., base, :], global_quats[..., mid, :]
+
+        # target angles of the triangle from the law of cosines
+        lab = _norm(b - a)
+        lcb = _norm(b - c)
+        lat = _clip(_norm(t - a), eps, lab + lcb - eps)
+
+        ac_ab_0 = _acos(_dot(_normalize(c - a), _normalize(b - a)))
+        ba_bc_0 = _acos(_dot(_normalize(a - b), _normalize(c - b)))
+        ac_at_0 = _acos(_dot(_normalize(c - a), _normalize(t - a)))
+        ac_ab_1 = _acos((lcb*lcb - lab*lab - lat*lat) / (-2*lab*lat))
+        ba_bc_1 = _acos((lat*lat - lab*lab - lcb*lcb) / (-2*lab*lcb))
+
+        # bending plane, and swing from the current effector direction to the target
+        axis0 = _cross(c - a, b - a)
+        if poles is not None:
+            pole_axis = _cross(c - a, poles[..., stage, :])
+            straight = _norm(axis0) < eps * lab * lcb
+            axis0 = _where(straight, pole_axis, axis0)
+        axis0 = _normalize(axis0)
+        axis1 = _normalize(_cross(c - a, t - a))
+
+        r0 = _angle_axis(ac_ab_1 - ac_ab_0, quat.mul_vec(quat.inv(a_gq), axis0))
+        r1 = _angle_axis(ba_bc_1 - ba_bc_0, quat.mul_vec(quat.inv(b_gq), axis0))
+        r2 = _angle_axis(ac_at_0, quat.mul_vec(quat.inv(a_gq), axis1))
+
+        local_quats[..., base, :] = quat.mul(local_quats[..., base, :], quat.mul(r2, r0))
+        local_quats[..., mid, :]  = quat.mul(local_quats[..., mid, :], r1)
+        refresh_subtrees(global_quats, global_pos, local_quats, root_pos, skeleton, base)
+
+    return global_quats, global_pos
+
+####################################################################################
+
+IK_METHODS = ("fabrik", "ccd", "jacobian")
+
+class _IKChain:
+    """
+    Joints moved by an iterative solve: the strict ancestors of the effectors (chain),
+    and the chain with the effectors (nodes), whose global transformations are kept up to date during the iterations.
+    """
+    def __init__(self, skeleton, eff_idx):
+        parent_idx = skeleton.parent_idx
+        is_chain = np.zeros(skeleton.num_joints, dtype=bool)
+        for jidx in eff_idx:
+            jidx = parent_idx[jidx]
+            while jidx >= 0 and not is_chain[jidx]:
+                is_chain[jidx] = True
+                jidx = parent_idx[jidx]
+
+        self.eff   = eff_idx
+        self.chain = np.nonzero(is_chain)[0]
+        self.nodes = is_chain.copy()
+        self.nodes[eff_idx] = True
+
+        # ancestor[n, l]: chain[n] is a strict ancestor of effector l
+        start, stop = skeleton.subtree_ranges[self.chain].T
+        pos = skeleton.subtree_ranges[eff_idx, 0]
+        self.ancestor = (start[:, None] <= pos) & (pos < stop[:, None]) & (self.chain[:, None] != eff_idx)
+
+        # chain joints of each depth, and their children among the nodes
+        depth = skeleton.depth
+        self.levels = []
+        for d in np.unique(depth[self.chain]):
+            joints = self.chain[depth[self.chain] == d]
+            children = np.nonzero(self.nodes & (depth == d + 1) & np.isin(parent_idx, joints))[0]
+            to_parent = (parent_idx[children][None, :] == joints[:, None]).astype(np.float32) # (n, c)
+            self.levels.append((joints, children, to_parent / np.maximum(to_parent.sum(-1, keepdims=True), 1)))
+
+
+def _joint_weights(skeleton, weights):
+    # (J,) weight of each joint, 0 for the root unless given
+    if weights is not None and not isinstance(weights, dict):
+        return np.asarray(weights, dtype=np.float32)
+    res = np.ones(skeleton.num_joints, dtype=np.float32)
+    res[0] = 0.0
+    for joint, weight in ({} if weights is None else weights).items():
+        res[_joint_indices(skeleton, joint)] = weight
+    return res
+
+
+def _ccd_step(local_quats, global_quats, global_pos, targets, chain, weights, active):
+    # one sweep from the deepest joints to the root, the joints of the same depth at once
+    eff_pos = global_pos[..., chain.eff, :]
+    for joints, _, _ in reversed(chain.levels):
+        ancestor = chain.ancestor[np.isin(chain.chain, joints)] # (n, L)
+        limbs = np.nonzero(ancestor.any(0))[0]
+        if len(limbs) == 0:
+            continue
+        anc = np.argmax(ancestor[:, limbs], axis=0) # (L',)
+        to_joint = ancestor[:, limbs] / ancestor[:, limbs].sum(-1, keepdims=True).clip(1)
+
+        pivot = global_pos[..., joints[anc], :]
+        e = eff_pos[..., limbs, :]
+        aaxis = _rotation_between(e - pivot, targets[..., limbs, :] - pivot) # (..., L', 3)
+        aaxis = _einsum("nl,...lc->...nc", _like(to_joint, aaxis), aaxis) * _like(weights[joints, None], aaxis) * active[..., None]
+        rots = _aaxis_to_quat(aaxis)
+
+        _rotate_global(local_quats, global_quats, joints, rots)
+        eff_pos[..., limbs, :] = pivot + _quat(rots).mul_vec(rots[..., anc, :], e - pivot)
+
+
+def _squared_errors(global_pos, targets, chain):
+    # (..., L, 1) squared distances of the effectors from their targets
+    diff = targets - global_pos[..., chain.eff, :]
+    return _dot(diff, diff)
+
+
+def _jacobian_step(local_quats, root_pos, skeleton, global_quats, global_pos, targets, chain, weights, active, damping, max_step, step):
+    # damped least squares on the world-space axis-angle velocities of all chain joints,
+    # scaled by the step of each pose (..., 1) and clamped to max_step radians per joint.
+    # A step that increases the summed or the largest squared distance of a pose is undone and its step is halved,
+    # otherwise its step doubles up to 1.
+    noc, noe = len(chain.chain), len(chain.eff)
+    joint_pos, eff_pos = global_pos[..., chain.chain, :], global_pos[..., chain.eff, :]
+    r = eff_pos[..., :, None, :] - joint_pos[..., None, :, :] # (..., L, N, 3)
+    r = r * _like(chain.ancestor.T[..., None], r)
+
+    # d(eff)/d(theta_k) = e_k x r
+    eye = _like(np.eye(3), r)
+    jac = _stack([_cross(eye[k], r) for k in range(3)], axis=-1) # (..., L, N, 3(xyz), 3(k))
+    jac = _swap_axes(jac, -3, -2).reshape(r.shape[:-3] + (noe * 3, noc * 3))
+
+    w = _like(np.repeat(weights[chain.chain], 3), jac) * active
+    jw = jac * w[..., None, :]
+    lhs = jw @ _swap_axes(jac, -1, -2) + _like(np.eye(noe * 3) * damping * damping, jac)
+    err = (targets - eff_pos).reshape(r.shape[:-3] + (noe * 3, 1))
+    solve = torch.linalg.solve if _is_torch(lhs) else np.linalg.solve
+    theta = (_swap_axes(jw, -1, -2) @ solve(lhs, err)).reshape(r.shape[:-3] + (noc, 3)) * step[..., None]
+    angle = _safe_norm(theta)
+    theta = _where(angle > max_step, theta * (max_step / angle), theta)
+
+    nodes = np.nonzero(chain.nodes)[0]
+    prev_error = _squared_errors(global_pos, targets, chain)
+    prev = (local_quats[..., chain.chain, :] * 1.0, global_quats[..., nodes, :] * 1.0, global_pos[..., nodes, :] * 1.0)
+    _rotate_global(local_quats, global_quats, chain.chain, _aaxis_to_quat(theta))
+    _propagate_joints(global_quats, global_pos, local_quats, root_pos, skeleton, chain.nodes)
+
+    error = _squared_errors(global_pos, targets, chain)
+    worse = (error.sum(-2) > prev_error.sum(-2)) | (_amax(error, -2) > _amax(prev_error, -2)) # (..., 1)
+    local_quats[..., chain.chain, :] = _where(worse[..., None], prev[0], local_quats[..., chain.chain, :])
+    global_quats[..., nodes, :] = _where(worse[..., None], prev[1], global_quats[..., nodes, :])
+    global_pos[..., nodes, :] = _where(worse[..., None], prev[2], global_pos[..., nodes, :])
+    return _where(worse, step * 0.5, step * 2).clip(max=1.0)
+
+
+def _fabrik_step(local_quats, root_pos, skeleton, global_quats, global_pos, targets, chain, weights, active):
+    # FABRIK on the positions of the nodes, then the chain joints are rotated top-down toward the new positions
+    lengths = skeleton.bone_lengths # (J-1,) from each non-root joint to its parent
+    pos = global_pos * 1.0
+    pos[..., chain.eff, :] = targets
+
+    # backward: the chain joints follow their children, averaged over branches
+    for joints, children, to_parent in reversed(chain.levels):
+        if len(children) == 0:
+            continue
+        child_pos = pos[..., children, :]
+        dirs = _normalize(pos[..., skeleton.parent_idx[children], :] - child_pos)
+        cand = child_pos + dirs * _like(lengths[children - 1, None], pos)
+        pos[..., joints, :] = _einsum("nc,...cd->...nd", _like(to_parent, pos), cand)
+        pos[..., chain.eff, :] = targets
+
+    # forward: the top of the chain stays, and children are placed at their bone lengths
+    top = chain.levels[0][0]
+    pos[..., top, :] = global_pos[..., top, :]
+    for _, children, _ in chain.levels:
+        if len(children) == 0:
+            continue
+        parent_pos = pos[..., skeleton.parent_idx[children], :]
+        dirs = _normalize(pos[..., children, :] - parent_pos)
+        pos[..., children, :] = parent_pos + dirs * _like(lengths[children - 1, None], pos)
+
+    # rotations from positions, one depth at a time
+    for joints, children, to_parent in chain.levels:
+        if len(children) == 0:
+            continue
+        pivot = global_pos[..., skeleton.parent_idx[children], :]
+        aaxis = _rotation_between(global_pos[..., children, :] - pivot, pos[..., children, :] - pivot)
+        aaxis = _einsum("nc,...cd->...nd", _like(to_parent, aaxis), aaxis) * _like(weights[joints, None], aaxis) * active[..., None]
+        _rotate_global(local_quats, global_quats, joints, _aaxis_to_quat(aaxis))
+
+        # the grandchildren too, since the next depth rotates from their current positions
+        dirty = chain.nodes & np.isin(skeleton.parent_idx, children)
+        dirty[joints] = dirty[children] = True
+        _propagate_joints(global_quats, global_pos, local_quats, root_pos, skeleton, dirty)
+
+
+def solve_ik(
+    local_quats,
+    root_pos,
+    skeleton,
+    effectors,
+    targets,
+    method="jacobian",
+    weights=None,
+    iterations=20,
+    tol=1e-3,
+    damping=0.05,
+    max_step=0.2,
+    global_quats=None,
+    global_pos=None,
+):
+    """
+    Iterative multi-effector IK for any batch of frames or characters at once.
+    The ancestors of the effectors are rotated, and the root position is kept.
+    The iterations stop early when every effector of every pose is within `tol` of its target,
+    and poses that have converged are not modified further.
+
+    In torch, every update is recorded by autograd, so that the result is differentiable with respect to the targets
+    and the input rotations. Pass a clone of a leaf tensor that requires gradients, since it is updated in place.
+
+    Args:
+        local_quats:  (..., J, 4) local rotations, updated in place
+        root_pos:     (..., 3) root positions
+        skeleton:     skeleton of the motion
+        effectors:    L names or indices of the effector joints
+        targets:      (..., L, 3) target positions of the effectors
+        method:       "fabrik", "ccd" or "jacobian" (damped least squares)
+        weights:      (J,) weight of each joint or dict of joint name -> weight, scaling its rotation per iteration.
+                      0 locks a joint, and the root is locked unless given.
+        iterations:   the maximum number of iterations
+        tol:          distance from the targets to stop
+        damping:      damping of the least squares, in units of length
+        max_step:     the largest rotation of a joint per iteration of the least squares, in radians.
+                      Iterations that increase the summed or the largest distance of the effectors of a pose from their targets
+                      are undone and retried with half the step, so that no pose ends farther from its targets than it started.
+        global_quats: (..., J, 4) global rotations of local_quats to update in place, or None to evaluate them
+        global_pos:   (..., J, 3) global positions of local_quats to update in place, or None to evaluate them
+    Returns:
+        global_quats: (..., J, 4) global rotations after IK
+        global_pos:   (..., J, 3) global positions after IK
+    """
+    if method not in IK_METHODS:
+        raise ValueError(f"Method must be one of {IK_METHODS}, but got {method}.")
+
+    quat = _quat(local_quats)
+    skeleton = skeleton.freeze()
+    chain = _IKChain(skeleton, _joint_indices(skeleton, effectors))
+    weights = _joint_weights(skeleton, weights)
+    if global_quats is None or global_pos is None:
+        global_quats, global_pos = quat.fk(local_quats, root_pos, skeleton)
+
+    targets = _like(targets, local_quats)
+    step = _like(np.ones(global_pos.shape[:-2] + (1,)), global_pos) # (..., 1) step scale of the least squares
+    for _ in range(iterations):
+        dist = _norm(targets - global_pos[..., chain.eff, :])[..., 0] # (..., L)
+        converged = (dist < tol).all(-1) if _is_torch(dist) else np.all(dist < tol, axis=-1)
+        if bool(converged.all()):
+            break
+        active = _like(~converged, dist)[..., None] # (..., 1)
+
+        if method == "fabrik":
+            _fabrik_step(local_quats, root_pos, skeleton, global_quats, global_pos, targets, chain, weights, active)
+        elif method == "ccd":
+            _ccd_step(local_quats, global_quats, global_pos, targets, chain, weights, active)
+            _propagate_joints(global_quats, global_pos, local_quats, root_pos, skeleton, chain.nodes)
+        else:
+            step = _jacobian_step(local_quats, root_pos, skeleton, global_quats, global_pos, targets, chain, weights, active, damping, max_step, step)
+
+    return refresh_subtrees(global_quats, global_pos, local_quats, root_pos, skeleton, chain.chain)
@@ -1,3 +1,51 @@
+import numpy as np
+
+from aPyOpenGL.transforms import n_quat
+from . import featureops, ikops
+
+####################################################################################
+
+def mirror(local_quats, root_pos, skeleton, pair_indices=None, sym_axis=None, out=None):
+    """
+    Mirrors motions of any batch shape, e.g. a single motion, a (N, T) stack, or a packed dataset.
+    Pair indices and the symmetry axis are taken from the skeleton cache if not given.
+
+    Args:
+        local_quats: (..., J, 4)
+        root_pos: (..., 3)
+        skeleton: skeleton of the motions
+        pair_indices: (J,) index of the mirrored joint for each joint
+        sym_axis: "x", "y" or "z"
+        out: optional (local_quats, root_pos) to write the results into, which can be the inputs themselves
+    Returns:
+        mirrored local_quats (..., J, 4) and root_pos (..., 3)
+    """
+    if pair_indices is None:
+        pair_indices = skeleton.find_pair_indices()
+    if sym_axis is None:
+        sym_axis = skeleton.find_symmetry_axis(pair_indices)
+    else:
+        assert sym_axis in ["x", "y", "z"], f"Invalid axis {sym_axis} for symmetry axis, must be one of ['x', 'y', 'z']"
+    idx = {"x": 0, "y": 1, "z": 2}[sym_axis]
+
+    if out is None:
+        out = (np.empty_like(local_quats), np.empty_like(root_pos))
+    out_quats, out_pos = out
+
+    # swap joints, then negate the real part and the component of the symmetry axis in place
+    quat_sign = np.ones(4, dtype=out_quats.dtype)
+    quat_sign[[0, idx + 1]] = -1
+    np.take(local_quats, pair_indices, axis=-2, out=out_quats)
+    np.multiply(out_quats, quat_sign, out=out_quats)
+
+    pos_sign = np.ones(3, dtype=out_pos.dtype)
+    pos_sign[idx] = -1
+    np.multiply(root_pos, pos_sign, out=out_pos)
+
+    return out_quats, out_pos
+
+####################################################################################
+
 # import torch
 # import numpy as np
 
@@ -76,155 +124,125 @@
 #     else:
 #         raise ValueError(f"Invalid type {type(local_R6)}")
 
-# ####################################################################################
-
-# def scaled_motion(
-#     motion,
-#     scale_factor,
-#     tolerance=0.1,
-#     scale_root_by="velocity",
-#     scale_effector_by="position",
-#     left_leg_name="LeftUpLeg",
-#     left_foot_name="LeftFoot",
-#     right_leg_name="RightUpLeg",
-#     right_foot_name="RightFoot",
-# ):
-#     """
-#     Returns a scaled motion if the scale factor is proper.
-#     Otherwise, returns None.
-#     """
-#     ret_motion = motion.copy()
-#     if scale_factor == 1.0:
-#         return ret_motion
-    
-#     # joint indices
-#     left_leg_idx   = motion.skeleton.idx_by_name[left_leg_name]
-#     left_foot_idx  = motion.skeleton.idx_by_name[left_foot_name]
-#     left_knee_idx  = motion.skeleton.parent_idx[left_foot_idx]
-
-#     right_leg_idx  = motion.skeleton.idx_by_name[right_leg_name]
-#     right_foot_idx = motion.skeleton.idx_by_name[right_foot_name]
-#     right_knee_idx = motion.skeleton.parent_idx[right_foot_idx]
-
-#     # chain lengths
-#     def chain_len(indices):
-#         return np.sum([np.linalg.norm(motion.skeleton.joints[idx].offset, axis=-1) for idx in indices])
-    
-#     left_lower_chain_len = chain_len([left_knee_idx, left_foot_idx])
-#     right_lower_chain_len = chain_len([right_knee_idx, right_foot_idx])
-
-#     # scale root
-#     if scale_root_by == "position":
-#         root_p = np.stack([pose.root_p for pose in ret_motion.poses], axis=0)
-#         root_p = root_p * np.array([scale_factor, 1.0, scale_factor], dtype=np.float32)
-#         for i in range(len(ret_motion)):
-#             ret_motion.poses[i].set_root_p(root_p[i])
-
-#     elif scale_root_by == "velocity":
-#         root_v = np.stack([(ret_motion.poses[i+1].root_p - ret_motion.poses[i].root_p) * scale_factor for i in range(len(ret_motion.poses) - 1)], axis=0)
-#         root_v = root_v * np.array([1.0, 0.0, 1.0], dtype=np.float32)
-#         for i in range(1, len(ret_motion)):
-#             root_p = ret_motion.poses[i-1].root_p + root_v[i-1]
-#             root_p[1] = ret_motion.poses[i].root_p[1]
-#             ret_motion.poses[i].set_root_p(root_p)
-    
-#     else:
-#         raise ValueError(f"scale_root is supposed to be either 'position' or 'velocity', but got {scale_root_by}")
-    
-#     # scale effector
-#     def too_far(scaled_p, base_idx, chain_len):
-#         return np.any(np.linalg.norm(scaled_p - copy_global_ps[:, base_idx], axis=-1) > chain_len + tolerance)
-#     def too_close(left_foot_p, right_foot_p):
-#         return np.any(np.linalg.norm(left_foot_p - right_foot_p, axis=-1) < tolerance)
-
-#     if scale_effector_by == "position":
-#         global_ps = np.stack([pose.global_p for pose in ret_motion.poses])
-#         def root_to_joint(joint_idx, scale_y=False):
-#             res = global_ps[:, joint_idx] - global_ps[:, 0]
-#             if scale_y:
-#                 return res * scale_factor
-#             else:
-#                 return res * npconst.Y() + (res * npconst.XZ()) * scale_factor
-
-#         copy_global_ps = np.stack([pose.global_p for pose in ret_motion.poses])
-#         scaled_left_foot  = copy_global_ps[:, 0] + root_to_joint(left_foot_idx)
-#         scaled_right_foot = copy_global_ps[:, 0] + root_to_joint(right_foot_idx)
-
-#         # discard if the target foot position is too far or too close
-#         # if too_far(scaled_left_foot, left_leg_idx, left_lower_chain_len) or too_far(scaled_right_foot, right_leg_idx, right_lower_chain_len):
-#         #     print(f"Scale factor {scale_factor} is too large.")
-#         #     return None
-#         # if too_close(scaled_left_foot, scaled_right_foot):
-#         #     print(f"Scale factor {scale_factor} is too small.")
-#         #     return None
-
-#         # apply two-bone IK
-#         for i in range(len(ret_motion)):
-#             ret_motion.poses[i].two_bone_ik(left_leg_idx,  left_foot_idx,  scaled_left_foot[i])
-#             ret_motion.poses[i].two_bone_ik(right_leg_idx, right_foot_idx, scaled_right_foot[i])
-#             ret_motion.poses[i].update()
-    
-#     elif scale_effector_by == "velocity":
-#         # scale root relative velocity
-#         rel_ps = np.stack([pose.global_p - pose.root_p for pose in ret_motion.poses])
-#         rel_vs = (rel_ps[1:] - rel_ps[:-1]) * npconst.Y() + (rel_ps[1:] - rel_ps[:-1]) * npconst.XZ() * scale_factor
-#         for i in range(1, len(ret_motion)):
-#             left_foot_p  = rel_vs[i-1, left_foot_idx] + ret_motion.poses[i].root_p + ret_motion.poses[i-1].global_p[left_foot_idx] - ret_motion.poses[i-1].root_p
-#             right_foot_p = rel_vs[i-1, right_foot_idx] + ret_motion.poses[i].root_p + ret_motion.poses[i-1].global_p[right_foot_idx] - ret_motion.poses[i-1].root_p
-#             left_foot_p[1] = ret_motion.poses[i].global_p[left_foot_idx][1]
-#             right_foot_p[1] = ret_motion.poses[i].global_p[right_foot_idx][1]
-
-#             # discard if the target foot position is too far
-#             # if too_far(left_foot_p, left_leg_idx, left_lower_chain_len) or too_far(right_foot_p, right_leg_idx, right_lower_chain_len):
-#             #     print(f"Scale factor {scale_factor} is too large.")
-#             #     return None
-#             # if too_close(left_foot_p, right_foot_p):
-#             #     print(f"Scale factor {scale_factor} is too small.")
-#             #     return None
-            
-#             # apply two-bone IK
-#             ret_motion.poses[i].two_bone_ik(left_leg_idx,  left_foot_idx,  left_foot_p)
-#             ret_motion.poses[i].two_bone_ik(right_leg_idx, right_foot_idx, right_foot_p)
-#             ret_motion.poses[i].update()
-    
-#     else:
-#         raise ValueError(f"scale_effector is supposed to be either 'position' or 'velocity', but got {scale_effector_by}")
-
-#     return ret_motion
-
-# ####################################################################################
-
-# def get_local_velocity(motion):
-#     """
-#     Base-relative velocity
-#     """
-#     v = np.stack([motion.poses[i+1].global_p - motion.poses[i].global_p for i in range(len(motion.poses) - 1)])
-#     v = np.concatenate([v[0:1], v], axis=0) # (T, J, 3)
-
-#     # local-to-global rotation matrix
-#     up = np.stack([motion.poses[i].up for i in range(len(motion.poses))])
-#     forward = np.stack([motion.poses[i].forward for i in range(len(motion.poses))])
-#     left = np.stack([motion.poses[i].left for i in range(len(motion.poses))])
-#     R = np.stack([left, up, forward], axis=-1)  # (T, 3, 3)
-
-#     # global-to-local transformation
-#     v = np.einsum("Trc,Tjc->Tjr", R.transpose((0, 2, 1)), v) # (T, J, 3)
-    
-#     return v
-
-# def get_local_position(motion):
-#     """
-#     Base-relative position
-#     """
-#     p = np.stack([motion.poses[i].global_p - motion.poses[i].base for i in range(len(motion.poses))])
-    
-#     # local-to-global rotation matrix
-#     up = np.stack([motion.poses[i].up for i in range(len(motion.poses))])
-#     forward = np.stack([motion.poses[i].forward for i in range(len(motion.poses))])
-#     left = np.stack([motion.poses[i].left for i in range(len(motion.poses))])
-#     R = np.stack([left, up, forward], axis=-1)  # (T, 3, 3)
-
-#     # global-to-local transformation
-#     p = np.einsum("Trc,Tjc->Tjr", R.transpose((0, 2, 1)), p) # (T, J, 3)
-    
-#     return p
\ No newline at end of file
+####################################################################################
+
+SCALE_MODES = ("position", "velocity")
+
+def scale_motions(
+    local_quats,
+    root_pos,
+    skeleton,
+    scale_factor,
+    offsets=None,
+    tolerance=0.1,
+    scale_root_by="velocity",
+    scale_effector_by="position",
+    effectors=("LeftFoot", "RightFoot"),
+):
+    """
+    Scales the horizontal motion of the root and the effectors of all frames at once, e.g. to fit a character of a different size.
+    The root trajectory is scaled on the xz-plane, and the effectors are moved by analytic two-bone IK
+    so that their horizontal offsets from the root are scaled by the same factor. Heights are kept.
+
+    Args:
+        local_quats: (ΣT, J, 4) local rotations of a motion or a packed dataset
+        root_pos: (ΣT, 3)
+        skeleton: skeleton of the motions
+        scale_factor: horizontal scale
+        offsets: (N+1,) clip boundaries of a packed dataset, or None for a single motion
+        tolerance: margin of the reachability checks
+        scale_root_by: "position" to scale the root positions about the origin,
+                       or "velocity" to scale the root velocities, i.e. the positions about the first frame of each clip
+        scale_effector_by: "position" to scale the offsets of the effectors from the root,
+                           or "velocity" to scale their velocities relative to the root, i.e. the offsets relative to the first frame
+        effectors: names or indices of the effectors, the ends of two-bone limbs
+    Returns:
+        local_quats (ΣT, J, 4) and root_pos (ΣT, 3) of the scaled motions,
+        valid (N,) whether every target of each clip is within reach of its limb by the tolerance and
+        no two targets are closer than the tolerance
+    """
+    if scale_root_by not in SCALE_MODES:
+        raise ValueError(f"scale_root_by must be one of {SCALE_MODES}, but got {scale_root_by}")
+    if scale_effector_by not in SCALE_MODES:
+        raise ValueError(f"scale_effector_by must be one of {SCALE_MODES}, but got {scale_effector_by}")
+
+    nof = len(local_quats)
+    offsets = np.array([0, nof], dtype=np.int64) if offsets is None else np.asarray(offsets, dtype=np.int64)
+    lengths = np.diff(offsets)
+    clip_idx = np.repeat(np.arange(len(lengths)), lengths)
+    first = offsets[:-1][clip_idx] # first frame of the clip of each frame
+
+    local_quats = np.array(local_quats, dtype=np.float32)
+    root_pos = np.asarray(root_pos, dtype=np.float32)
+    if scale_factor == 1.0:
+        return local_quats, root_pos.copy(), np.ones(len(lengths), dtype=bool)
+
+    # scaling on the xz-plane about a pivot, the origin or the first frame of each clip
+    scale = np.array([scale_factor, 1.0, scale_factor], dtype=np.float32)
+    root_pivot = 0.0 if scale_root_by == "position" else root_pos[first]
+    scaled_root = root_pivot + (root_pos - root_pivot) * scale
+
+    global_quats, global_pos = n_quat.fk(local_quats, scaled_root, skeleton)
+    base_idx, mid_idx, eff_idx = ikops.two_bone_chains(skeleton, effectors)
+    rel_pos = global_pos[:, eff_idx] - scaled_root[:, None] # (ΣT, L, 3)
+    rel_pivot = 0.0 if scale_effector_by == "position" else rel_pos[first]
+    targets = scaled_root[:, None] + rel_pivot + (rel_pos - rel_pivot) * scale
+
+    # reachability of all frames at once
+    reach = skeleton.bone_lengths[mid_idx - 1] + skeleton.bone_lengths[eff_idx - 1]
+    too_far = np.linalg.norm(targets - global_pos[:, base_idx], axis=-1) > reach + tolerance # (ΣT, L)
+    i, j = np.triu_indices(len(eff_idx), k=1)
+    too_close = np.linalg.norm(targets[:, i] - targets[:, j], axis=-1) < tolerance # (ΣT, L(L-1)/2)
+    invalid = too_far.any(axis=-1) | too_close.any(axis=-1)
+    valid = np.bincount(clip_idx, weights=invalid, minlength=len(lengths)) == 0
+
+    ikops.two_bone_ik(local_quats, scaled_root, skeleton, eff_idx, targets, global_quats=global_quats, global_pos=global_pos)
+    return local_quats, scaled_root, valid
+
+
+def scaled_motion(
+    motion,
+    scale_factor,
+    tolerance=0.1,
+    scale_root_by="velocity",
+    scale_effector_by="position",
+    effectors=("LeftFoot", "RightFoot"),
+):
+    """
+    Returns a scaled motion if the scale factor is proper. Otherwise, returns None.
+    For a MotionDataset, returns a dataset of the clips for which the scale factor is proper, or None if there are none.
+    See scale_motions() for the arguments.
+    """
+    offsets = getattr(motion, "offsets", None)
+    local_quats, root_pos, valid = scale_motions(motion.local_quats, motion.root_pos, motion.skeleton, scale_factor, offsets,
+                                                 tolerance, scale_root_by, scale_effector_by, effectors)
+    if offsets is None:
+        return motion.from_numpy(motion.skeleton, local_quats, root_pos, motion.fps, motion.name) if valid[0] else None
+
+    keep = np.nonzero(valid)[0]
+    if len(keep) == 0:
+        return None
+    frames = np.concatenate([np.arange(offsets[i], offsets[i+1]) for i in keep])
+    lengths = np.diff(offsets)[keep]
+    return type(motion)(motion.skeleton, local_quats[frames], root_pos[frames], np.concatenate([[0], np.cumsum(lengths)]),
+                        [motion.names[i] for i in keep], motion.fps[keep])
+
+
+####################################################################################
+
+def get_local_velocity(motion):
+    """
+    Base-relative velocity of all joints in the facing frame, as displacements per frame. (T, J, 3)
+    See featureops for the batched features of motions and datasets.
+    """
+    global_quats, global_pos = n_quat.fk(motion.local_quats, motion.root_pos, motion.skeleton)
+    facing = featureops.facing_directions(global_quats[..., 0, :], motion.skeleton)
+    return featureops.root_relative_velocities(global_pos, facing, fps=1.0)
+
+def get_local_position(motion):
+    """
+    Base-relative position of all joints in the facing frame. (T, J, 3)
+    """
+    global_quats, global_pos = n_quat.fk(motion.local_quats, motion.root_pos, motion.skeleton)
+    facing = featureops.facing_directions(global_quats[..., 0, :], motion.skeleton)
+    return featureops.root_relative_positions(global_pos, facing)
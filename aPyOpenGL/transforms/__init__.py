@@ -1,13 +1,17 @@
+from .backend import BACKENDS, set_backend, get_backend, use_backend
+
 from .numpy import aaxis as n_aaxis
 from .numpy import euler as n_euler
 from .numpy import quat as n_quat
 from .numpy import rotmat as n_rotmat
 from .numpy import ortho6d as n_ortho6d
 from .numpy import xform as n_xform
+from .numpy import kinematics as n_kinematics
 
 from .torch import aaxis as t_aaxis
 from .torch import euler as t_euler
 from .torch import quat as t_quat
 from .torch import rotmat as t_rotmat
 from .torch import ortho6d as t_ortho6d
-from .torch import xform as t_xform
\ No newline at end of file
+from .torch import xform as t_xform
+from .torch import kinematics as t_kinematics
\ No newline at end of file
@@ -0,0 +1,57 @@
+import warnings
+from contextlib import contextmanager
+
+"""
+Backend of the numpy transforms.
+    numpy  vectorized numpy kernels
+    numba  compiled loops over the same arithmetic (aPyOpenGL.transforms.numpy.jit) for
+           n_quat.mul, n_quat.mul_vec, n_quat.slerp, n_quat.fk, n_rotmat.to_quat and n_euler.to_quat
+
+The backend is selected globally with set_backend() or use_backend(), or per call with the `backend` argument of these kernels.
+Numba is imported on the first call that needs it. If it is not installed, a RuntimeWarning is issued once
+and the numpy kernels are used instead.
+"""
+BACKENDS = ("numpy", "numba")
+
+_backend = "numpy"
+_jit = None # kernel module once loaded, False if numba is not available
+
+def _check(name):
+    if name not in BACKENDS:
+        raise ValueError(f"Invalid backend: {name}. Must be one of {BACKENDS}")
+    return name
+
+def set_backend(name):
+    global _backend
+    _backend = _check(name)
+
+def get_backend():
+    return _backend
+
+@contextmanager
+def use_backend(name):
+    """
+    Selects the backend within a with-block.
+    """
+    global _backend
+    prev, _backend = _backend, _check(name)
+    try:
+        yield
+    finally:
+        _backend = prev
+
+def jit_kernels(backend=None):
+    """
+    Numba kernel module if `backend` (the global backend if None) is "numba" and numba is installed, otherwise None.
+    """
+    global _jit
+    if _check(_backend if backend is None else backend) != "numba":
+        return None
+    if _jit is None:
+        try:
+            from .numpy import jit
+            _jit = jit
+        except ImportError:
+            warnings.warn("Failed to import numba. Falling back to the numpy backend.", RuntimeWarning, stacklevel=3)
+            _jit = False
+    return _jit or None
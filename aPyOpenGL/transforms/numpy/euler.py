@@ -1,6 +1,7 @@
 import numpy as np
 
 from . import quat
+from ..backend import jit_kernels
 
 def to_rotmat(angles, order, radians=True):
     if not radians:
@@ -25,9 +26,13 @@ def to_rotmat(angles, order, radians=True):
     Rs = [_euler_axis_to_rotmat(angles[..., i], order[i]) for i in range(3)]
     return np.matmul(np.matmul(Rs[0], Rs[1]), Rs[2])
 
-def to_quat(angles, order, radians=True):
+def to_quat(angles, order, radians=True, backend=None):
     if not radians:
         angles = np.deg2rad(angles)
+
+    jit = jit_kernels(backend)
+    if jit is not None:
+        return jit.euler_to_quat(np.asarray(angles), order)
     
     def _euler_axis_to_quat(angle, axis):
         zero = np.zeros_like(angle, dtype=np.float32)
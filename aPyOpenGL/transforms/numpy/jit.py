@@ -0,0 +1,230 @@
+import numpy as np
+from numba import njit
+
+from . import quat
+
+"""
+Numba kernels of the numba backend (see aPyOpenGL.transforms.backend).
+Each kernel loops over flattened rows and evaluates the same operations in the same order and precision as its numpy counterpart,
+so that the results are identical.
+Transcendental functions are left to numpy ufuncs between the loops, since numpy's SIMD implementations round differently from libm.
+Constants are passed in the dtype of the inputs, since numba would promote float32 arithmetic with Python floats to float64.
+"""
+DTYPES = (np.float32, np.float64)
+
+def supports(*dtypes):
+    return all(np.dtype(dtype) in DTYPES for dtype in dtypes)
+
+def _rows(x, shape, dtype):
+    # x broadcast to `shape` and flattened to (N, C), a view where possible
+    return np.broadcast_to(np.asarray(x, dtype=dtype), shape).reshape(-1, shape[-1])
+
+def _output(out, shape, dtype, *inputs):
+    res, target = quat._output(out, shape, dtype, *inputs)
+    if not res.flags.c_contiguous:
+        res, target = np.empty(shape, dtype=dtype), out
+    return res, target
+
+"""
+Row kernels
+"""
+@njit(cache=True, inline="always")
+def _qmul(r0, i0, j0, k0, r1, i1, j1, k1):
+    return (
+        r0*r1 - i0*i1 - j0*j1 - k0*k1,
+        r0*i1 + i0*r1 + j0*k1 - k0*j1,
+        r0*j1 - i0*k1 + j0*r1 + k0*i1,
+        r0*k1 + i0*j1 - j0*i1 + k0*r1,
+    )
+
+@njit(cache=True, inline="always")
+def _qmul_vec(w, x, y, z, vx, vy, vz):
+    # t = 2 * (u x v), v + w * t + u x t
+    tx, ty, tz = y*vz - z*vy, z*vx - x*vz, x*vy - y*vx
+    tx, ty, tz = tx + tx, ty + ty, tz + tz
+    return (
+        (vx + w*tx) + (y*tz - z*ty),
+        (vy + w*ty) + (z*tx - x*tz),
+        (vz + w*tz) + (x*ty - y*tx),
+    )
+
+@njit(cache=True)
+def _mul(q0, q1, out):
+    for n in range(out.shape[0]):
+        out[n, 0], out[n, 1], out[n, 2], out[n, 3] = _qmul(q0[n, 0], q0[n, 1], q0[n, 2], q0[n, 3], q1[n, 0], q1[n, 1], q1[n, 2], q1[n, 3])
+
+@njit(cache=True)
+def _mul_vec(q, v, out):
+    for n in range(out.shape[0]):
+        out[n, 0], out[n, 1], out[n, 2] = _qmul_vec(q[n, 0], q[n, 1], q[n, 2], q[n, 3], v[n, 0], v[n, 1], v[n, 2])
+
+@njit(cache=True)
+def _fk(local_quats, root_pos, pre_quats, pre_pos, parent_idx, global_quats, global_pos):
+    # (N, J, 4), (N, 3), (J, 4), (J, 3), (J,) -> (N, J, 4), (N, J, 3), where parent_idx[j] < j
+    p = pre_quats[0]
+    for n in range(global_quats.shape[0]):
+        l = local_quats[n, 0]
+        global_quats[n, 0, 0], global_quats[n, 0, 1], global_quats[n, 0, 2], global_quats[n, 0, 3] = _qmul(p[0], p[1], p[2], p[3], l[0], l[1], l[2], l[3])
+        global_pos[n, 0, 0], global_pos[n, 0, 1], global_pos[n, 0, 2] = root_pos[n, 0], root_pos[n, 1], root_pos[n, 2]
+
+        for j in range(1, global_quats.shape[1]):
+            g, gp = global_quats[n, parent_idx[j]], global_pos[n, parent_idx[j]]
+            q, l, o = pre_quats[j], local_quats[n, j], pre_pos[j]
+            r, i, jj, k = _qmul(g[0], g[1], g[2], g[3], q[0], q[1], q[2], q[3])
+            global_quats[n, j, 0], global_quats[n, j, 1], global_quats[n, j, 2], global_quats[n, j, 3] = _qmul(r, i, jj, k, l[0], l[1], l[2], l[3])
+            x, y, z = _qmul_vec(g[0], g[1], g[2], g[3], o[0], o[1], o[2])
+            global_pos[n, j, 0], global_pos[n, j, 1], global_pos[n, j, 2] = x + gp[0], y + gp[1], z + gp[2]
+
+@njit(cache=True)
+def _slerp_units(q_from, q_to, units, dot, zero, one, eps):
+    # unit quaternions with a positive dot product, and the clipped dot product
+    for n in range(dot.shape[0]):
+        a, b = q_from[n], q_to[n]
+
+        # numpy sums the squares from left to right
+        na = np.sqrt(a[0]*a[0] + a[1]*a[1] + a[2]*a[2] + a[3]*a[3]) + eps
+        nb = np.sqrt(b[0]*b[0] + b[1]*b[1] + b[2]*b[2] + b[3]*b[3]) + eps
+        a0, a1, a2, a3 = a[0] / na, a[1] / na, a[2] / na, a[3] / na
+        b0, b1, b2, b3 = b[0] / nb, b[1] / nb, b[2] / nb, b[3] / nb
+
+        d = a0*b0 + a1*b1 + a2*b2 + a3*b3
+        if d < zero:
+            b0, b1, b2, b3 = -b0, -b1, -b2, -b3
+        d = abs(d)
+
+        units[0, n, 0], units[0, n, 1], units[0, n, 2], units[0, n, 3] = a0, a1, a2, a3
+        units[1, n, 0], units[1, n, 1], units[1, n, 2], units[1, n, 3] = b0, b1, b2, b3
+        dot[n] = min(max(d, -one), one)
+
+@njit(cache=True)
+def _slerp_blend(units, dot, t, sin_omega, sin0, sin1, out, one, eps, linear_dot):
+    # sin(omega), sin((1 - t) * omega) and sin(t * omega) come from numpy
+    for n in range(out.shape[0]):
+        a, b = units[0, n], units[1, n]
+        if dot[n] > linear_dot:
+            t0, t1 = one - t[n], t[n]
+        else:
+            t0, t1 = sin0[n] / sin_omega[n], sin1[n] / sin_omega[n]
+
+        r, i, j, k = t0*a[0] + t1*b[0], t0*a[1] + t1*b[1], t0*a[2] + t1*b[2], t0*a[3] + t1*b[3]
+        norm = np.sqrt(r*r + i*i + j*j + k*k) + eps
+        out[n, 0], out[n, 1], out[n, 2], out[n, 3] = r / norm, i / norm, j / norm, k / norm
+
+@njit(cache=True)
+def _rotmat_to_quat(rotmat, out, zero, one, eps):
+    for n in range(out.shape[0]):
+        m = rotmat[n]
+
+        # the largest of 4*r*r, 4*i*i, 4*j*j, 4*k*k, and twice its absolute value
+        sq0 = one + m[0, 0] + m[1, 1] + m[2, 2]
+        sq1 = one + m[0, 0] - m[1, 1] - m[2, 2]
+        sq2 = one - m[0, 0] + m[1, 1] - m[2, 2]
+        sq3 = one - m[0, 0] - m[1, 1] + m[2, 2]
+        c, sq = 0, sq0
+        if sq1 > sq:
+            c, sq = 1, sq1
+        if sq2 > sq:
+            c, sq = 2, sq2
+        if sq3 > sq:
+            c, sq = 3, sq3
+        a = np.sqrt(max(sq, zero))
+        aa = a*a
+        div = a + a + eps
+
+        if c == 0:
+            r, i, j, k = aa, m[2, 1] - m[1, 2], m[0, 2] - m[2, 0], m[1, 0] - m[0, 1]
+        elif c == 1:
+            r, i, j, k = m[2, 1] - m[1, 2], aa, m[0, 1] + m[1, 0], m[0, 2] + m[2, 0]
+        elif c == 2:
+            r, i, j, k = m[0, 2] - m[2, 0], m[0, 1] + m[1, 0], aa, m[1, 2] + m[2, 1]
+        else:
+            r, i, j, k = m[1, 0] - m[0, 1], m[0, 2] + m[2, 0], m[1, 2] + m[2, 1], aa
+        r, i, j, k = r / div, i / div, j / div, k / div
+
+        norm = np.sqrt(r*r + i*i + j*j + k*k)
+        out[n, 0], out[n, 1], out[n, 2], out[n, 3] = r / norm, i / norm, j / norm, k / norm
+
+@njit(cache=True, inline="always")
+def _axis_quat(cos, sin, axis):
+    zero = np.float32(0.0)
+    if axis == 0:
+        return cos, sin, zero, zero
+    elif axis == 1:
+        return cos, zero, sin, zero
+    return cos, zero, zero, sin
+
+@njit(cache=True)
+def _euler_to_quat(cos, sin, axes, out):
+    # cos, sin: (N, 3) of the half angles
+    for n in range(out.shape[0]):
+        r0, i0, j0, k0 = _axis_quat(cos[n, 0], sin[n, 0], axes[0])
+        r1, i1, j1, k1 = _axis_quat(cos[n, 1], sin[n, 1], axes[1])
+        r2, i2, j2, k2 = _axis_quat(cos[n, 2], sin[n, 2], axes[2])
+        r, i, j, k = _qmul(r0, i0, j0, k0, r1, i1, j1, k1)
+        out[n, 0], out[n, 1], out[n, 2], out[n, 3] = _qmul(r, i, j, k, r2, i2, j2, k2)
+
+"""
+Wrappers with the broadcasting and `out` semantics of the numpy kernels
+"""
+def mul(q0, q1, out=None):
+    dtype = np.result_type(q0, q1)
+    shape = np.broadcast_shapes(q0.shape, q1.shape)
+    res, target = _output(out, shape, dtype, q0, q1)
+    _mul(_rows(q0, shape, dtype), _rows(q1, shape, dtype), res.reshape(-1, 4))
+    return quat._finish(res, target)
+
+def mul_vec(q, v, out=None):
+    dtype = np.result_type(q, v)
+    shape = np.broadcast_shapes(q.shape[:-1] + (3,), v.shape)
+    res, target = _output(out, shape, dtype, q, v)
+    _mul_vec(_rows(q, shape[:-1] + (4,), dtype), _rows(v, shape, dtype), res.reshape(-1, 3))
+    return quat._finish(res, target)
+
+def slerp(q_from, q_to, t):
+    dtype = q_from.dtype
+    t = np.asarray(t, dtype=dtype)
+    shape = np.broadcast_shapes(q_from.shape, q_to.shape, t.shape + (1,))
+    t = _rows(t[..., None], shape[:-1] + (1,), dtype)[:, 0]
+    one, eps = dtype.type(1.0), dtype.type(1e-8)
+
+    units = np.empty((2,) + t.shape + (4,), dtype=dtype)
+    dot = np.empty(t.shape, dtype=dtype)
+    _slerp_units(_rows(q_from, shape, dtype), _rows(q_to, shape, dtype), units, dot, dtype.type(0.0), one, eps)
+
+    omega = np.arccos(dot)
+    sin_omega = np.sin(omega)
+    sin0 = np.sin((1.0 - t) * omega)
+    sin1 = np.sin(np.multiply(t, omega, out=omega), out=omega)
+
+    res = np.empty(shape, dtype=dtype)
+    _slerp_blend(units, dot, t, sin_omega, sin0, sin1, res.reshape(-1, 4), one, eps, dtype.type(0.9999))
+    return res
+
+def fk(local_quats, root_pos, pre_quats, pre_pos, parent_idx, dtype):
+    batch_dims = np.broadcast_shapes(local_quats.shape[:-2], root_pos.shape[:-1])
+    noj = local_quats.shape[-2]
+    global_quats = np.empty(batch_dims + (noj, 4), dtype=dtype)
+    global_pos   = np.empty(batch_dims + (noj, 3), dtype=dtype)
+    local_quats = np.broadcast_to(np.asarray(local_quats, dtype=dtype), batch_dims + (noj, 4)).reshape(-1, noj, 4)
+    _fk(
+        local_quats, _rows(root_pos, batch_dims + (3,), dtype),
+        np.asarray(pre_quats, dtype=dtype), np.asarray(pre_pos, dtype=dtype), np.asarray(parent_idx, dtype=np.int64),
+        global_quats.reshape(-1, noj, 4), global_pos.reshape(-1, noj, 3)
+    )
+    return global_quats, global_pos
+
+def rotmat_to_quat(rotmat, out=None):
+    dtype = rotmat.dtype
+    batch_dim = rotmat.shape[:-2]
+    res, target = _output(out, batch_dim + (4,), dtype, rotmat)
+    _rotmat_to_quat(rotmat.reshape(-1, 3, 3), res.reshape(-1, 4), dtype.type(0.0), dtype.type(1.0), dtype.type(1e-8))
+    return quat._finish(res, target)
+
+def euler_to_quat(angles, order):
+    if any(axis not in "xyz" for axis in order):
+        raise ValueError(f"Invalid axis: {next(axis for axis in order if axis not in 'xyz')}")
+    axes = np.array(["xyz".index(axis) for axis in order], dtype=np.int64)
+    half = (angles / 2).reshape(-1, 3)
+    res = np.empty(angles.shape[:-1] + (4,), dtype=np.float32)
+    _euler_to_quat(np.cos(half, dtype=np.float32), np.sin(half, dtype=np.float32), axes, res.reshape(-1, 4))
+    return res
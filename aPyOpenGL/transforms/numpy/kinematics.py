@@ -0,0 +1,54 @@
+import numpy as np
+
+"""
+Level-parallel forward kinematics
+"""
+def depth_levels(parent_idx):
+    """
+    Groups non-root joints by their depth in the tree.
+    Assumes that every parent comes before its children, i.e. parent_idx[i] < i.
+
+    Args:
+        parent_idx: (J,) parent index of each joint, -1 for the root
+    Returns:
+        list of (joint indices, parent indices) for depth 1, 2, ...
+    """
+    parent_idx = np.asarray(parent_idx, dtype=np.int64)
+    depth = np.zeros(len(parent_idx), dtype=np.int64)
+    for i in range(1, len(parent_idx)):
+        if not 0 <= parent_idx[i] < i:
+            raise ValueError(f"Parent of joint {i} must come before it, but got {parent_idx[i]}")
+        depth[i] = depth[parent_idx[i]] + 1
+
+    levels = []
+    for d in range(1, depth.max(initial=0) + 1):
+        joints = np.nonzero(depth == d)[0]
+        levels.append((joints, parent_idx[joints]))
+    return levels
+
+def propagate(global_rots, global_pos, local_rots, pre_rots, pre_pos, levels, mul, mul_vec=None):
+    """
+    Fills global rotations (and positions) of the non-root joints in place, one tree depth at a time:
+        global_rots[i] = global_rots[parent] * pre_rots[i] * local_rots[i]
+        global_pos[i]  = global_rots[parent] * pre_pos[i] + global_pos[parent]
+
+    Args:
+        global_rots: (..., J, *R) output rotations with the root already filled
+        global_pos:  (..., J, 3) output positions with the root already filled, or None
+        local_rots:  (..., J, *R) local rotations
+        pre_rots:    (J, *R) pre-rotations
+        pre_pos:     (J, 3) local offsets, or None
+        levels:      output of depth_levels()
+        mul:         composition of two rotations in the representation R
+        mul_vec:     rotation of vectors in the representation R
+    """
+    rot_axis = -pre_rots.ndim
+    tail = (slice(None),) * (pre_rots.ndim - 1)
+
+    for joints, parents in levels:
+        parent_rots = np.take(global_rots, parents, axis=rot_axis)
+        global_rots[(Ellipsis, joints) + tail] = mul(mul(parent_rots, pre_rots[joints]), np.take(local_rots, joints, axis=rot_axis))
+        if global_pos is not None:
+            global_pos[..., joints, :] = mul_vec(parent_rots, pre_pos[joints]) + global_pos[..., parents, :]
+
+    return global_rots, global_pos
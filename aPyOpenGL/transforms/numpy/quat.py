@@ -1,30 +1,94 @@
 import numpy as np
 
-from . import rotmat, aaxis, euler, ortho6d, xform
+from . import rotmat, aaxis, euler, ortho6d, xform, kinematics
+from ..backend import jit_kernels
 
 """
 Quaternion operations
+Kernels write each component into an optional `out` buffer through chains of in-place ufuncs on strided views,
+so that they allocate a few component-sized scratch arrays instead of a temporary per term.
+`out` may be one of the inputs.
+Kernels with a `backend` argument run on the given backend, or on the global one if None (see aPyOpenGL.transforms.backend).
 """
-def mul(q0, q1):
-    r0, i0, j0, k0 = np.split(q0, 4, axis=-1)
-    r1, i1, j1, k1 = np.split(q1, 4, axis=-1)
-
-    res = np.concatenate([
-        r0*r1 - i0*i1 - j0*j1 - k0*k1,
-        r0*i1 + i0*r1 + j0*k1 - k0*j1,
-        r0*j1 - i0*k1 + j0*r1 + k0*i1,
-        r0*k1 + i0*j1 - j0*i1 + k0*r1
-    ], axis=-1)
-
-    return res
-
-def mul_vec(q, v):
-    t = 2.0 * np.cross(q[..., 1:], v, axis=-1)
-    res = v + q[..., 0:1] * t + np.cross(q[..., 1:], t, axis=-1)
-    return res
-
-def inv(q):
-    return np.concatenate([q[..., 0:1], -q[..., 1:]], axis=-1)
+def _output(out, shape, dtype, *inputs):
+    # buffer to compute into, and the buffer to copy the result into if `out` overlaps the inputs or has another precision
+    if out is None:
+        return np.empty(shape, dtype=dtype), None
+    if out.dtype != dtype or any(np.may_share_memory(out, x) for x in inputs):
+        return np.empty(shape, dtype=dtype), out
+    return out, None
+
+def _finish(res, target):
+    if target is None:
+        return res
+    target[...] = res
+    return target
+
+def _fma_chain(dst, tmp, terms):
+    # dst = a0*b0 (+|-) a1*b1 (+|-) ..., evaluated left to right
+    (a, b), rest = terms[0][1:], terms[1:]
+    np.multiply(a, b, out=dst)
+    for sign, a, b in rest:
+        np.multiply(a, b, out=tmp)
+        (np.add if sign > 0 else np.subtract)(dst, tmp, out=dst)
+    return dst
+
+def mul(q0, q1, out=None, backend=None):
+    """
+    Hamilton product q0 * q1. (..., 4)
+    """
+    q0, q1 = np.asarray(q0), np.asarray(q1)
+    jit = jit_kernels(backend)
+    if jit is not None and jit.supports(np.result_type(q0, q1)):
+        return jit.mul(q0, q1, out)
+
+    res, target = _output(out, np.broadcast_shapes(q0.shape, q1.shape), np.result_type(q0, q1), q0, q1)
+    r0, i0, j0, k0 = q0[..., 0], q0[..., 1], q0[..., 2], q0[..., 3]
+    r1, i1, j1, k1 = q1[..., 0], q1[..., 1], q1[..., 2], q1[..., 3]
+
+    tmp = np.empty(res.shape[:-1], dtype=res.dtype)
+    _fma_chain(res[..., 0], tmp, [(1, r0, r1), (-1, i0, i1), (-1, j0, j1), (-1, k0, k1)])
+    _fma_chain(res[..., 1], tmp, [(1, r0, i1), ( 1, i0, r1), ( 1, j0, k1), (-1, k0, j1)])
+    _fma_chain(res[..., 2], tmp, [(1, r0, j1), (-1, i0, k1), ( 1, j0, r1), ( 1, k0, i1)])
+    _fma_chain(res[..., 3], tmp, [(1, r0, k1), ( 1, i0, j1), (-1, j0, i1), ( 1, k0, r1)])
+    return _finish(res, target)
+
+def mul_vec(q, v, out=None, backend=None):
+    """
+    Rotation of vectors v by quaternions q. (..., 3)
+    v + 2w(u x v) + u x (2(u x v)), where q = (w, u)
+    """
+    q, v = np.asarray(q), np.asarray(v)
+    jit = jit_kernels(backend)
+    if jit is not None and jit.supports(np.result_type(q, v)):
+        return jit.mul_vec(q, v, out)
+
+    res, target = _output(out, np.broadcast_shapes(q.shape[:-1] + (3,), v.shape), np.result_type(q, v), q, v)
+    w, x, y, z = q[..., 0], q[..., 1], q[..., 2], q[..., 3]
+    vx, vy, vz = v[..., 0], v[..., 1], v[..., 2]
+
+    # t = 2 * (u x v)
+    tmp = np.empty(res.shape[:-1], dtype=res.dtype)
+    t = [np.empty(res.shape[:-1], dtype=res.dtype) for _ in range(3)] # 0-d arrays, not scalars, for a single vector
+    for tc, terms in zip(t, [[(1, y, vz), (-1, z, vy)], [(1, z, vx), (-1, x, vz)], [(1, x, vy), (-1, y, vx)]]):
+        _fma_chain(tc, tmp, terms)
+        np.multiply(tc, 2.0, out=tc)
+
+    # v + w * t + u x t
+    cross = np.empty_like(tmp)
+    for c, (vc, tc, terms) in enumerate(zip([vx, vy, vz], t, [[(1, y, t[2]), (-1, z, t[1])], [(1, z, t[0]), (-1, x, t[2])], [(1, x, t[1]), (-1, y, t[0])]])):
+        rc = res[..., c]
+        np.multiply(w, tc, out=rc)
+        np.add(vc, rc, out=rc)
+        rc += _fma_chain(cross, tmp, terms)
+    return _finish(res, target)
+
+def inv(q, out=None):
+    """
+    Inverse of unit quaternions, i.e. the conjugate. (..., 4)
+    """
+    q = np.asarray(q)
+    return np.multiply(q, np.array([1, -1, -1, -1], dtype=q.dtype), out=out)
 
 def identity():
     return np.array([1.0, 0.0, 0.0, 0.0], dtype=np.float32)
@@ -74,6 +138,41 @@ def interpolate(q_from, q_to, t):
     
     return q_interp
 
+def slerp(q_from, q_to, t, backend=None):
+    """
+    Element-wise spherical linear interpolation.
+    Args:
+        q_from: (..., 4)
+        q_to: (..., 4)
+        t: (...), broadcastable to the batch shape of the quaternions, or just a float
+    Returns:
+        interpolated quaternion (..., 4)
+    """
+    jit = jit_kernels(backend)
+    if jit is not None and q_from.dtype == q_to.dtype and jit.supports(q_from.dtype):
+        return jit.slerp(q_from, q_to, t)
+
+    t = np.asarray(t, dtype=q_from.dtype)[..., None] # (..., 1)
+
+    # ensure unit quaternions
+    q_from_ = q_from / (np.linalg.norm(q_from, axis=-1, keepdims=True) + 1e-8) # (..., 4)
+    q_to_   = q_to   / (np.linalg.norm(q_to,   axis=-1, keepdims=True) + 1e-8) # (..., 4)
+
+    # ensure positive dot product
+    dot = np.sum(q_from_ * q_to_, axis=-1, keepdims=True) # (..., 1)
+    q_to_ = np.where(dot < 0.0, -q_to_, q_to_)
+    dot = np.abs(dot)
+
+    # interpolation amounts, linear for nearly identical quaternions
+    linear = dot > 0.9999
+    omega = np.arccos(np.clip(dot, -1.0, 1.0)) # (..., 1)
+    sin_omega = np.where(linear, 1.0, np.sin(omega))
+    t0 = np.where(linear, 1.0 - t, np.sin((1.0 - t) * omega) / sin_omega)
+    t1 = np.where(linear, t, np.sin(t * omega) / sin_omega)
+
+    q_interp = t0 * q_from_ + t1 * q_to_
+    return q_interp / (np.linalg.norm(q_interp, axis=-1, keepdims=True) + 1e-8)
+
 def between_vecs(v_from, v_to):
     v_from_ = v_from / (np.linalg.norm(v_from, axis=-1, keepdims=True) + 1e-8) # (..., 3)
     v_to_   = v_to / (np.linalg.norm(v_to,   axis=-1, keepdims=True) + 1e-8)   # (..., 3)
@@ -87,28 +186,33 @@ def between_vecs(v_from, v_to):
     
     return np.concatenate([real[..., None], imag], axis=-1)
 
-def fk(local_quats, root_pos, skeleton):
+def fk(local_quats, root_pos, skeleton, backend=None):
     """
     Attributes:
         local_quats: (..., J, 4)
         root_pos: (..., 3), global root position
         skeleton: aPyOpenGL.agl.Skeleton
+        backend: "numpy", "numba", or None for the global backend
     """
-    pre_xforms = np.tile(skeleton.pre_xforms, local_quats.shape[:-2] + (1, 1, 1)) # (..., J, 4, 4)
-    pre_quats  = xform.to_quat(pre_xforms) # (..., J, 4)
-    pre_pos    = xform.to_translation(pre_xforms) # (..., J, 3)
-    pre_pos[..., 0, :] = root_pos
-
-    global_quats = [mul(pre_quats[..., 0, :], local_quats[..., 0, :])]
-    global_pos = [pre_pos[..., 0, :]]
-
-    for i in range(1, skeleton.num_joints):
-        parent_idx = skeleton.parent_idx[i]
-        global_quats.append(mul(mul(global_quats[parent_idx], pre_quats[..., i, :]), local_quats[..., i, :]))
-        global_pos.append(mul_vec(global_quats[parent_idx], pre_pos[..., i, :]) + global_pos[parent_idx])
-    
-    global_quats = np.stack(global_quats, axis=-2) # (..., J, 4)
-    global_pos = np.stack(global_pos, axis=-2) # (..., J, 3)
+    pre_quats = skeleton.pre_quats # (J, 4)
+    pre_pos   = skeleton.offsets # (J, 3)
+    quat_dtype = np.result_type(local_quats, pre_quats)
+    pos_dtype  = np.result_type(quat_dtype, root_pos, pre_pos)
+
+    # the numba kernel computes in a single precision
+    jit = jit_kernels(backend)
+    if jit is not None and quat_dtype == pos_dtype and jit.supports(quat_dtype):
+        return jit.fk(local_quats, root_pos, pre_quats, pre_pos, skeleton.parent_idx, quat_dtype)
+
+    # preallocated outputs
+    batch_dims   = np.broadcast_shapes(local_quats.shape[:-2], root_pos.shape[:-1])
+    global_quats = np.empty(batch_dims + local_quats.shape[-2:], dtype=quat_dtype) # (..., J, 4)
+    global_pos   = np.empty(batch_dims + pre_pos.shape, dtype=pos_dtype) # (..., J, 3)
+
+    # root and the other joints level by level
+    global_quats[..., 0, :] = mul(pre_quats[0], local_quats[..., 0, :])
+    global_pos[..., 0, :]   = root_pos
+    kinematics.propagate(global_quats, global_pos, local_quats, pre_quats, pre_pos, skeleton.depth_levels, mul, mul_vec)
 
     return global_quats, global_pos
 
@@ -136,22 +240,30 @@ def to_aaxis(quat):
 
     return axis * angle[..., None] # (..., 3)
 
-def to_rotmat(quat):
-    two_s = 2.0 / np.sum(quat * quat, axis=-1) # (...,)
+def to_rotmat(quat, out=None):
+    """
+    Rotation matrices of quaternions, which do not have to be normalized. (..., 3, 3)
+    """
+    quat = np.asarray(quat)
+    res, target = _output(out, quat.shape[:-1] + (3, 3), quat.dtype, quat)
     r, i, j, k = quat[..., 0], quat[..., 1], quat[..., 2], quat[..., 3]
 
-    rotmat = np.stack([
-        1.0 - two_s * (j*j + k*k),
-        two_s * (i*j - k*r),
-        two_s * (i*k + j*r),
-        two_s * (i*j + k*r),
-        1.0 - two_s * (i*i + k*k),
-        two_s * (j*k - i*r),
-        two_s * (i*k - j*r),
-        two_s * (j*k + i*r),
-        1.0 - two_s * (i*i + j*j)
-    ], axis=-1)
-    return rotmat.reshape(quat.shape[:-1] + (3, 3)) # (..., 3, 3)
+    tmp = np.empty(quat.shape[:-1], dtype=quat.dtype)
+    two_s = _fma_chain(np.empty_like(tmp), tmp, [(1, r, r), (1, i, i), (1, j, j), (1, k, k)])
+    np.divide(2.0, two_s, out=two_s)
+
+    # 1 - 2s * (a*a + b*b) on the diagonal, 2s * (a*b -+ c*d) off the diagonal
+    entries = {
+        (0, 0): [(1, j, j), ( 1, k, k)], (0, 1): [(1, i, j), (-1, k, r)], (0, 2): [(1, i, k), ( 1, j, r)],
+        (1, 0): [(1, i, j), ( 1, k, r)], (1, 1): [(1, i, i), ( 1, k, k)], (1, 2): [(1, j, k), (-1, i, r)],
+        (2, 0): [(1, i, k), (-1, j, r)], (2, 1): [(1, j, k), ( 1, i, r)], (2, 2): [(1, i, i), ( 1, j, j)],
+    }
+    for (row, col), terms in entries.items():
+        entry = _fma_chain(res[..., row, col], tmp, terms)
+        np.multiply(two_s, entry, out=entry)
+        if row == col:
+            np.subtract(1.0, entry, out=entry)
+    return _finish(res, target)
 
 def to_ortho6d(quat):
     return rotmat.to_ortho6d(to_rotmat(quat))
@@ -171,8 +283,8 @@ def from_aaxis(a):
 def from_euler(angles, order, radians=True):
     return euler.to_quat(angles, order, radians=radians)
 
-def from_rotmat(r):
-    return rotmat.to_quat(r)
+def from_rotmat(r, out=None):
+    return rotmat.to_quat(r, out=out)
 
 def from_ortho6d(r6d):
     return ortho6d.to_quat(r6d)
@@ -1,6 +1,7 @@
 import numpy as np
 
-from . import quat, aaxis, ortho6d, xform, euler
+from . import quat, aaxis, ortho6d, xform, euler, kinematics
+from ..backend import jit_kernels
 
 """
 Operations
@@ -18,24 +19,24 @@ def fk(local_rotmats, root_pos, skeleton):
         root_pos: (..., 3), global root position
         skeleton: aPyOpenGL.agl.Skeleton
     """
-    pre_xforms = np.tile(skeleton.pre_xforms, local_rotmats.shape[:-3] + (1, 1, 1)) # (..., J, 4, 4)
-    pre_rotmats = xform.to_rotmat(pre_xforms) # (..., J, 3, 3)
-    pre_pos     = xform.to_translation(pre_xforms) # (..., J, 3)
-    pre_pos[..., 0, :] = root_pos
-
-    global_rotmats = [np.matmul(pre_rotmats[..., 0, :, :], local_rotmats[..., 0, :, :])]
-    global_pos = [pre_pos[..., 0, :]]
-
-    for i in range(1, skeleton.num_joints):
-        parent_idx = skeleton.parent_idx[i]
-        global_rotmats.append(np.matmul(np.matmul(global_rotmats[parent_idx], pre_rotmats[..., i, :, :]), local_rotmats[..., i, :, :]))
-        global_pos.append(np.einsum("...ij,...j->...i", global_rotmats[parent_idx], pre_pos[..., i, :]) + global_pos[parent_idx])
-    
-    global_rotmats = np.stack(global_rotmats, axis=-3) # (..., J, 3, 3)
-    global_pos = np.stack(global_pos, axis=-2) # (..., J, 3)
+    pre_rotmats = skeleton.pre_rotmats # (J, 3, 3)
+    pre_pos     = skeleton.offsets # (J, 3)
+
+    # preallocated outputs
+    batch_dims     = np.broadcast_shapes(local_rotmats.shape[:-3], root_pos.shape[:-1])
+    global_rotmats = np.empty(batch_dims + local_rotmats.shape[-3:], dtype=np.result_type(local_rotmats, pre_rotmats)) # (..., J, 3, 3)
+    global_pos     = np.empty(batch_dims + pre_pos.shape, dtype=np.result_type(global_rotmats, root_pos, pre_pos)) # (..., J, 3)
+
+    # root and the other joints level by level
+    global_rotmats[..., 0, :, :] = np.matmul(pre_rotmats[0], local_rotmats[..., 0, :, :])
+    global_pos[..., 0, :]        = root_pos
+    kinematics.propagate(global_rotmats, global_pos, local_rotmats, pre_rotmats, pre_pos, skeleton.depth_levels, np.matmul, _mul_vec)
 
     return global_rotmats, global_pos
 
+def _mul_vec(r, v):
+    return np.einsum("...ij,...j->...i", r, v)
+
 def inv(r):
     return np.transpose(r, axes=(-2, -1))
 
@@ -45,39 +46,51 @@ Rotation matrix to other representation
 def to_aaxis(rotmat):
     return quat.to_aaxis(to_quat(rotmat))
 
-def to_quat(rotmat):
-    batch_dim = rotmat.shape[:-2]
-    rotmat_ = rotmat.reshape(batch_dim + (9,))
-    rotmat00, rotmat01, rotmat02, rotmat10, rotmat11, rotmat12, rotmat20, rotmat21, rotmat22 = rotmat_[..., 0], rotmat_[..., 1], rotmat_[..., 2], rotmat_[..., 3], rotmat_[..., 4], rotmat_[..., 5], rotmat_[..., 6], rotmat_[..., 7], rotmat_[..., 8]
-
-    def _to_positive_sqrt(x):
-        ret = np.zeros_like(x)
-        positive = x > 0
-        ret[positive] = np.sqrt(x[positive])
-        return ret
-
-    quat_square = np.stack([
-        (1.0 + rotmat00 + rotmat11 + rotmat22), # 4*r*r
-        (1.0 + rotmat00 - rotmat11 - rotmat22), # 4*i*i
-        (1.0 - rotmat00 + rotmat11 - rotmat22), # 4*j*j
-        (1.0 - rotmat00 - rotmat11 + rotmat22), # 4*k*k
-    ], axis=-1) # (..., 4)
-    quat_abs = _to_positive_sqrt(quat_square) # 2*|r|, 2*|i|, 2*|j|, 2*|k|
-    r, i, j, k = quat_abs[..., 0], quat_abs[..., 1], quat_abs[..., 2], quat_abs[..., 3]
-
-    quat_candidates = np.stack([
-        np.stack([r*r, rotmat21-rotmat12, rotmat02-rotmat20, rotmat10-rotmat01], axis=-1),
-        np.stack([rotmat21-rotmat12, i*i, rotmat01+rotmat10, rotmat02+rotmat20], axis=-1),
-        np.stack([rotmat02-rotmat20, rotmat01+rotmat10, j*j, rotmat12+rotmat21], axis=-1),
-        np.stack([rotmat10-rotmat01, rotmat02+rotmat20, rotmat12+rotmat21, k*k], axis=-1),
-    ], axis=-2) # (..., 4, 4)
-    quat_candidates = quat_candidates / (2 * quat_abs[..., None] + 1e-8)
+def to_quat(rotmat, out=None, backend=None):
+    """
+    Quaternions of rotation matrices. (..., 4)
+    Each quaternion is computed from its largest component, selected per matrix, and only the selected formula is evaluated.
+    """
+    rotmat = np.asarray(rotmat)
+    jit = jit_kernels(backend)
+    if jit is not None and jit.supports(rotmat.dtype):
+        return jit.rotmat_to_quat(rotmat, out)
 
+    batch_dim = rotmat.shape[:-2]
+    res, target = quat._output(out, batch_dim + (4,), rotmat.dtype, rotmat)
+    m00, m11, m22 = rotmat[..., 0, 0], rotmat[..., 1, 1], rotmat[..., 2, 2]
+
+    # 4*r*r, 4*i*i, 4*j*j, 4*k*k
+    quat_square = np.empty(batch_dim + (4,), dtype=rotmat.dtype)
+    for c, signs in enumerate([(1, 1, 1), (1, -1, -1), (-1, 1, -1), (-1, -1, 1)]):
+        sq = quat_square[..., c]
+        np.copyto(sq, 1.0)
+        for sign, m in zip(signs, (m00, m11, m22)):
+            (np.add if sign > 0 else np.subtract)(sq, m, out=sq)
     quat_idx = np.argmax(quat_square, axis=-1)
-    quat = np.take_along_axis(quat_candidates, quat_idx[..., None, None].repeat(4, axis=-1), axis=-2).squeeze(-2)
-    quat = quat / np.linalg.norm(quat, axis=-1, keepdims=True)
-
-    return quat.reshape(batch_dim + (4,))
+    quat_abs = np.sqrt(np.maximum(quat_square, 0, out=quat_square), out=quat_square) # 2*|r|, 2*|i|, 2*|j|, 2*|k|
+
+    # candidate of the largest component, divided by 4 times that component
+    for c in range(4):
+        mask = quat_idx == c
+        if not mask.any():
+            continue
+        m = rotmat[mask] # (M, 3, 3)
+        a = quat_abs[mask, c]
+        cands = [
+            [a*a, m[:, 2, 1] - m[:, 1, 2], m[:, 0, 2] - m[:, 2, 0], m[:, 1, 0] - m[:, 0, 1]],
+            [m[:, 2, 1] - m[:, 1, 2], a*a, m[:, 0, 1] + m[:, 1, 0], m[:, 0, 2] + m[:, 2, 0]],
+            [m[:, 0, 2] - m[:, 2, 0], m[:, 0, 1] + m[:, 1, 0], a*a, m[:, 1, 2] + m[:, 2, 1]],
+            [m[:, 1, 0] - m[:, 0, 1], m[:, 0, 2] + m[:, 2, 0], m[:, 1, 2] + m[:, 2, 1], a*a],
+        ][c]
+        res[mask] = np.stack(cands, axis=-1) / (2 * a[:, None] + 1e-8)
+
+    # normalize in place
+    tmp = np.empty(batch_dim, dtype=res.dtype)
+    norm = quat._fma_chain(np.empty_like(tmp), tmp, [(1, res[..., c], res[..., c]) for c in range(4)])
+    np.sqrt(norm, out=norm)
+    np.divide(res, norm[..., None], out=res)
+    return quat._finish(res, target)
 
 def to_ortho6d(rotmat):
     return np.concatenate([rotmat[..., 0, :], rotmat[..., 1, :]], axis=-1)
@@ -0,0 +1,38 @@
+import torch
+
+from ..numpy.kinematics import depth_levels
+
+"""
+Level-parallel forward kinematics
+"""
+def propagate(global_rots, global_pos, local_rots, pre_rots, pre_pos, levels, mul, mul_vec=None):
+    """
+    Fills global rotations (and positions) of the non-root joints in place, one tree depth at a time:
+        global_rots[i] = global_rots[parent] * pre_rots[i] * local_rots[i]
+        global_pos[i]  = global_rots[parent] * pre_pos[i] + global_pos[parent]
+
+    Args:
+        global_rots: (..., J, *R) output rotations with the root already filled
+        global_pos:  (..., J, 3) output positions with the root already filled, or None
+        local_rots:  (..., J, *R) local rotations
+        pre_rots:    (J, *R) pre-rotations
+        pre_pos:     (J, 3) local offsets, or None
+        levels:      output of depth_levels(), indices as numpy arrays or as tensors on the device of global_rots
+        mul:         composition of two rotations in the representation R
+        mul_vec:     rotation of vectors in the representation R
+    """
+    rot_dim = global_rots.dim() - pre_rots.dim()
+    tail = (slice(None),) * (pre_rots.dim() - 1)
+
+    for joints, parents in levels:
+        if not isinstance(joints, torch.Tensor):
+            joints  = torch.tensor(joints, device=global_rots.device)
+            parents = torch.tensor(parents, device=global_rots.device)
+
+        parent_rots = torch.index_select(global_rots, rot_dim, parents)
+        global_rots[(Ellipsis, joints) + tail] = mul(mul(parent_rots, pre_rots[joints]), torch.index_select(local_rots, local_rots.dim() - pre_rots.dim(), joints))
+        if global_pos is not None:
+            offsets = pre_pos[joints].expand(global_pos.shape[:-2] + (len(joints), 3)) # torch.cross does not broadcast
+            global_pos[..., joints, :] = mul_vec(parent_rots, offsets) + torch.index_select(global_pos, global_pos.dim() - 2, parents)
+
+    return global_rots, global_pos
@@ -1,6 +1,6 @@
 import torch
 import torch.nn.functional as F
-from . import rotmat, aaxis, euler, ortho6d, xform
+from . import rotmat, aaxis, euler, ortho6d, xform, kinematics
 
 """
 Quaternion operations
@@ -76,6 +76,37 @@ def interpolate(q_from, q_to, t):
     
     return q_interp
 
+def slerp(q_from, q_to, t):
+    """
+    Element-wise spherical linear interpolation.
+    Args:
+        q_from: (..., 4)
+        q_to: (..., 4)
+        t: (...), broadcastable to the batch shape of the quaternions, or just a float
+    Returns:
+        interpolated quaternion (..., 4)
+    """
+    t = torch.as_tensor(t, dtype=q_from.dtype, device=q_from.device)[..., None] # (..., 1)
+
+    # ensure unit quaternions
+    q_from_ = F.normalize(q_from, dim=-1, eps=1e-8) # (..., 4)
+    q_to_   = F.normalize(q_to,   dim=-1, eps=1e-8) # (..., 4)
+
+    # ensure positive dot product
+    dot = torch.sum(q_from_ * q_to_, dim=-1, keepdim=True) # (..., 1)
+    q_to_ = torch.where(dot < 0.0, -q_to_, q_to_)
+    dot = torch.abs(dot)
+
+    # interpolation amounts, linear for nearly identical quaternions
+    linear = dot > 0.9999
+    omega = torch.acos(torch.clamp(dot, -1.0, 1.0 - 1e-7)) # (..., 1), clamped for finite gradients
+    sin_omega = torch.where(linear, torch.ones_like(omega), torch.sin(omega))
+    t0 = torch.where(linear, 1.0 - t, torch.sin((1.0 - t) * omega) / sin_omega)
+    t1 = torch.where(linear, t, torch.sin(t * omega) / sin_omega)
+
+    q_interp = t0 * q_from_ + t1 * q_to_
+    return F.normalize(q_interp, dim=-1, eps=1e-8)
+
 def between_vecs(v_from, v_to):
     v_from_ = F.normalize(v_from, dim=-1, eps=1e-8) # (..., 3)
     v_to_   = F.normalize(v_to,   dim=-1, eps=1e-8) # (..., 3)
@@ -96,22 +127,18 @@ def fk(local_quats, root_pos, skeleton):
         root_pos: (..., 3), global root position
         skeleton: aPyOpenGL.agl.Skeleton
     """
-    pre_xforms = torch.from_numpy(skeleton.pre_xforms).to(local_quats.device)
-    pre_xforms = torch.tile(pre_xforms, local_quats.shape[:-2] + (1, 1, 1)) # (..., J, 4, 4)
-    pre_quats  = xform.to_quat(pre_xforms)
-    pre_pos    = xform.to_translation(pre_xforms)
-    pre_pos[..., 0, :] = root_pos
-
-    global_quats = [mul(pre_quats[..., 0, :], local_quats[..., 0, :])]
-    global_pos = [pre_pos[..., 0, :]]
-
-    for i in range(1, skeleton.num_joints):
-        parent_idx = skeleton.parent_idx[i]
-        global_quats.append(mul(mul(global_quats[parent_idx], pre_quats[..., i, :]), local_quats[..., i, :]))
-        global_pos.append(mul_vec(global_quats[parent_idx], pre_pos[..., i, :]) + global_pos[parent_idx])
-    
-    global_quats = torch.stack(global_quats, dim=-2) # (..., J, 4)
-    global_pos = torch.stack(global_pos, dim=-2) # (..., J, 3)
+    pre_quats = torch.tensor(skeleton.pre_quats, dtype=local_quats.dtype, device=local_quats.device) # (J, 4)
+    pre_pos   = torch.tensor(skeleton.offsets, dtype=local_quats.dtype, device=local_quats.device) # (J, 3)
+
+    # preallocated outputs
+    batch_dims   = torch.broadcast_shapes(local_quats.shape[:-2], root_pos.shape[:-1])
+    global_quats = local_quats.new_empty(batch_dims + local_quats.shape[-2:]) # (..., J, 4)
+    global_pos   = local_quats.new_empty(batch_dims + pre_pos.shape) # (..., J, 3)
+
+    # root and the other joints level by level
+    global_quats[..., 0, :] = mul(pre_quats[0], local_quats[..., 0, :])
+    global_pos[..., 0, :]   = root_pos
+    kinematics.propagate(global_quats, global_pos, local_quats, pre_quats, pre_pos, skeleton.kinematic_tables.torch_depth_levels(local_quats.device), mul, mul_vec)
 
     return global_quats, global_pos
 
@@ -1,7 +1,7 @@
 import torch
 import torch.nn.functional as F
 
-from . import quat, aaxis, ortho6d, xform, euler
+from . import quat, aaxis, ortho6d, xform, euler, kinematics
 
 """
 Operations
@@ -19,24 +19,23 @@ def fk(local_rotmats, root_pos, skeleton):
         root_pos: (..., 3), global root position
         skeleton: aPyOpenGL.agl.Skeleton
     """
-    pre_xforms  = torch.from_numpy(skeleton.pre_xforms).to(local_rotmats.device) # (J, 4, 4)
-    pre_xforms  = torch.tile(pre_xforms, local_rotmats.shape[:-3] + (1, 1, 1))
-    pre_rotmats = xform.to_rotmat(pre_xforms) # (..., J, 3, 3)
-    pre_pos     = xform.to_translation(pre_xforms) # (..., J, 3)
-    pre_pos[..., 0, :]  = root_pos
-
-    global_rotmats = [torch.matmul(pre_rotmats[..., 0, :, :], local_rotmats[..., 0, :, :])]
-    global_pos = [pre_pos[..., 0, :]]
-
-    for i in range(1, skeleton.num_joints):
-        parent_idx = skeleton.parent_idx[i]
-        global_rotmats.append(torch.matmul(torch.matmul(global_rotmats[parent_idx], pre_rotmats[..., i, :, :]), local_rotmats[..., i, :, :]))
-        global_pos.append(torch.einsum("...ij,...j->...i", global_rotmats[parent_idx], pre_pos[..., i, :]) + global_pos[parent_idx])
-    
-    global_rotmats = torch.stack(global_rotmats, dim=-3) # (..., J, 3, 3)
-    global_pos = torch.stack(global_pos, dim=-2) # (..., J, 3)
+    pre_rotmats = torch.tensor(skeleton.pre_rotmats, dtype=local_rotmats.dtype, device=local_rotmats.device) # (J, 3, 3)
+    pre_pos     = torch.tensor(skeleton.offsets, dtype=local_rotmats.dtype, device=local_rotmats.device) # (J, 3)
+
+    # preallocated outputs
+    batch_dims     = torch.broadcast_shapes(local_rotmats.shape[:-3], root_pos.shape[:-1])
+    global_rotmats = local_rotmats.new_empty(batch_dims + local_rotmats.shape[-3:]) # (..., J, 3, 3)
+    global_pos     = local_rotmats.new_empty(batch_dims + pre_pos.shape) # (..., J, 3)
+
+    # root and the other joints level by level
+    global_rotmats[..., 0, :, :] = torch.matmul(pre_rotmats[0], local_rotmats[..., 0, :, :])
+    global_pos[..., 0, :]        = root_pos
+    kinematics.propagate(global_rotmats, global_pos, local_rotmats, pre_rotmats, pre_pos, skeleton.kinematic_tables.torch_depth_levels(local_rotmats.device), torch.matmul, _mul_vec)
 
     return global_rotmats, global_pos
+
+def _mul_vec(r, v):
+    return torch.einsum("...ij,...j->...i", r, v)
 """
 Rotations to other representations
 """
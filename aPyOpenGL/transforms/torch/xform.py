@@ -1,6 +1,6 @@
 import torch
 
-from . import rotmat, quat, aaxis
+from . import rotmat, quat, aaxis, kinematics
 
 """
 Operations
@@ -21,15 +21,19 @@ def fk(local_xforms, root_pos, skeleton):
         root_pos: (..., 3), global root position
         skeleton: aPyOpenGL.agl.Skeleton
     """
-    pre_xforms = torch.from_numpy(skeleton.pre_xforms).to(local_xforms.device) # (J, 4, 4)
-    pre_xforms = torch.tile(pre_xforms, local_xforms.shape[:-3] + (1, 1, 1)) # (..., J, 4, 4)
-    pre_xforms[..., 0, :3, 3] = root_pos
-    
-    global_xforms = [pre_xforms[..., 0, :, :] @ local_xforms[..., 0, :, :]]
-    for i in range(1, skeleton.num_joints):
-        global_xforms.append(global_xforms[skeleton.parent_idx[i]] @ pre_xforms[..., i, :, :] @ local_xforms[..., i, :, :])
-    
-    global_xforms = torch.stack(global_xforms, dim=-3) # (..., J, 4, 4)
+    pre_xforms = torch.tensor(skeleton.pre_xforms, dtype=local_xforms.dtype, device=local_xforms.device) # (J, 4, 4)
+
+    # root pre-transformation with the global root position
+    batch_dims = torch.broadcast_shapes(local_xforms.shape[:-3], root_pos.shape[:-1])
+    root_xform = local_xforms.new_empty(batch_dims + (4, 4))
+    root_xform[...] = pre_xforms[0]
+    root_xform[..., :3, 3] = root_pos
+
+    # root and the other joints level by level
+    global_xforms = local_xforms.new_empty(batch_dims + local_xforms.shape[-3:]) # (..., J, 4, 4)
+    global_xforms[..., 0, :, :] = root_xform @ local_xforms[..., 0, :, :]
+    kinematics.propagate(global_xforms, None, local_xforms, pre_xforms, None, skeleton.kinematic_tables.torch_depth_levels(local_xforms.device), torch.matmul)
+
     return global_xforms
 
 """
@@ -0,0 +1,117 @@
+import sys
+import time
+import numpy as np
+
+from aPyOpenGL import agl
+from aPyOpenGL.transforms import n_quat, n_rotmat, n_euler, backend
+
+"""
+Cross-check of the numba backend against the numpy kernels, and their times on (T, J) batches.
+Results must match bit for bit, in float32 and float64, with broadcasting and `out` buffers.
+Exits with an error if numba is not installed or if a kernel does not match.
+
+    python benchmarks/numba_backend.py
+"""
+def ulps(a, b):
+    # distance in units in the last place, 0 for equal values including signed zeros
+    a, b = np.asarray(a), np.asarray(b)
+    itype = np.int32 if a.dtype == np.float32 else np.int64
+    ia, ib = a.view(itype).astype(np.int64), b.view(itype).astype(np.int64)
+    sign = np.iinfo(itype).min
+    ia = np.where(ia < 0, sign - ia, ia)
+    ib = np.where(ib < 0, sign - ib, ib)
+    return int(np.abs(ia - ib).max(initial=0))
+
+def timeit(func, *args, repeat=5, **kwargs):
+    func(*args, **kwargs)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(*args, **kwargs)
+    return (time.perf_counter() - start) / repeat
+
+def random_quats(rng, shape, dtype):
+    q = rng.normal(size=shape + (4,))
+    return (q / np.linalg.norm(q, axis=-1, keepdims=True)).astype(dtype)
+
+
+def cases(rng, skeleton, local_quats, root_pos, dtype):
+    shape = local_quats.shape[:-1]
+    q0, q1 = random_quats(rng, shape, dtype), random_quats(rng, shape, dtype)
+    q1[:, :3] = q0[:, :3] # nearly identical and opposite quaternions take the linear branch of slerp
+    q1[:, 3:6] = -q0[:, 3:6]
+    v = rng.normal(size=shape + (3,)).astype(dtype)
+    t = rng.uniform(size=shape).astype(dtype)
+    r = n_quat.to_rotmat(q0)
+    angles = rng.uniform(-np.pi, np.pi, size=shape + (3,)).astype(dtype)
+    lq, rp = local_quats.astype(dtype), root_pos.astype(dtype)
+
+    # name, function, arguments
+    return [
+        ("mul",               n_quat.mul,       (q0, q1)),
+        ("mul broadcast",     n_quat.mul,       (q0[:1, :1], q1[:, 0])),
+        ("mul_vec",           n_quat.mul_vec,   (q0, v)),
+        ("mul_vec broadcast", n_quat.mul_vec,   (q0, v[0])),
+        ("fk",                n_quat.fk,        (lq, rp, skeleton)),
+        ("rotmat.to_quat",    n_rotmat.to_quat, (r,)),
+        ("euler.to_quat",     n_euler.to_quat,  (angles, "zyx")),
+        ("slerp",             n_quat.slerp,     (q0, q1, t)),
+        ("slerp scalar t",    n_quat.slerp,     (q0, q1, 0.3)),
+    ]
+
+
+def check_out(rng, dtype):
+    # `out` aliasing an input, and a non-contiguous `out`
+    q0, q1 = random_quats(rng, (100, 52), dtype), random_quats(rng, (100, 52), dtype)
+    want = n_quat.mul(q0, q1, backend="numpy")
+    got = q0.copy()
+    n_quat.mul(got, q1, out=got, backend="numba")
+    assert ulps(want, got) == 0, "mul, out aliasing an input"
+
+    want = n_rotmat.to_quat(n_quat.to_rotmat(q0), backend="numpy")
+    got = np.zeros((100, 52, 8), dtype=dtype)[..., ::2]
+    n_rotmat.to_quat(n_quat.to_rotmat(q0), out=got, backend="numba")
+    assert ulps(want, got) == 0, "rotmat.to_quat, non-contiguous out"
+
+
+def main():
+    if backend.jit_kernels("numba") is None:
+        sys.exit("numba is not installed")
+
+    motion = agl.BVH("aPyOpenGL/agl/data/bvh/ybot_capoeira.bvh").motion()
+    reps = 20
+    local_quats = np.tile(motion.local_quats, (reps, 1, 1))
+    root_pos = np.tile(motion.root_pos, (reps, 1))
+
+    rng = np.random.default_rng(0)
+    failed = []
+    for dtype in (np.float32, np.float64):
+        print(f"(T, J) = {local_quats.shape[:-1]}, {np.dtype(dtype).name}")
+        print(f"{'kernel':18s} | {'ulps':>5s} | {'numpy':>10s} | {'numba':>10s}")
+        for name, func, args in cases(rng, motion.skeleton, local_quats, root_pos, dtype):
+            want, got = func(*args, backend="numpy"), func(*args, backend="numba")
+            want, got = (want, got) if isinstance(want, tuple) else ((want,), (got,))
+            diff = max(ulps(w, g) for w, g in zip(want, got))
+            assert all(w.dtype == g.dtype and w.shape == g.shape for w, g in zip(want, got)), name
+            if diff > 0:
+                failed.append(f"{name} ({np.dtype(dtype).name}): {diff} ulps")
+
+            sec = [timeit(func, *args, backend=b) for b in backend.BACKENDS]
+            print(f"{name:18s} | {diff:5d} | " + " | ".join(f"{s * 1e3:7.2f} ms" for s in sec))
+        check_out(rng, dtype)
+        print()
+
+    # global selection
+    with backend.use_backend("numba"):
+        assert backend.get_backend() == "numba"
+        a = n_quat.fk(motion.local_quats, motion.root_pos, motion.skeleton)
+    assert backend.get_backend() == "numpy"
+    b = n_quat.fk(motion.local_quats, motion.root_pos, motion.skeleton)
+    assert all(ulps(x, y) == 0 for x, y in zip(a, b)), "fk with the global backend"
+
+    if failed:
+        sys.exit("Mismatches:\n" + "\n".join(failed))
+    print("All kernels match.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+import time
+import tracemalloc
+import numpy as np
+
+from aPyOpenGL.transforms import n_quat
+
+"""
+Peak memory and time of the quaternion kernels on (T, J) batches,
+against the previous implementations that split the inputs and stack or concatenate new component arrays.
+numpy reports its allocations to tracemalloc, so the peak is the extra memory allocated during a call.
+
+    python benchmarks/quat_kernels.py
+"""
+def split_mul(q0, q1):
+    r0, i0, j0, k0 = np.split(q0, 4, axis=-1)
+    r1, i1, j1, k1 = np.split(q1, 4, axis=-1)
+    return np.concatenate([
+        r0*r1 - i0*i1 - j0*j1 - k0*k1,
+        r0*i1 + i0*r1 + j0*k1 - k0*j1,
+        r0*j1 - i0*k1 + j0*r1 + k0*i1,
+        r0*k1 + i0*j1 - j0*i1 + k0*r1
+    ], axis=-1)
+
+def cross_mul_vec(q, v):
+    t = 2.0 * np.cross(q[..., 1:], v, axis=-1)
+    return v + q[..., 0:1] * t + np.cross(q[..., 1:], t, axis=-1)
+
+def concat_inv(q):
+    return np.concatenate([q[..., 0:1], -q[..., 1:]], axis=-1)
+
+def stack_to_rotmat(quat):
+    two_s = 2.0 / np.sum(quat * quat, axis=-1)
+    r, i, j, k = quat[..., 0], quat[..., 1], quat[..., 2], quat[..., 3]
+    rotmat = np.stack([
+        1.0 - two_s * (j*j + k*k), two_s * (i*j - k*r), two_s * (i*k + j*r),
+        two_s * (i*j + k*r), 1.0 - two_s * (i*i + k*k), two_s * (j*k - i*r),
+        two_s * (i*k - j*r), two_s * (j*k + i*r), 1.0 - two_s * (i*i + j*j)
+    ], axis=-1)
+    return rotmat.reshape(quat.shape[:-1] + (3, 3))
+
+def stack_from_rotmat(rotmat):
+    m = rotmat.reshape(rotmat.shape[:-2] + (9,))
+    m00, m01, m02, m10, m11, m12, m20, m21, m22 = [m[..., i] for i in range(9)]
+    quat_square = np.stack([1.0 + m00 + m11 + m22, 1.0 + m00 - m11 - m22, 1.0 - m00 + m11 - m22, 1.0 - m00 - m11 + m22], axis=-1)
+    quat_abs = np.where(quat_square > 0, np.sqrt(np.maximum(quat_square, 0)), 0)
+    r, i, j, k = quat_abs[..., 0], quat_abs[..., 1], quat_abs[..., 2], quat_abs[..., 3]
+    cands = np.stack([
+        np.stack([r*r, m21-m12, m02-m20, m10-m01], axis=-1),
+        np.stack([m21-m12, i*i, m01+m10, m02+m20], axis=-1),
+        np.stack([m02-m20, m01+m10, j*j, m12+m21], axis=-1),
+        np.stack([m10-m01, m02+m20, m12+m21, k*k], axis=-1),
+    ], axis=-2) / (2 * quat_abs[..., None] + 1e-8)
+    idx = np.argmax(quat_square, axis=-1)
+    quat = np.take_along_axis(cands, idx[..., None, None].repeat(4, axis=-1), axis=-2).squeeze(-2)
+    return quat / np.linalg.norm(quat, axis=-1, keepdims=True)
+
+
+def measure(func, *args, repeat=5, **kwargs):
+    func(*args, **kwargs)
+    tracemalloc.start()
+    func(*args, **kwargs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(*args, **kwargs)
+    return peak, (time.perf_counter() - start) / repeat
+
+
+def main(num_frames=10000, num_joints=52):
+    rng = np.random.default_rng(0)
+    shape = (num_frames, num_joints)
+    q0 = rng.normal(size=shape + (4,)).astype(np.float32)
+    q0 /= np.linalg.norm(q0, axis=-1, keepdims=True)
+    q1 = rng.normal(size=shape + (4,)).astype(np.float32)
+    v  = rng.normal(size=shape + (3,)).astype(np.float32)
+    r  = n_quat.to_rotmat(q0)
+    out4, out3, out33 = np.empty_like(q0), np.empty_like(v), np.empty_like(r)
+
+    cases = [
+        ("mul",         split_mul,         n_quat.mul,         (q0, q1), out4),
+        ("mul_vec",     cross_mul_vec,     n_quat.mul_vec,     (q0, v),  out3),
+        ("inv",         concat_inv,        n_quat.inv,         (q0,),    out4),
+        ("to_rotmat",   stack_to_rotmat,   n_quat.to_rotmat,   (q1,),    out33),
+        ("from_rotmat", stack_from_rotmat, n_quat.from_rotmat, (r,),     out4),
+    ]
+
+    mb = 1024 * 1024
+    print(f"(T, J) = {shape}, float32, output size {q0.nbytes / mb:.1f} MB per (T, J, 4)")
+    print(f"{'kernel':12s} | {'previous':>20s} | {'fused':>20s} | {'fused, out=':>20s}")
+    for name, previous, fused, args, out in cases:
+        assert np.allclose(previous(*args), fused(*args), atol=1e-6), name
+        row = [measure(previous, *args), measure(fused, *args), measure(fused, *args, out=out)]
+        print(f"{name:12s} | " + " | ".join(f"{peak / mb:7.1f} MB {sec * 1e3:7.2f} ms" for peak, sec in row))
+
+
+if __name__ == "__main__":
+    main()
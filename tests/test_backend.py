@@ -0,0 +1,126 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from aPyOpenGL import agl
+from aPyOpenGL.transforms import n_quat, n_rotmat, n_euler, backend
+from aPyOpenGL.transforms import numpy as transforms_numpy
+
+"""
+Cross-check of the numba backend against the numpy kernels, which must match bit for bit.
+The numba tests are skipped if numba is not installed.
+"""
+BVH_PATH = Path(__file__).resolve().parents[1] / "aPyOpenGL" / "agl" / "data" / "bvh" / "ybot_capoeira.bvh"
+DTYPES = [np.float32, np.float64]
+
+@pytest.fixture(scope="module")
+def numba():
+    return pytest.importorskip("numba")
+
+@pytest.fixture(scope="module")
+def motion():
+    return agl.BVH(str(BVH_PATH)).motion()
+
+def _random_quats(rng, shape, dtype):
+    q = rng.normal(size=shape + (4,))
+    return (q / np.linalg.norm(q, axis=-1, keepdims=True)).astype(dtype)
+
+def _assert_same(want, got):
+    want, got = (want, got) if isinstance(want, tuple) else ((want,), (got,))
+    for w, g in zip(want, got):
+        assert w.dtype == g.dtype and w.shape == g.shape
+        np.testing.assert_array_equal(w, g)
+
+
+@pytest.mark.parametrize("dtype", DTYPES)
+def test_mul(numba, dtype):
+    rng = np.random.default_rng(0)
+    q0, q1 = _random_quats(rng, (50, 52), dtype), _random_quats(rng, (50, 52), dtype)
+    for args in [(q0, q1), (q0[:1, :1], q1[:, 0:1]), (q0[0, 0], q1[0, 0])]:
+        _assert_same(n_quat.mul(*args, backend="numpy"), n_quat.mul(*args, backend="numba"))
+
+
+@pytest.mark.parametrize("dtype", DTYPES)
+def test_mul_vec(numba, dtype):
+    rng = np.random.default_rng(0)
+    q, v = _random_quats(rng, (50, 52), dtype), rng.normal(size=(50, 52, 3)).astype(dtype)
+    for args in [(q, v), (q, v[0]), (q[0, 0], v), (q[0, 0], v[0, 0])]:
+        _assert_same(n_quat.mul_vec(*args, backend="numpy"), n_quat.mul_vec(*args, backend="numba"))
+
+
+@pytest.mark.parametrize("dtype", DTYPES)
+def test_fk(numba, motion, dtype):
+    local_quats, root_pos = motion.local_quats.astype(dtype), motion.root_pos.astype(dtype)
+    want = n_quat.fk(local_quats, root_pos, motion.skeleton, backend="numpy")
+    got = n_quat.fk(local_quats, root_pos, motion.skeleton, backend="numba")
+    _assert_same(want, got)
+
+    with backend.use_backend("numba"):
+        _assert_same(want, n_quat.fk(local_quats, root_pos, motion.skeleton))
+    assert backend.get_backend() == "numpy"
+
+
+@pytest.mark.parametrize("dtype", DTYPES)
+def test_to_rotmat_to_quat(numba, dtype):
+    # rotation matrices from quat.to_rotmat, including the 180 degree rotations of each branch of rotmat.to_quat
+    rng = np.random.default_rng(0)
+    q = _random_quats(rng, (50, 52), dtype)
+    q[0, :4] = np.eye(4, dtype=dtype)
+    rotmat = n_quat.to_rotmat(q)
+    _assert_same(n_rotmat.to_quat(rotmat, backend="numpy"), n_rotmat.to_quat(rotmat, backend="numba"))
+
+
+@pytest.mark.parametrize("dtype", DTYPES)
+def test_out(numba, dtype):
+    rng = np.random.default_rng(0)
+    q0, q1 = _random_quats(rng, (50, 52), dtype), _random_quats(rng, (50, 52), dtype)
+    v = rng.normal(size=(50, 52, 3)).astype(dtype)
+
+    # out aliasing an input
+    want = n_quat.mul(q0, q1, backend="numpy")
+    got = q0.copy()
+    assert n_quat.mul(got, q1, out=got, backend="numba") is got
+    _assert_same(want, got)
+
+    want = n_quat.mul_vec(q0, v, backend="numpy")
+    got = v.copy()
+    assert n_quat.mul_vec(q0, got, out=got, backend="numba") is got
+    _assert_same(want, got)
+
+    # non-contiguous out
+    rotmat = n_quat.to_rotmat(q0)
+    want = n_rotmat.to_quat(rotmat, backend="numpy")
+    got = np.zeros((50, 52, 8), dtype=dtype)[..., ::2]
+    n_rotmat.to_quat(rotmat, out=got, backend="numba")
+    _assert_same(want, got)
+
+
+@pytest.mark.parametrize("dtype", DTYPES)
+def test_slerp_euler(numba, dtype):
+    rng = np.random.default_rng(0)
+    q0, q1 = _random_quats(rng, (50, 52), dtype), _random_quats(rng, (50, 52), dtype)
+    q1[:, :3] = q0[:, :3] # nearly identical and opposite quaternions take the linear branch of slerp
+    q1[:, 3:6] = -q0[:, 3:6]
+    t = rng.uniform(size=(50, 52)).astype(dtype)
+    for args in [(q0, q1, t), (q0, q1, 0.3)]:
+        _assert_same(n_quat.slerp(*args, backend="numpy"), n_quat.slerp(*args, backend="numba"))
+
+    angles = rng.uniform(-np.pi, np.pi, size=(50, 52, 3)).astype(dtype)
+    _assert_same(n_euler.to_quat(angles, "zyx", backend="numpy"), n_euler.to_quat(angles, "zyx", backend="numba"))
+
+
+def test_fallback(monkeypatch):
+    # without numba, the numba backend warns once and uses the numpy kernels
+    monkeypatch.setattr(backend, "_jit", None)
+    monkeypatch.setitem(sys.modules, "numba", None)
+    monkeypatch.setitem(sys.modules, "aPyOpenGL.transforms.numpy.jit", None)
+    monkeypatch.delattr(transforms_numpy, "jit", raising=False)
+
+    with pytest.warns(RuntimeWarning, match="numba"):
+        assert backend.jit_kernels("numba") is None
+    assert backend.jit_kernels("numba") is None
+
+    q = _random_quats(np.random.default_rng(0), (10,), np.float32)
+    _assert_same(n_quat.mul(q, q, backend="numpy"), n_quat.mul(q, q, backend="numba"))
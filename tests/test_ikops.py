@@ -0,0 +1,147 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+import torch
+
+from aPyOpenGL import agl
+from aPyOpenGL.ops import ikops
+from aPyOpenGL.transforms import n_quat, n_aaxis
+
+"""
+Convergence of the iterative multi-effector IK on the capoeira clip.
+Targets are the effector positions after random rotations of the arms and legs, so they are reachable
+with the spine and the root unchanged, but every solver also moves the spine shared by the effectors.
+"""
+BVH_PATH = Path(__file__).resolve().parents[1] / "aPyOpenGL" / "agl" / "data" / "bvh" / "ybot_capoeira.bvh"
+EFFECTORS = ["LeftHand", "RightHand", "LeftFoot", "RightFoot"]
+LIMBS = ["LeftArm", "LeftForeArm", "RightArm", "RightForeArm", "LeftUpLeg", "LeftLeg", "RightUpLeg", "RightLeg"]
+
+@pytest.fixture(scope="module")
+def motion():
+    return agl.BVH(str(BVH_PATH)).motion()
+
+@pytest.fixture(scope="module")
+def mutable_skeleton():
+    # the Skeleton built by the parser, not the FrozenSkeleton of its motion
+    return agl.BVH(str(BVH_PATH)).skeleton
+
+@pytest.fixture(scope="module")
+def targets(motion):
+    skeleton = motion.skeleton
+    limbs = [skeleton.idx_by_name[name] for name in LIMBS]
+    rng = np.random.default_rng(0)
+
+    local_quats = motion.local_quats.copy()
+    aaxis = rng.normal(scale=0.2, size=(motion.num_frames, len(limbs), 3))
+    local_quats[:, limbs] = n_quat.mul(local_quats[:, limbs], n_aaxis.to_quat(aaxis).astype(np.float32))
+    _, global_pos = n_quat.fk(local_quats, motion.root_pos, skeleton)
+    return global_pos[:, [skeleton.idx_by_name[name] for name in EFFECTORS]]
+
+def _errors(motion, global_pos, targets):
+    # (T,) largest distance of the effectors from their targets
+    eff_idx = [motion.skeleton.idx_by_name[name] for name in EFFECTORS]
+    return np.linalg.norm(global_pos[:, eff_idx] - targets, axis=-1).max(-1)
+
+
+@pytest.mark.parametrize("method", ["fabrik", "jacobian"])
+def test_solve_ik_multi_effector(motion, targets, method):
+    _, global_pos = n_quat.fk(motion.local_quats, motion.root_pos, motion.skeleton)
+    start = _errors(motion, global_pos, targets)
+
+    local_quats = motion.local_quats.copy()
+    _, global_pos = ikops.solve_ik(local_quats, motion.root_pos, motion.skeleton, EFFECTORS, targets, method, iterations=100, tol=1e-3)
+    end = _errors(motion, global_pos, targets)
+
+    assert np.all(end <= start)
+    assert end.max() < 2e-3
+
+
+def test_solve_ik_ccd_multi_effector(motion, targets):
+    # CCD converges slowly with shared ancestors, but no pose moves away from its targets
+    _, global_pos = n_quat.fk(motion.local_quats, motion.root_pos, motion.skeleton)
+    start = _errors(motion, global_pos, targets)
+
+    local_quats = motion.local_quats.copy()
+    _, global_pos = ikops.solve_ik(local_quats, motion.root_pos, motion.skeleton, EFFECTORS, targets, "ccd", iterations=100, tol=1e-3)
+    end = _errors(motion, global_pos, targets)
+
+    assert np.all(end <= start)
+    assert np.median(end) < 2e-3
+
+
+def test_solve_ik_fabrik_each_iteration(motion, targets):
+    # the largest error over all poses must not grow from one iteration to the next
+    frames = slice(100, 120)
+    local_quats, root_pos = motion.local_quats[frames].copy(), motion.root_pos[frames]
+    prev = np.inf
+    for _ in range(20):
+        _, global_pos = ikops.solve_ik(local_quats, root_pos, motion.skeleton, EFFECTORS, targets[frames], "fabrik", iterations=1, tol=0)
+        error = _errors(motion, global_pos, targets[frames]).max()
+        assert error <= prev + 1e-6
+        prev = error
+
+
+def test_solve_ik_fabrik_torch(motion, targets):
+    frames = slice(100, 120)
+    local_quats = torch.tensor(motion.local_quats[frames])
+    root_pos = torch.tensor(motion.root_pos[frames])
+    _, global_pos = ikops.solve_ik(local_quats, root_pos, motion.skeleton, EFFECTORS, torch.tensor(targets[frames]), "fabrik", iterations=50, tol=1e-3)
+    assert _errors(motion, global_pos.numpy(), targets[frames]).max() < 2e-3
+
+
+def test_two_bone_ik_mutable_skeleton(motion, targets, mutable_skeleton):
+    frames, effectors = slice(100, 120), ["LeftHand", "RightFoot"]
+    limb_targets = targets[frames][:, [EFFECTORS.index(name) for name in effectors]]
+    want, got = motion.local_quats[frames].copy(), motion.local_quats[frames].copy()
+    _, want_pos = ikops.two_bone_ik(want, motion.root_pos[frames], motion.skeleton, effectors, limb_targets)
+    _, got_pos = ikops.two_bone_ik(got, motion.root_pos[frames], mutable_skeleton, effectors, limb_targets)
+    np.testing.assert_array_equal(want, got)
+    np.testing.assert_array_equal(want_pos, got_pos)
+
+
+@pytest.mark.parametrize("method", ikops.IK_METHODS)
+def test_solve_ik_mutable_skeleton(motion, targets, mutable_skeleton, method):
+    frames = slice(100, 120)
+    want, got = motion.local_quats[frames].copy(), motion.local_quats[frames].copy()
+    _, want_pos = ikops.solve_ik(want, motion.root_pos[frames], motion.skeleton, EFFECTORS, targets[frames], method, iterations=5)
+    _, got_pos = ikops.solve_ik(got, motion.root_pos[frames], mutable_skeleton, EFFECTORS, targets[frames], method, iterations=5)
+    np.testing.assert_array_equal(want, got)
+    np.testing.assert_array_equal(want_pos, got_pos)
+
+
+@pytest.fixture(scope="module")
+def noisy_targets(motion):
+    # current positions of five effectors moved by 10 cm noise, some out of reach
+    effectors = ["LeftFoot", "RightFoot", "LeftHand", "RightHand", "Head"]
+    _, global_pos = n_quat.fk(motion.local_quats, motion.root_pos, motion.skeleton)
+    eff_pos = global_pos[:, [motion.skeleton.idx_by_name[name] for name in effectors]]
+    return effectors, (eff_pos + np.random.default_rng(0).normal(scale=0.1, size=eff_pos.shape)).astype(np.float32)
+
+
+@pytest.mark.parametrize("method", ikops.IK_METHODS)
+@pytest.mark.parametrize("iterations", [5, 20])
+def test_solve_ik_unreachable(motion, noisy_targets, method, iterations):
+    # no pose ends farther from its targets than it started, in the largest or the summed squared distance
+    effectors, targets = noisy_targets
+    eff_idx = [motion.skeleton.idx_by_name[name] for name in effectors]
+    _, global_pos = n_quat.fk(motion.local_quats, motion.root_pos, motion.skeleton)
+    start = np.linalg.norm(global_pos[:, eff_idx] - targets, axis=-1)
+
+    local_quats = motion.local_quats.copy()
+    _, global_pos = ikops.solve_ik(local_quats, motion.root_pos, motion.skeleton, effectors, targets, method, iterations=iterations)
+    end = np.linalg.norm(global_pos[:, eff_idx] - targets, axis=-1)
+
+    assert np.all(end.max(-1) <= start.max(-1) + 1e-5)
+    assert np.all((end ** 2).sum(-1) <= (start ** 2).sum(-1) + 1e-5)
+
+
+def test_solve_ik_unreachable_torch(motion, noisy_targets):
+    # the accepted steps of the least squares are the same in torch as in numpy
+    effectors, targets = noisy_targets
+    eff_idx = [motion.skeleton.idx_by_name[name] for name in effectors]
+    _, want = ikops.solve_ik(motion.local_quats.copy(), motion.root_pos, motion.skeleton, effectors, targets, "jacobian")
+    _, got = ikops.solve_ik(torch.tensor(motion.local_quats), torch.tensor(motion.root_pos), motion.skeleton, effectors, torch.tensor(targets), "jacobian")
+    want = np.linalg.norm(want[:, eff_idx] - targets, axis=-1)
+    got = np.linalg.norm(got.numpy()[:, eff_idx] - targets, axis=-1)
+    assert np.abs(want - got).max() < 1e-2